@@ -0,0 +1,79 @@
+"""Measures the local cold start of every stage Lambda.
+
+Each stage is imported in a fresh interpreter, as in a new Lambda container. The benchmark
+reports the module import time, the time to create the clients used on the fast path
+(describing an existing job), and which heavy packages were loaded by the import:
+
+    python code/workflow/benchmarks/bench_cold_start.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+STAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "implementations", "autopilot")
+
+# stage module -> clients used when the stage only checks on an existing job
+STAGES = {
+    "bp_init_stage": ["s3"],
+    "bp_automl_stage": ["s3", "sagemaker"],
+    "bp_model_registration_stage": ["sagemaker"],
+    "bp_error_analysis_stage": ["sagemaker"],
+    "bp_bias_analysis_stage": ["sagemaker"],
+    "bp_xai_analysis_stage": ["sagemaker"]
+}
+
+HEAVY = ["boto3", "sagemaker", "pandas", "numpy"]
+
+PROBE = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import {stage}
+imported = perf_counter()
+from bp_clients import get_client
+for service in {services}:
+    get_client(service)
+initialized = perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "init_ms": (initialized - imported) * 1000,
+    "loaded": sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy}))
+}}))
+"""
+
+def cold_start(stage, services) :
+
+    # clients need a region and credentials to be created, but no API call is made
+    env = dict(os.environ)
+    env.setdefault("AWS_REGION", "us-east-1")
+    env.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    env.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+    proc = subprocess.run([sys.executable, "-c", PROBE.format(stage=stage, services=services, heavy=HEAVY)],
+                          cwd=STAGE_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode :
+        raise Exception(f"Failed to load {stage}:\n{proc.stderr[-2000:]}")
+
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main() :
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'stage':<30}{'import(ms)':>12}{'clients(ms)':>13}{'total(ms)':>11}  heavy packages loaded")
+    for stage, services in STAGES.items() :
+
+        runs = [cold_start(stage, services) for _ in range(args.repeat)]
+        import_ms = statistics.median(r["import_ms"] for r in runs)
+        init_ms = statistics.median(r["init_ms"] for r in runs)
+        loaded = ", ".join(runs[0]["loaded"]) if runs[0]["loaded"] else "-"
+
+        print(f"{stage:<30}{import_ms:>12.1f}{init_ms:>13.1f}{import_ms + init_ms:>11.1f}  {loaded}")
+
+if __name__ == "__main__" :
+    main()
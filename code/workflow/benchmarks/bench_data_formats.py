@@ -0,0 +1,180 @@
+"""Storage, bytes read and time of every reader of the prepped data, with CSV and with Parquet.
+
+Writes a synthetic wide dataset in both formats, as the shards Data Wrangler would write for
+output_format "csv" and "parquet", to an in-memory object store, then runs the readers of the
+stages and of the notebook over each (best of --repeat runs):
+
+    schema              read_header, the columns of the dataset in the AutoML stage
+    bias_merge          create_merged_dataset of the Bias Analysis stage
+    xai_baseline        build_baseline of the XAI Analysis stage
+    transform_input     convert_to_csv, Parquet only: Batch Transform sends the model CSV
+    stage_projected     read_frames of --projected columns, as the stages read a few columns
+    notebook_full       ShardReader.read_merged_df of the whole dataset
+    notebook_projected  ShardReader.read_merged_df of --projected columns
+
+    python code/workflow/benchmarks/bench_data_formats.py --rows 200000 --columns 200
+    python code/workflow/benchmarks/bench_data_formats.py --rows 50000 --columns 20 --cases schema bias_merge
+"""
+import argparse
+import io
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "..")
+sys.path.insert(0, os.path.join(ROOT, "code", "workflow", "implementations", "autopilot"))
+sys.path.insert(0, os.path.join(ROOT, "notebook"))
+
+import bp_bias_analysis_stage
+from bp_baseline import build_baseline
+from bp_s3_data import convert_to_csv, read_frames, read_header
+from utils.shards import ShardReader
+
+CASES = ["schema", "bias_merge", "xai_baseline", "transform_input", "stage_projected", "notebook_full", "notebook_projected"]
+FORMATS = ["csv", "parquet"]
+BUCKET = "bench"
+TARGET = "target"
+
+class LocalObjectStore() :
+
+    ## The S3 calls of the readers and of S3MultipartWriter, over objects held in memory.
+    ## Counts the bytes of every GET, ranged or not.
+    def __init__(self) :
+        self.objects = {}
+        self.uploads = {}
+        self.bytes_read = 0
+
+    def get_paginator(self, op) :
+        return self
+
+    def paginate(self, Bucket, Prefix="", PaginationConfig=None) :
+        yield {"Contents": [{"Key": k, "Size": len(v)} for k, v in sorted(self.objects.items()) if k.startswith(Prefix)]}
+
+    def get_object(self, Bucket, Key, Range=None) :
+
+        data = self.objects[Key]
+        if Range :
+            start, end = (int(v) for v in Range[len("bytes="):].split("-"))
+            data = data[start:end + 1]
+        self.bytes_read += len(data)
+        return {"Body": io.BytesIO(data)}
+
+    def create_multipart_upload(self, Bucket, Key) :
+
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = []
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Body, Bucket, Key, PartNumber, UploadId) :
+
+        self.uploads[UploadId].append(Body)
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload) :
+        self.objects[Key] = b"".join(self.uploads.pop(UploadId))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId) :
+        self.uploads.pop(UploadId, None)
+
+    def delete_prefix(self, prefix) :
+        for key in [k for k in self.objects if k.startswith(prefix)] :
+            del self.objects[key]
+
+def make_dataset(rows, columns, categorical, seed) :
+
+    ## Continuous and integer-valued numeric features, such as counts and encoded flags,
+    ## categorical features of a few levels, and a binary target in the last column.
+    rng = np.random.default_rng(seed)
+    n_categorical = int(columns * categorical)
+    data = {}
+    for i in range(columns - n_categorical) :
+        data[f"num_{i}"] = rng.normal(0, 100, rows).round(2) if i % 2 else rng.integers(0, 100, rows)
+    for i in range(n_categorical) :
+        levels = np.array([f"level_{j}" for j in range(rng.integers(3, 20))])
+        data[f"cat_{i}"] = levels[rng.integers(0, len(levels), rows)]
+    data[TARGET] = rng.integers(0, 2, rows)
+
+    return pd.DataFrame(data)
+
+def write_shards(store, df, shards) :
+
+    for data_format in FORMATS :
+        for n, idx in enumerate(np.array_split(np.arange(len(df)), shards)) :
+            buffer = io.BytesIO()
+            if data_format == "parquet" :
+                df.iloc[idx].to_parquet(buffer, index=False)
+            else :
+                df.iloc[idx].to_csv(buffer, index=False)
+            store.objects[f"prepped/{data_format}/part-{n:05d}.{data_format}"] = buffer.getvalue()
+
+def get_case(store, case, data_format, projected) :
+
+    data_uri = f"s3://{BUCKET}/prepped/{data_format}/"
+    prefix = f"prepped/{data_format}/"
+
+    if case == "schema" :
+        return lambda : read_header(store, data_uri, data_format=data_format)
+    if case == "bias_merge" :
+        return lambda : bp_bias_analysis_stage.create_merged_dataset(data_uri, f"s3://{BUCKET}/merged", TARGET, data_format)
+    if case == "xai_baseline" :
+        return lambda : build_baseline(store, data_uri, TARGET, 10, data_format=data_format)
+    if case == "transform_input" :
+        return lambda : convert_to_csv(store, data_uri, f"s3://{BUCKET}/transform-input", data_format) if data_format != "csv" else None
+    if case == "stage_projected" :
+        return lambda : sum(len(df) for df in read_frames(store, data_uri, data_format, columns=projected))
+    if case == "notebook_full" :
+        return lambda : ShardReader(store, verbose=False).read_merged_df(BUCKET, prefix, data_format=data_format)
+    if case == "notebook_projected" :
+        return lambda : ShardReader(store, verbose=False).read_merged_df(BUCKET, prefix, data_format=data_format, columns=projected)
+
+def measure(store, fn, repeat) :
+
+    times = []
+    for _ in range(repeat) :
+        store.delete_prefix("merged")
+        store.delete_prefix("transform-input")
+        store.bytes_read = 0
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+
+    return min(times), store.bytes_read
+
+def main() :
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=100)
+    parser.add_argument("--categorical", type=float, default=0.2, help="fraction of categorical columns")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--projected", type=int, default=2, help="columns read by the projected cases, with the target")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    store = LocalObjectStore()
+    bp_bias_analysis_stage.s3 = store
+
+    df = make_dataset(args.rows, args.columns, args.categorical, args.seed)
+    write_shards(store, df, args.shards)
+    projected = df.columns[:args.projected].to_list() + [TARGET]
+    del df
+
+    sizes = {f: sum(len(v) for k, v in store.objects.items() if k.startswith(f"prepped/{f}/")) for f in FORMATS}
+    print(f"{args.rows} rows x {args.columns + 1} columns in {args.shards} shards: "
+          f"CSV {sizes['csv'] / 2**20:.1f} MB, Parquet {sizes['parquet'] / 2**20:.1f} MB "
+          f"({sizes['csv'] / sizes['parquet']:.1f}x smaller)\n")
+
+    print(f"{'case':<20}{'CSV s':>10}{'CSV MB read':>13}{'Parquet s':>11}{'Parquet MB read':>17}{'speedup':>9}")
+    for case in args.cases :
+        results = {f: measure(store, get_case(store, case, f, projected), args.repeat) for f in FORMATS}
+        (csv_s, csv_read), (pq_s, pq_read) = results["csv"], results["parquet"]
+        speedup = f"{csv_s / pq_s:>8.1f}x" if case != "transform_input" and pq_s > 0 else f"{'-':>9}"
+        print(f"{case:<20}{csv_s:>10.3f}{csv_read / 2**20:>13.2f}{pq_s:>11.3f}{pq_read / 2**20:>17.2f}{speedup}")
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,157 @@
+"""Counts SageMaker API calls per completed job for the Evaluate stage polling policies.
+
+Simulates concurrent blueprint runs against a fake SageMaker client on a virtual clock,
+so the benchmark runs in seconds and needs no AWS account:
+
+    python code/workflow/benchmarks/bench_job_tracker.py --blueprints 50
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "implementations", "autopilot"))
+
+from bp_job_tracker import DEFAULT_MONITOR_CONFIG, TERMINAL_STATUSES, JobTracker
+
+class VirtualClock() :
+
+    def __init__(self) :
+        self.now = 0.0
+
+    def __call__(self) :
+        return self.now
+
+class FakeSageMakerClient() :
+
+    def __init__(self, clock) :
+        self.clock = clock
+        self.calls = Counter()
+        self.jobs = {}
+
+    def add_job(self, job_type, name, duration) :
+        self.jobs[name] = {"type": job_type, "created": self.clock(), "duration": duration}
+
+    def _status(self, name) :
+        job = self.jobs[name]
+        return "Completed" if self.clock() >= job["created"] + job["duration"] else "InProgress"
+
+    def _describe(self, op, job_type, name_arg, status_key, name) :
+        self.calls[op] += 1
+        if name not in self.jobs or self.jobs[name]["type"] != job_type :
+            raise Exception(f"Could not find job {name}.")
+        return {name_arg: name, status_key: self._status(name)}
+
+    def _list(self, op, job_type, name_arg, status_key, summaries_key, NameContains="", SortBy=None,
+              SortOrder="Descending", MaxResults=10, NextToken=None) :
+        self.calls[op] += 1
+        names = [n for n, j in self.jobs.items() if j["type"] == job_type and NameContains in n]
+        names.sort(key=lambda n: self.jobs[n]["created"], reverse=(SortOrder == "Descending"))
+        start = int(NextToken) if NextToken else 0
+        page = names[start:start+MaxResults]
+        resp = {summaries_key: [{name_arg: n, status_key: self._status(n)} for n in page]}
+        if start + MaxResults < len(names) :
+            resp["NextToken"] = str(start + MaxResults)
+        return resp
+
+    def describe_processing_job(self, ProcessingJobName) :
+        return self._describe("DescribeProcessingJob", "processing", "ProcessingJobName",
+                              "ProcessingJobStatus", ProcessingJobName)
+
+    def describe_transform_job(self, TransformJobName) :
+        return self._describe("DescribeTransformJob", "transform", "TransformJobName",
+                              "TransformJobStatus", TransformJobName)
+
+    def list_processing_jobs(self, **kwargs) :
+        return self._list("ListProcessingJobs", "processing", "ProcessingJobName",
+                          "ProcessingJobStatus", "ProcessingJobSummaries", **kwargs)
+
+    def list_transform_jobs(self, **kwargs) :
+        return self._list("ListTransformJobs", "transform", "TransformJobName",
+                          "TransformJobStatus", "TransformJobSummaries", **kwargs)
+
+# (stage, job type, base job name, mean duration in seconds)
+STAGES = [
+    ("error-analysis", "transform", "bp-error-analysis", 600),
+    ("bias-analysis", "processing", "bp-clarify-bias", 900),
+    ("xai-analysis", "processing", "bp-clarify-shap", 900)
+]
+
+def legacy_schedule(polls) :
+    ## Original behavior: describe every 60s inside a 300s Lambda, raise TaskTimedOut after
+    ## the fourth describe, and get retried by Step Functions 300s later.
+    return 300 if polls % 4 == 3 else 60
+
+def simulate(policy, n_blueprints, seed) :
+
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    client = FakeSageMakerClient(clock)
+    monitor_config = dict(DEFAULT_MONITOR_CONFIG)
+    trackers = {stage: JobTracker(client, clock=clock, rand=rng.random) for stage, _, _, _ in STAGES}
+
+    events = []
+    for b in range(n_blueprints) :
+        start = rng.uniform(0, 600)
+        for stage, job_type, base_name, mean in STAGES :
+            duration = max(60, rng.gauss(mean, mean / 3))
+            heapq.heappush(events, (start, f"{base_name}-{b:04d}", stage, job_type, base_name, duration, None))
+
+    created, lambda_seconds, latencies = {}, 0.0, []
+    while events :
+
+        t, name, stage, job_type, base_name, duration, prior = heapq.heappop(events)
+        clock.now = t
+        if name not in created :
+            client.add_job(job_type, name, duration)
+            created[name] = t
+
+        if policy == "tracker" :
+            results = trackers[stage].check(job_type, name, monitor_config, prior, base_name)
+            delay = results["poll_interval"]
+        else :
+            describe = client.describe_transform_job if job_type == "transform" else client.describe_processing_job
+            key = "TransformJobName" if job_type == "transform" else "ProcessingJobName"
+            status_key = "TransformJobStatus" if job_type == "transform" else "ProcessingJobStatus"
+            polls = prior["polls"] + 1 if prior else 0
+            results = {"status": describe(**{key: name})[status_key], "polls": polls}
+            delay = 60 if policy == "fixed-60" else legacy_schedule(polls)
+
+        if results["status"] in TERMINAL_STATUSES :
+            latencies.append(t - (created[name] + duration))
+            continue
+
+        # the legacy policy sleeps inside the Lambda while the other policies return immediately
+        lambda_seconds += 60 if policy == "legacy" and delay == 60 else 0.1
+        heapq.heappush(events, (t + delay, name, stage, job_type, base_name, duration, results))
+
+    total_calls = sum(client.calls.values())
+    return {
+        "policy": policy,
+        "jobs": len(latencies),
+        "api_calls": total_calls,
+        "calls_per_job": total_calls / len(latencies),
+        "mean_latency": sum(latencies) / len(latencies),
+        "max_latency": max(latencies),
+        "lambda_seconds": lambda_seconds,
+        "calls": dict(client.calls)
+    }
+
+def main() :
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blueprints", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'policy':<10}{'jobs':>6}{'api calls':>11}{'calls/job':>11}{'mean lat(s)':>13}{'max lat(s)':>12}{'lambda(s)':>11}")
+    for policy in ("legacy", "fixed-60", "tracker") :
+        r = simulate(policy, args.blueprints, args.seed)
+        print(f"{r['policy']:<10}{r['jobs']:>6}{r['api_calls']:>11}{r['calls_per_job']:>11.2f}"
+              f"{r['mean_latency']:>13.1f}{r['max_latency']:>12.1f}{r['lambda_seconds']:>11.0f}")
+        print(f"{'':<10}{r['calls']}")
+
+if __name__ == "__main__" :
+    main()
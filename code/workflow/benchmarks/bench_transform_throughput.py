@@ -0,0 +1,190 @@
+"""Records/sec of the Error Analysis Batch Transform settings against a local inference server.
+
+The server stands in for the Autopilot inference pipeline: every request pays a fixed
+overhead, for the HTTP hops between the pipeline's containers, plus a cost per record, and
+at most --workers requests are served at a time, one per vCPU. The client splits the dataset
+the way Batch Transform does with the given strategy, payload limit and concurrency, and
+compares the settings of transform-config before tuning (SingleRecord, one request at a time)
+with the settings the stage plans for the data:
+
+    python code/workflow/benchmarks/bench_transform_throughput.py --rows 5000
+    python code/workflow/benchmarks/bench_transform_throughput.py --rows 20000 --request-overhead-ms 5 --columns 50
+"""
+import argparse
+import http.client
+import io
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "implementations", "autopilot"))
+
+from bp_transform_tuning import get_instance_vcpus, measure_rows, plan_transform
+
+class InferenceHandler(BaseHTTPRequestHandler) :
+
+    # keep-alive connections, as between the Batch Transform agent and the container. The
+    # response is buffered and flushed once: a body written after its headers would wait for
+    # the client's delayed ACK on every request.
+    protocol_version = "HTTP/1.1"
+    wbufsize = 1024 * 1024
+
+    def log_message(self, *args) :
+        pass
+
+    def _reply(self, code, body=b"") :
+        self.send_response(code)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) :
+        self._reply(200 if self.path == "/ping" else 404)
+
+    def do_POST(self) :
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server.workers :
+            lines = body.decode("utf-8").splitlines()
+            sleep(server.request_overhead + server.record_cost * len(lines))
+            # a score per record, so the response grows with the mini-batch like the real one
+            scores = [f"{(hash(line) % 1000) / 1000:.3f}" for line in lines]
+        self._reply(200, ("\n".join(scores) + "\n").encode("utf-8"))
+
+def start_server(workers, request_overhead, record_cost) :
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), InferenceHandler)
+    server.daemon_threads = True
+    server.workers = threading.BoundedSemaphore(workers)
+    server.request_overhead = request_overhead
+    server.record_cost = record_cost
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+class LocalObjectStore() :
+
+    ## The S3 calls measure_rows makes, over objects held in memory.
+    def __init__(self, objects) :
+        self.objects = objects
+
+    def get_paginator(self, op) :
+        return self
+
+    def paginate(self, Bucket, Prefix="") :
+        yield {"Contents": [{"Key": k, "Size": len(v)} for k, v in sorted(self.objects.items()) if k.startswith(Prefix)]}
+
+    def get_object(self, Bucket, Key, Range=None) :
+
+        data = self.objects[Key]
+        if Range :
+            start, end = (int(v) for v in Range[len("bytes="):].split("-"))
+            data = data[start:end + 1]
+        return {"Body": io.BytesIO(data)}
+
+def make_shards(rows, columns, shards, seed) :
+
+    rand = random.Random(seed)
+    header = ",".join([f"f{i}" for i in range(columns)] + ["target"])
+    objects = {}
+    for n in range(shards) :
+        lines = [header]
+        for _ in range(rows // shards) :
+            lines.append(",".join([f"{rand.gauss(0, 100):.4f}" for _ in range(columns)] + [str(rand.randint(0, 1))]))
+        objects[f"data/part-{n:05d}.csv"] = ("\n".join(lines) + "\n").encode("utf-8")
+
+    return objects
+
+def mini_batches(data, strategy, max_payload) :
+
+    ## Records of an object, without its header, batched the way Batch Transform splits lines.
+    records = data.split(b"\n")[1:]
+    records = [r for r in records if r]
+    if strategy == "SingleRecord" :
+        return [r + b"\n" for r in records]
+
+    limit = max_payload * 2**20
+    batches, batch, size = [], [], 0
+    for r in records :
+        if batch and size + len(r) + 1 > limit :
+            batches.append(b"\n".join(batch) + b"\n")
+            batch, size = [], 0
+        batch.append(r)
+        size += len(r) + 1
+    if batch :
+        batches.append(b"\n".join(batch) + b"\n")
+
+    return batches
+
+def transform(port, objects, strategy, max_payload, max_concurrent) :
+
+    batches = [b for data in objects.values() for b in mini_batches(data, strategy, max_payload)]
+    local = threading.local()
+
+    def invoke(batch) :
+        if not hasattr(local, "conn") :
+            local.conn = http.client.HTTPConnection("127.0.0.1", port)
+        local.conn.request("POST", "/invocations", body=batch, headers={"Content-Type": "text/csv"})
+        response = local.conn.getresponse()
+        return response.read().count(b"\n")
+
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool :
+        records = sum(pool.map(invoke, batches))
+    seconds = perf_counter() - started
+
+    return {"requests": len(batches), "records": records, "seconds": seconds, "records_per_sec": records / seconds}
+
+def main() :
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--instance-type", default="ml.m5.xlarge")
+    parser.add_argument("--workers", type=int, help="requests served at a time, defaults to the instance's vCPUs")
+    parser.add_argument("--request-overhead-ms", type=float, default=2.0)
+    parser.add_argument("--record-us", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    objects = make_shards(args.rows, args.columns, args.shards, args.seed)
+    xform_params = {"strategy": "auto", "split_type": "Line", "instance_type": args.instance_type, "instance_count": 1}
+    plan = plan_transform(measure_rows(LocalObjectStore(objects), "s3://bench/data"), xform_params)
+
+    workers = args.workers if args.workers else get_instance_vcpus(args.instance_type)
+    server = start_server(workers, args.request_overhead_ms / 1000, args.record_us / 1e6)
+    port = server.server_address[1]
+
+    print(f"{args.rows} rows of {plan['row_bytes']:.0f} bytes in {args.shards} shards, "
+          f"{workers} inference workers, {args.request_overhead_ms}ms per request + {args.record_us}us per record")
+    print(f"planned: {plan['strategy']}, MaxPayloadInMB={plan['max_payload']}, "
+          f"MaxConcurrentTransforms={plan['max_concurrent_transforms']}\n")
+
+    cases = [
+        ("SingleRecord, untuned", "SingleRecord", 6, 1),
+        ("SingleRecord, concurrent", "SingleRecord", plan["max_payload"], plan["max_concurrent_transforms"]),
+        ("planned", plan["strategy"], plan["max_payload"], plan["max_concurrent_transforms"])
+    ]
+
+    print(f"{'settings':<26}{'strategy':>14}{'payload MB':>12}{'concurrency':>13}{'requests':>10}{'seconds':>10}{'records/s':>12}{'speedup':>9}")
+    baseline = None
+    try :
+        for name, strategy, max_payload, max_concurrent in cases :
+            result = transform(port, objects, strategy, max_payload, max_concurrent)
+            if result["records"] != args.rows // args.shards * args.shards :
+                raise Exception(f"{name}: {result['records']} predictions for {args.rows} rows.")
+            baseline = baseline if baseline else result["records_per_sec"]
+            print(f"{name:<26}{strategy:>14}{max_payload:>12}{max_concurrent:>13}{result['requests']:>10}"
+                  f"{result['seconds']:>10.2f}{result['records_per_sec']:>12.0f}{result['records_per_sec'] / baseline:>8.1f}x")
+    finally :
+        server.shutdown()
+
+if __name__ == "__main__" :
+    main()
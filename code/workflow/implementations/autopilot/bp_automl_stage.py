@@ -4,9 +4,10 @@ import os
 from time import gmtime, sleep, strftime, time
 from urllib.parse import urlparse
 
-import boto3
-
-class TaskTimedOut(Exception): pass
+from bp_clients import get_client, track_api_calls
+from bp_job_tracker import TERMINAL_STATUSES, TaskTimedOut, get_monitor_config, get_prior_results, next_poll_interval
+from bp_s3_data import DATA_FORMATS, get_data_format, read_header
+from bp_telemetry import span, track_telemetry
 
 class AutoMLManager() :
 
@@ -14,16 +15,16 @@ class AutoMLManager() :
     
         if not drivers :
             drivers = {
-                "s3": boto3.client("s3"),
-                "sm" : boto3.client('sagemaker', region_name = os.environ.get('AWS_REGION')),
+                "s3": get_client("s3"),
+                "sm" : get_client('sagemaker', region_name = os.environ.get('AWS_REGION')),
             }
         
         self.init_drivers(drivers)
 
     def init_drivers(self, drivers) :
-        self.s3 = drivers["s3"] if "s3" in drivers and drivers["s3"] else boto3.client("s3")
+        self.s3 = drivers["s3"] if "s3" in drivers and drivers["s3"] else get_client("s3")
         #self.wf = drivers["sfn"] if "sfn" in drivers and drivers["sfn"] else boto3.client("stepfunctions")
-        self.dsml = drivers["sm"]if "sm" in drivers and drivers["sm"] else boto3.client('sagemaker', region_name = os.environ.get('AWS_REGION'))
+        self.dsml = drivers["sm"]if "sm" in drivers and drivers["sm"] else get_client('sagemaker', region_name = os.environ.get('AWS_REGION'))
 
     @classmethod
     def get_job_config(cls, max_candidates) :
@@ -48,10 +49,10 @@ class AutoMLManager() :
                     }
                    
     @classmethod
-    def get_input_config(cls, data_uri, target) :
+    def get_input_config(cls, data_uri, target, content_type=None) :
                         
         # 'ManifestFile'|'S3Prefix'
-        return [{
+        input_config = {
                     'DataSource': {
                         'S3DataSource': {
                             'S3DataType': 'S3Prefix',
@@ -60,7 +61,12 @@ class AutoMLManager() :
                     },
                     #'CompressionType': 'None'|'Gzip',
                     'TargetAttributeName': target
-                },]
+                }
+        # Autopilot reads CSV unless told otherwise
+        if content_type :
+            input_config['ContentType'] = content_type
+        
+        return [input_config]
         
     def get_automl_objective(metric_name) :    
         return {'MetricName': metric_name}
@@ -117,10 +123,11 @@ class AutoMLManager() :
                 timeout = 86400 
         
             data_uri = event["taskresult"]["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
+            content_type = DATA_FORMATS[get_data_format(event["config"]["Payload"])]["automl"]
             config = {
                         "JobName" : job_name,
                         "JobProperties" : cls.get_job_config(max_candidates),
-                        "Input" : cls.get_input_config(data_uri, target_name),
+                        "Input" : cls.get_input_config(data_uri, target_name, content_type),
                         "Problem" : problem_type,
                         "Objective": cls.get_automl_objective(metric_name),
                         "Output" : cls.get_output_config(f"s3://{ws_bucket}/{ws_prefix}/candidates"),
@@ -161,42 +168,61 @@ class AutoMLManager() :
         return "s3://{}/{}".format(parsed.netloc,"/".join(extended_key.split("/")[:-1]))        
         
     @classmethod
-    def monitor_status(cls, job_name, context, client) :
+    def get_results(cls, job_name, job_description) :
+        
+        status = job_description['AutoMLJobStatus']
+        
+        results = {"job_name" : job_name, "status" : status}
+        if status == 'Completed' : 
+            
+            best_candidate = job_description['BestCandidate']
+            best_candidate_name = best_candidate['CandidateName']
+            
+            results["best-candidate"] = {   
+                                        "name" : best_candidate_name,
+                                        "objective": {
+                                            "name": best_candidate['FinalAutoMLJobObjectiveMetric']['MetricName'],
+                                            "value": best_candidate['FinalAutoMLJobObjectiveMetric']['Value']
+                                            },
+                                        "containers" : best_candidate["InferenceContainers"]
+                                        }
+        return results
+        
+    @classmethod
+    def describe_status(cls, job_name, client) :
+        return cls.get_results(job_name, client.describe_auto_ml_job(AutoMLJobName=job_name))
     
-        sleep_time = 60
+    ## Non-blocking status check. The workflow re-invokes this stage from a Wait state
+    ## loop until the job reaches a terminal status.
+    @classmethod
+    def check_status(cls, results, monitor_config, prior_results=None) :
+        
+        polls = prior_results["polls"] + 1 if prior_results and "polls" in prior_results else 0
+        results["polls"] = polls
+        results["poll_interval"] = next_poll_interval("automl", polls, monitor_config)
+        
+        return results
+        
+    @classmethod
+    def monitor_status(cls, job_name, context, client, monitor_config) :
+    
+        polls = 0
         while True: 
             
-            job_description = client.describe_auto_ml_job(AutoMLJobName=job_name)
-            status = job_description['AutoMLJobStatus']
+            results = cls.describe_status(job_name, client)
+            status = results["status"]
             
-            results = {"job_name" : job_name}  
-            if status == 'Completed' : 
-                
-                best_candidate = job_description['BestCandidate']
-                best_candidate_name = best_candidate['CandidateName']
-                
-                results["best-candidate"] = {   
-                                            "name" : best_candidate_name,
-                                            "objective": {
-                                                "name": best_candidate['FinalAutoMLJobObjectiveMetric']['MetricName'],
-                                                "value": best_candidate['FinalAutoMLJobObjectiveMetric']['Value']
-                                                },
-                                            "containers" : best_candidate["InferenceContainers"]
-                                            }
-                
-                break;
-                        
-            elif status in ('Failed', 'Stopped') :
+            if status in TERMINAL_STATUSES :
                 break;
             else :
                 
+                sleep_time = min(next_poll_interval("automl", polls, monitor_config), monitor_config["max_poll_interval"])
+                polls += 1
                 if context.get_remaining_time_in_millis() > 2000*sleep_time :
                     sleep(sleep_time)
                 else :
                     raise TaskTimedOut("Task timed out.")
         
-        results["status"] = status 
-        
         return results 
     
     @classmethod
@@ -212,6 +238,17 @@ class AutoMLManager() :
             
         return best_model_performance >= min_performance
     
+    ## The schema of the prepped data is resolved once, from the first few KB of the data, and
+    ## passed on to the evaluation stages so they never read data just for its header.
+    def get_schema(self, wf_state, data_uri) :
+        
+        schema = get_prior_results(wf_state, ["automlresult", "Payload", "automl-config", "schema"])
+        if not schema or schema["data_uri"] != data_uri :
+            with span("read_schema") :
+                schema = read_header(self.s3, data_uri, data_format=get_data_format(wf_state["config"]["Payload"]))
+        
+        return schema
+    
     def run_sm_autopilot(self, automl_config, context, wf_state) :
         
         if not context or not wf_state :
@@ -220,26 +257,44 @@ class AutoMLManager() :
         try :
             job_def = self.dsml.describe_auto_ml_job(AutoMLJobName=automl_config["JobName"])
         except :
+            job_def = None
             
             # DT: 03/10/2020 workaround DataWrangler bug P45265671
             unique_s3_prefix = automl_config["Input"][0]["DataSource"]["S3DataSource"]["S3Uri"]
-            fixed_data_path = self.fix_datawrangler_data_path(self.s3, unique_s3_prefix)
-            automl_config["Input"][0]["DataSource"]["S3DataSource"]["S3Uri"] = fixed_data_path
+            with span("create_job") :
+                fixed_data_path = self.fix_datawrangler_data_path(self.s3, unique_s3_prefix)
+                automl_config["Input"][0]["DataSource"]["S3DataSource"]["S3Uri"] = fixed_data_path
             
-            self.dsml.create_auto_ml_job(AutoMLJobName = automl_config["JobName"],
-                                        InputDataConfig = automl_config["Input"],
-                                        OutputDataConfig = automl_config["Output"],
-                                        AutoMLJobConfig = automl_config["JobProperties"],
-                                        ProblemType = automl_config["Problem"],
-                                        AutoMLJobObjective = automl_config["Objective"],
-                                        RoleArn = automl_config["IamRole"])
+                self.dsml.create_auto_ml_job(AutoMLJobName = automl_config["JobName"],
+                                            InputDataConfig = automl_config["Input"],
+                                            OutputDataConfig = automl_config["Output"],
+                                            AutoMLJobConfig = automl_config["JobProperties"],
+                                            ProblemType = automl_config["Problem"],
+                                            AutoMLJobObjective = automl_config["Objective"],
+                                            RoleArn = automl_config["IamRole"])
+        
+        # the describe call above doubles as the status check
+        if job_def :
+            data_uri = job_def["InputDataConfig"][0]["DataSource"]["S3DataSource"]["S3Uri"]
+            results = self.get_results(automl_config["JobName"], job_def)
+        else :
+            data_uri = fixed_data_path
+            results = {"job_name" : automl_config["JobName"], "status" : "InProgress"}
     
-        results = self.monitor_status(automl_config["JobName"], context, self.dsml)
+        monitor_config = get_monitor_config(wf_state["config"]["Payload"])
+        if monitor_config["mode"] == "blocking" :
+            if results["status"] not in TERMINAL_STATUSES :
+                with span("wait") :
+                    results = self.monitor_status(automl_config["JobName"], context, self.dsml, monitor_config)
+        else :
+            prior_results = get_prior_results(wf_state, ["automlresult", "Payload", "model-config", "job-results"])
+            results = self.check_status(results, monitor_config, prior_results)
         results["qualified"] = self.model_is_qualified(wf_state, results)
         
         passed_config = wf_state["config"]["Payload"]
         passed_config["model-config"]["job-results"] = results
-        passed_config["automl-config"]["data_uri"] = job_def["InputDataConfig"][0]["DataSource"]["S3DataSource"]["S3Uri"]
+        passed_config["automl-config"]["data_uri"] = data_uri
+        passed_config["automl-config"]["schema"] = self.get_schema(wf_state, data_uri)
         
         return passed_config 
         
@@ -256,6 +311,8 @@ class AutoMLManager() :
         
         return results
 
+@track_telemetry("automl")
+@track_api_calls
 def lambda_handler(event, context):
     
     automl = AutoMLManager()
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from bp_s3_data import DEFAULT_DATA_FORMAT, list_objects, parse_s3_uri, read_object_frames
+
+## Builds the baseline for KernelSHAP. The shards of the dataset are streamed once and
+## sampled uniformly per target class, and each class's sample is then summarized into a few
+## representative rows with k-medoids. Medoids are rows of the dataset, so categorical
+## values stay valid, and the model is invoked for far fewer baseline rows than a random
+## sample of the same quality would need.
+##
+## A dataset of more than max_objects shards is sampled from a random subset of them, so the
+## scan is bounded by the Lambda's time and memory rather than by the size of the dataset.
+
+DEFAULT_RESERVOIR_SIZE = 500
+DEFAULT_MAX_OBJECTS = 16
+CHUNK_ROWS = 50000
+MAX_ITER = 20
+
+def sample_shards(client, data_uri, target_name, reservoir_size=DEFAULT_RESERVOIR_SIZE, stratify=True, seed=0,
+                  data_format=DEFAULT_DATA_FORMAT, max_objects=DEFAULT_MAX_OBJECTS) :
+
+    ## Bottom-k sampling: every row gets a uniform random key and each stratum keeps the rows
+    ## with the smallest keys. That is a uniform sample without replacement, and samples of
+    ## different chunks merge by keeping the smallest keys again.
+    rng = np.random.default_rng(seed)
+
+    bucket, prefix = parse_s3_uri(data_uri)
+    objects = [obj for obj in list_objects(client, bucket, prefix) if obj["Size"] > 0 and not obj["Key"].endswith("/")]
+    if max_objects and len(objects) > max_objects :
+        objects = [objects[i] for i in sorted(rng.choice(len(objects), max_objects, replace=False))]
+
+    reservoirs, counts, columns = {}, {}, None
+    chunks = (chunk for obj in objects for chunk in read_object_frames(client, bucket, obj, data_format, chunk_rows=CHUNK_ROWS))
+    for chunk in chunks :
+
+        if columns is None :
+            columns = chunk.columns.to_list()
+        chunk = chunk[columns].assign(_key=rng.random(len(chunk)))
+
+        strata = chunk.groupby(target_name, sort=False) if stratify else [(None, chunk)]
+        for label, rows in strata :
+            counts[label] = counts.get(label, 0) + len(rows)
+            if label in reservoirs :
+                rows = pd.concat([reservoirs[label], rows])
+            reservoirs[label] = rows.nsmallest(reservoir_size, "_key")
+
+    if columns is None :
+        raise Exception(f"No data found under {data_uri}.")
+
+    return {label: rows.drop(columns="_key") for label, rows in reservoirs.items()}, counts, columns
+
+def gower_distances(df) :
+
+    ## Mean per-column distance: range-normalized absolute difference for numeric columns and
+    ## mismatch for the others. Missing numeric values are compared as the column median.
+    n = len(df)
+    dist = np.zeros((n, n))
+    for col in df.columns :
+
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values) :
+            x = values.fillna(values.median()).to_numpy(dtype=float)
+            spread = x.max() - x.min() if n else 0
+            if spread > 0 :
+                dist += np.abs(x[:, None] - x[None, :]) / spread
+        else :
+            codes, _ = pd.factorize(values)
+            dist += codes[:, None] != codes[None, :]
+
+    return dist / max(len(df.columns), 1)
+
+def k_medoids(dist, k, rng, max_iter=MAX_ITER) :
+
+    n = len(dist)
+    if k >= n :
+        return np.arange(n)
+
+    # k-means++ style seeding, then alternate between assignment and medoid updates
+    medoids = [int(rng.integers(n))]
+    for _ in range(1, k) :
+        d = dist[:, medoids].min(axis=1)
+        medoids.append(int(rng.choice(n, p=d / d.sum())) if d.sum() > 0 else int(rng.integers(n)))
+    medoids = np.array(medoids)
+
+    for _ in range(max_iter) :
+
+        assignment = dist[:, medoids].argmin(axis=1)
+        updated = medoids.copy()
+        for c in range(k) :
+            members = np.flatnonzero(assignment == c)
+            if len(members) :
+                updated[c] = members[dist[np.ix_(members, members)].sum(axis=1).argmin()]
+
+        if np.array_equal(updated, medoids) :
+            break
+        medoids = updated
+
+    return medoids
+
+def allocate(counts, num_rows) :
+
+    ## Splits num_rows across strata in proportion to their size (largest remainder), with
+    ## at least one row per stratum when there are enough rows to go around.
+    labels = list(counts.keys())
+    total = sum(counts.values())
+    quotas = np.array([counts[l] * num_rows / total for l in labels])
+
+    alloc = np.floor(quotas).astype(int)
+    if num_rows >= len(labels) :
+        alloc = np.maximum(alloc, 1)
+    for i in np.argsort(quotas - np.floor(quotas))[::-1] :
+        if alloc.sum() >= num_rows :
+            break
+        alloc[i] += 1
+
+    return dict(zip(labels, alloc))
+
+def build_baseline(client, data_uri, target_name, num_rows, reservoir_size=DEFAULT_RESERVOIR_SIZE, stratify=True, seed=0,
+                   data_format=DEFAULT_DATA_FORMAT, max_objects=DEFAULT_MAX_OBJECTS) :
+
+    reservoirs, counts, columns = sample_shards(client, data_uri, target_name, reservoir_size, stratify, seed, data_format,
+                                                max_objects)
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for label, k in allocate(counts, num_rows).items() :
+
+        if k == 0 :
+            continue
+        # the target is dropped by name, wherever it is in the dataset
+        features = reservoirs[label].drop(columns=target_name).reset_index(drop=True)
+        rows.append(features.iloc[k_medoids(gower_distances(features), k, rng)])
+
+    return pd.concat(rows).reset_index(drop=True), columns
@@ -1,97 +1,69 @@
 # Author: Dylan Tong, AWS
 import json
-from time import sleep
-from urllib.parse import urlparse
 
-import pandas as pd
+from bp_clients import LazyClient, get_sagemaker_session, track_api_calls
+from bp_eval_cache import EvalCache
+from bp_job_tracker import JobTracker, get_monitor_config, get_prior_results
+from bp_s3_data import DATA_FORMATS, DEFAULT_DATA_FORMAT, S3MultipartWriter, get_columns, get_data_format, parse_s3_uri, read_frames
+from bp_telemetry import span, track_telemetry
 
-import boto3
-
-from sagemaker import clarify
-from sagemaker import Session
-
-sm = boto3.client("sagemaker")
-s3 = boto3.client("s3")
-
-class TaskTimedOut(Exception): pass
+sm = LazyClient("sagemaker")
+s3 = LazyClient("s3")
+tracker = JobTracker(sm)
+eval_cache = EvalCache(s3, sm, "bias-analysis-config")
 
 # this is a temporary workaround. There's a bug in the bias detection processing
 # script that results in different behavior depending on how the dataset is split.
-# the temporary workaround is to merge the files. Be warn that this workaround will
-# not scale well.
-def create_merged_dataset(s3_src, s3_dst, target_name) :
-
-    parsed = urlparse(s3_src, allow_fragments=False)
-    if parsed.query:
-        prefix= parsed.path.lstrip('/') + '?' + parsed.query
-    else:
-        prefix= parsed.path.lstrip('/')
-    
-    files = []
-    kwargs = {'Bucket': parsed.netloc, 'Prefix': prefix, 'MaxKeys': 100}
-    resp = s3.list_objects_v2(**kwargs)
-    is_first = True
-    for obj in resp['Contents'] :
-        if is_first :
-            files.append(pd.read_csv("s3://{}/{}".format(parsed.netloc, obj["Key"])))
-        else :
-            files.append(pd.read_csv("s3://{}/{}".format(parsed.netloc, obj["Key"], skiprows=1, header=None)))    
+# the temporary workaround is to merge the files. The shards are streamed through in
+# chunks of MERGE_CHUNK_ROWS rows and written out as a multipart upload, so memory use
+# does not grow with the size of the dataset. Parquet shards are merged into the row
+# groups of a single Parquet file.
+MERGE_CHUNK_ROWS = 50000
 
-    df = pd.concat(files)
-    df[target_name] = df[target_name].astype(int)
-    dst = f"{s3_dst}/merged.csv"
-    df.to_csv(dst, index=False)
-    return dst
-    
-def get_first_matching_s3_key(bucket, prefix=''):
-        
-    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': 1}
-    resp = s3.list_objects_v2(**kwargs)
-    for obj in resp['Contents']:
-        return obj['Key']
-
-def get_data_columns(data_uri) :
-    
-    #obtains the headers from the first object of many at the specified location
-    parsed = urlparse(data_uri, allow_fragments=False)
-    if parsed.query:
-        prefix= parsed.path.lstrip('/') + '?' + parsed.query
-    else:
-        prefix= parsed.path.lstrip('/')
-    key = get_first_matching_s3_key(parsed.netloc,prefix)
-    
-    uri = f"s3://{parsed.netloc}/{key}"
-    return pd.read_csv(uri,nrows=0).columns.to_list() 
+def create_merged_dataset(s3_src, s3_dst, target_name, data_format=DEFAULT_DATA_FORMAT) :
 
-def monitor_job_status(job_name, context) :
-    
-    sleep_time = 60
-    while True: 
+    dst_bucket, dst_prefix = parse_s3_uri(f"{s3_dst}/merged.{data_format}")
     
-        status = sm.describe_processing_job(ProcessingJobName = job_name)["ProcessingJobStatus"]
-
-        if status == 'Completed' : 
-            break;
-                    
-        elif status in ('Failed', 'Stopped') :
-            break;
-        else :
+    columns, parquet_writer = None, None
+    with span("merge_dataset") as merge_span, S3MultipartWriter(s3, dst_bucket, dst_prefix) as writer :
+        for df in read_frames(s3, s3_src, data_format, chunk_rows=MERGE_CHUNK_ROWS) :
             
-            if context.get_remaining_time_in_millis() > 2000*sleep_time :
-                sleep(sleep_time)
+            # only the header of the first shard is written out
+            write_header = columns is None
+            if write_header :
+                columns = df.columns.to_list()
+            
+            df = df[columns]
+            df[target_name] = df[target_name].astype(int)
+            if data_format == "parquet" :
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                # every chunk is cast to the schema of the first one
+                table = pa.Table.from_pandas(df, schema=parquet_writer.schema if parquet_writer else None, preserve_index=False)
+                if parquet_writer is None :
+                    parquet_writer = pq.ParquetWriter(writer, table.schema)
+                parquet_writer.write_table(table)
             else :
-                raise TaskTimedOut("Task timed out.")
-    
-    return {"status":status}
+                writer.write(df.to_csv(index=False, header=write_header).encode("utf-8"))
+        
+        if parquet_writer :
+            parquet_writer.close()
+        merge_span.add_bytes(writer.bytes_written)
+                
+    return f"s3://{dst_bucket}/{dst_prefix}"
     
 def create_clarify_bias_job(event) :
     
+    # the SDK is only needed to create the job, not to monitor it
+    from sagemaker import clarify
+    
     role = event["Input"]["Payload"]["security-config"]["iam_role"]
     ws_params = event["Input"]["Payload"]["workspace-config"]
     data_params = event["Input"]["Payload"]["data-config"]
     model_params = event["Input"]["Payload"]["model-config"]
     automl_params = event["Input"]["Payload"]["automl-config"]
     bias_analysis_params = event["Input"]["Payload"]["bias-analysis-config"]
+    data_format = get_data_format(event["Input"]["Payload"])
     
     # This is a temporary workaround. The bias detection job behaves differently when
     # files are split. Remove when the bug is fixed.
@@ -100,10 +72,10 @@ def create_clarify_bias_job(event) :
                                                 ws_params["s3_prefix"],
                                                 "data/merged")
     
-    input_path = create_merged_dataset(automl_params["data_uri"], merged_files_dst, automl_params["target_name"])
+    input_path = create_merged_dataset(automl_params["data_uri"], merged_files_dst, automl_params["target_name"], data_format)
     ################################## End Workaround ############################################
 
-    session = Session()
+    session = get_sagemaker_session()
     clarify_processor = clarify.SageMakerClarifyProcessor(  role=role,
                                                             instance_count=bias_analysis_params["instance_count"],
                                                             instance_type=bias_analysis_params["instance_type"],
@@ -116,8 +88,8 @@ def create_clarify_bias_job(event) :
     bias_data_config = clarify.DataConfig(  s3_data_input_path=input_path,
                                             s3_output_path=output_uri,
                                             label=automl_params["target_name"],
-                                            headers=get_data_columns(automl_params["data_uri"]),
-                                            dataset_type='text/csv')
+                                            headers=get_columns(s3, automl_params["data_uri"], automl_params.get("schema"), data_format),
+                                            dataset_type=DATA_FORMATS[data_format]["clarify"])
         
     model_config = clarify.ModelConfig( model_name=model_params["model_name"],
                                         instance_type=model_params["instance_type"],
@@ -145,19 +117,39 @@ def create_clarify_bias_job(event) :
                                 pre_training_methods='all',
                                 post_training_methods='all',
                                 wait=False,
-                                logs=False)                                
+                                logs=False)
 
+@track_telemetry("bias-analysis")
+@track_api_calls
 def lambda_handler(event, context):
 
     bias_analysis_params = event["Input"]["Payload"]["bias-analysis-config"]
     job_name = bias_analysis_params["job_name"]
+    monitor_config = get_monitor_config(event["Input"]["Payload"])
+    reuse_results = event["Input"]["Payload"].get("pipeline-config", {}).get("reuse_eval_results", True)
     
-    try :
-        sm.describe_processing_job(ProcessingJobName = job_name)
-    except :
-        create_clarify_bias_job(event) 
+    # an earlier run with the same model, data and config already produced this result
+    with span("eval_cache") :
+        cache, memo = eval_cache.begin(event, reuse_results)
+    if memo :
+        bias_analysis_params["job-results"] = memo["job-results"]
+        bias_analysis_params["eval-cache"] = cache
+        return event["Input"]["Payload"]
+    
+    if not tracker.exists("processing", job_name) :
+        with span("create_job") :
+            create_clarify_bias_job(event)
         
-    results = monitor_job_status(job_name, context)
+    if monitor_config["mode"] == "blocking" :
+        with span("wait") :
+            results = tracker.wait("processing", job_name, context, monitor_config, bias_analysis_params["job_base_name"])
+    else :
+        prior_results = get_prior_results(event["Input"], ["taskresult", "Payload", "bias-analysis-config", "job-results"])
+        with span("check_status") :
+            results = tracker.check("processing", job_name, monitor_config, prior_results, bias_analysis_params["job_base_name"])
+    
+    eval_cache.end(event, cache, job_name, results)
     
     event["Input"]["Payload"]["bias-analysis-config"]["job-results"] = results
+    event["Input"]["Payload"]["bias-analysis-config"]["eval-cache"] = cache
     return event["Input"]["Payload"]
\ No newline at end of file
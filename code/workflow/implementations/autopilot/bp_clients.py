@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+from collections import Counter
+from functools import wraps
+from time import perf_counter
+
+import botocore.session
+from botocore.config import Config
+
+## Stages talk to AWS through botocore directly. Importing boto3 and building clients are a
+## large part of a cold start, so clients are only created when a stage first calls them and
+## are then reused by every warm invocation of the same Lambda container.
+
+## Adaptive retries back off and rate limit on throttling, which several concurrent
+## blueprints polling SageMaker can trigger. The pool is sized for the parallel S3 transfers
+## of the stages; the per-service settings override the defaults.
+CLIENT_CONFIG = {
+    "default": {
+        "retry_mode": "adaptive",
+        "max_attempts": 10,
+        "max_pool_connections": 10,
+        "connect_timeout": 5,
+        "read_timeout": 60
+    },
+    "s3": {
+        "max_pool_connections": 32
+    }
+}
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_clients = {}
+_sagemaker_sessions = {}
+
+## API calls and retries made since the start of the current invocation, with the time spent
+## in the calls and the bytes of the responses, by service.
+counters = {"calls": Counter(), "attempts": 0, "seconds": Counter(), "bytes": Counter()}
+
+def get_session() :
+
+    global _session
+    if _session is None :
+        _session = botocore.session.get_session()
+    return _session
+
+def get_region() :
+    return os.environ.get("AWS_REGION") or get_session().get_config_variable("region")
+
+def get_client_config(service) :
+
+    settings = dict(CLIENT_CONFIG["default"])
+    settings.update(CLIENT_CONFIG.get(service, {}))
+
+    return Config(retries={"mode": settings["retry_mode"], "max_attempts": settings["max_attempts"]},
+                  max_pool_connections=settings["max_pool_connections"],
+                  connect_timeout=settings["connect_timeout"],
+                  read_timeout=settings["read_timeout"])
+
+def _count_call(model, context=None, **kwargs) :
+
+    counters["calls"][f"{model.service_model.service_name}:{model.name}"] += 1
+    if context is not None :
+        context["bp_started"] = perf_counter()
+
+def _time_call(model, context=None, parsed=None, **kwargs) :
+
+    service = model.service_model.service_name
+    if context and "bp_started" in context :
+        counters["seconds"][service] += perf_counter() - context["bp_started"]
+    # streamed bodies are counted when the call returns, before they are read
+    if isinstance(parsed, dict) and parsed.get("ContentLength") :
+        counters["bytes"][service] += parsed["ContentLength"]
+
+def _count_attempt(**kwargs) :
+    counters["attempts"] += 1
+
+def get_client(service, region_name=None) :
+
+    region = region_name if region_name else get_region()
+    if (service, region) not in _clients :
+
+        client = get_session().create_client(service, region_name=region, config=get_client_config(service))
+        # before-call and after-call fire once per API call, before-send once per HTTP attempt
+        client.meta.events.register("before-call", _count_call)
+        client.meta.events.register("after-call", _time_call)
+        client.meta.events.register("before-send", _count_attempt)
+        _clients[(service, region)] = client
+
+    return _clients[(service, region)]
+
+def register_client(service, client, region_name=None) :
+
+    ## Installs a client in the registry, in place of the botocore client that get_client
+    ## would create. Used to run the stages against local stand-ins of the AWS APIs.
+    region = region_name if region_name else get_region()
+    _clients[(service, region)] = client
+    _sagemaker_sessions.pop(region, None)
+
+    return client
+
+def get_sagemaker_session(region_name=None) :
+
+    ## SageMaker SDK session on top of the registry's clients and credentials. The SDK is
+    ## only imported by the stages that create jobs with it.
+    import boto3
+    from sagemaker import Session
+
+    region = region_name if region_name else get_region()
+    if region not in _sagemaker_sessions :
+        boto_session = boto3.Session(botocore_session=get_session(), region_name=region)
+        _sagemaker_sessions[region] = Session(boto_session=boto_session,
+                                              sagemaker_client=get_client("sagemaker", region))
+
+    return _sagemaker_sessions[region]
+
+def reset_counters() :
+
+    counters["calls"] = Counter()
+    counters["attempts"] = 0
+    counters["seconds"] = Counter()
+    counters["bytes"] = Counter()
+
+def get_counters() :
+
+    api_calls = sum(counters["calls"].values())
+    return {
+        "api_calls": api_calls,
+        "retries": max(counters["attempts"] - api_calls, 0),
+        "calls": dict(counters["calls"]),
+        "seconds": {k: round(v, 4) for k, v in counters["seconds"].items()},
+        "bytes": dict(counters["bytes"])
+    }
+
+def track_api_calls(handler) :
+
+    ## Resets the counters for every invocation and logs them at debug level when the handler
+    ## returns. The stage's telemetry record carries the same usage in the payload.
+    @wraps(handler)
+    def wrapper(event, context) :
+
+        reset_counters()
+        try :
+            return handler(event, context)
+        finally :
+            logger.debug("api-usage: %s", json.dumps(get_counters()))
+
+    return wrapper
+
+class LazyClient() :
+
+    ## Module-level stand-in for a client. The client is created on the first API call.
+    def __init__(self, service, region_name=None) :
+        self.service = service
+        self.region_name = region_name
+
+    def __getattr__(self, name) :
+        return getattr(get_client(self.service, self.region_name), name)
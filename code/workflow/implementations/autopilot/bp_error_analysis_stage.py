@@ -1,17 +1,27 @@
 # Author: Dylan Tong, AWS
 import json
-from time import sleep
+import logging
 
-import boto3
+from botocore.exceptions import ClientError
 
-from sagemaker.transformer import Transformer
+from bp_clients import LazyClient, get_sagemaker_session, track_api_calls
+from bp_eval_cache import EvalCache, get_output_uri
+from bp_job_tracker import JobTracker, get_monitor_config, get_prior_results
+from bp_s3_data import convert_to_csv, get_data_format
+from bp_telemetry import span, track_telemetry
+from bp_transform_tuning import get_throughput, measure_rows, plan_transform
 
-sm = boto3.client("sagemaker")
-
-class TaskTimedOut(Exception): pass
+sm = LazyClient("sagemaker")
+s3 = LazyClient("s3")
+tracker = JobTracker(sm)
+eval_cache = EvalCache(s3, sm, "error-analysis-config")
+logger = logging.getLogger(__name__)
 
 def create_batch_predictions_job(event) :
     
+    # the SDK is only needed to create the job, not to monitor it
+    from sagemaker.transformer import Transformer
+    
     role = event["Input"]["Payload"]["security-config"]["iam_role"]
     ws_params = event["Input"]["Payload"]["workspace-config"]
     data_params = event["Input"]["Payload"]["data-config"]
@@ -23,16 +33,35 @@ def create_batch_predictions_job(event) :
     output_uri = "s3://{}/{}/{}".format(ws_params["s3_bucket"],
                                         ws_params["s3_prefix"],
                                         error_analysis_params["output_prefix"])
+    
+    test_data_uri = error_analysis_params["test_data_uri"] if error_analysis_params["test_data_uri"] else automl_params["data_uri"]
+    
+    # the inference containers of Autopilot models take CSV, so Parquet prepped data is
+    # converted into CSV shards under the workspace first
+    data_format = get_data_format(event["Input"]["Payload"])
+    if not error_analysis_params["test_data_uri"] and data_format != "csv" :
+        with span("convert_to_csv") :
+            test_data_uri = convert_to_csv(s3,
+                                           test_data_uri,
+                                           "s3://{}/{}/data/transform-input/{}".format(ws_params["s3_bucket"],
+                                                                                       ws_params["s3_prefix"],
+                                                                                       error_analysis_params["job_name"]),
+                                           data_format)
+    
+    # batching and concurrency are tuned to the width of the rows and the size of the data
+    plan = plan_transform(measure_rows(s3, test_data_uri), xform_params)
                                         
     transformer = Transformer(model_name=model_params["model_name"],
                           instance_count=xform_params["instance_count"],
                           instance_type=xform_params["instance_type"],
                           accept = 'text/csv',
-                          strategy=xform_params["strategy"],
+                          strategy=plan["strategy"],
                           assemble_with=xform_params["assemble_with"],
-                          output_path=output_uri)
+                          max_concurrent_transforms=plan["max_concurrent_transforms"],
+                          max_payload=plan["max_payload"],
+                          output_path=output_uri,
+                          sagemaker_session=get_sagemaker_session())
 
-    test_data_uri = error_analysis_params["test_data_uri"] if error_analysis_params["test_data_uri"] else automl_params["data_uri"]
     transformer.transform(job_name = error_analysis_params["job_name"],
                         data = test_data_uri,
                         split_type= xform_params["split_type"],
@@ -43,39 +72,74 @@ def create_batch_predictions_job(event) :
                         logs=False,
                         wait=False)
     
-def monitor_job_status(job_name, context) :
+    return plan
+
+## Once the predictions are in, they are summarized into metrics.json under the output prefix.
+## A summary that fails to read or parse the predictions is logged and leaves the notebook to
+## compute the metrics from them; other errors fail the stage.
+## Returns the summary's location and the number of records transformed.
+def create_metrics_summary(event, job_name) :
     
-    sleep_time = 60
-    while True: 
+    from bp_metrics import get_metrics_config, summarize_predictions, write_summary
     
-        status = sm.describe_transform_job(TransformJobName = job_name)["TransformJobStatus"]
-
-        if status == 'Completed' : 
-            break;
-                    
-        elif status in ('Failed', 'Stopped') :
-            break;
-        else :
-            
-            if context.get_remaining_time_in_millis() > 2000*sleep_time :
-                sleep(sleep_time)
-            else :
-                raise TaskTimedOut("Task timed out.")
-    
-    return {"status":status}
+    error_analysis_params = event["Input"]["Payload"]["error-analysis-config"]
+    metrics_config = get_metrics_config(error_analysis_params)
+    if not metrics_config["enabled"] :
+        return None, None
     
+    output_uri = get_output_uri(event["Input"]["Payload"], "error-analysis-config")
+    try :
+        summary = summarize_predictions(s3, output_uri, metrics_config, job_name)
+        return write_summary(s3, output_uri, summary), summary["rows"]
+    except (ClientError, ValueError) as e :
+        logger.warning("Failed to summarize the predictions under %s: %s", output_uri, e)
+        return None, None
 
+@track_telemetry("error-analysis")
+@track_api_calls
 def lambda_handler(event, context):
     
     error_analysis_params = event["Input"]["Payload"]["error-analysis-config"]
     job_name = error_analysis_params["job_name"]
+    monitor_config = get_monitor_config(event["Input"]["Payload"])
+    reuse_results = event["Input"]["Payload"].get("pipeline-config", {}).get("reuse_eval_results", True)
     
-    try :
-        sm.describe_transform_job(TransformJobName = job_name)
-    except :
-        create_batch_predictions_job(event) 
+    # an earlier run with the same model, data and config already produced this result
+    with span("eval_cache") :
+        cache, memo = eval_cache.begin(event, reuse_results)
+    if memo :
+        error_analysis_params["job-results"] = memo["job-results"]
+        error_analysis_params["eval-cache"] = cache
+        return event["Input"]["Payload"]
+    
+    plan = get_prior_results(event["Input"], ["taskresult", "Payload", "error-analysis-config", "transform-plan"])
+    if not tracker.exists("transform", job_name) :
+        with span("create_job") :
+            from bp_metrics import delete_summary
+            delete_summary(s3, get_output_uri(event["Input"]["Payload"], "error-analysis-config"))
+            plan = create_batch_predictions_job(event)
+        
+    if monitor_config["mode"] == "blocking" :
+        with span("wait") :
+            results = tracker.wait("transform", job_name, context, monitor_config, error_analysis_params["job_base_name"])
+    else :
+        prior_results = get_prior_results(event["Input"], ["taskresult", "Payload", "error-analysis-config", "job-results"])
+        with span("check_status") :
+            results = tracker.check("transform", job_name, monitor_config, prior_results, error_analysis_params["job_base_name"])
+    
+    # summarized before the results are memoized, so that the memo covers the summary
+    if results["status"] == "Completed" :
+        with span("summarize_predictions") :
+            results["metrics-summary"], records = create_metrics_summary(event, job_name)
         
-    results = monitor_job_status(job_name, context)
+        # without a summary, the number of records is the one estimated when the job was planned
+        estimated = records is None and plan is not None
+        records = plan["rows"] if estimated else records
+        results["throughput"] = get_throughput(sm.describe_transform_job(TransformJobName=job_name), records, estimated)
+    
+    eval_cache.end(event, cache, job_name, results)
     
     event["Input"]["Payload"]["error-analysis-config"]["job-results"] = results
+    event["Input"]["Payload"]["error-analysis-config"]["eval-cache"] = cache
+    event["Input"]["Payload"]["error-analysis-config"]["transform-plan"] = plan
     return event["Input"]["Payload"]
\ No newline at end of file
@@ -0,0 +1,129 @@
+import logging
+
+from botocore.exceptions import ClientError
+
+from bp_fingerprint import NoDataFound, fingerprint, fingerprint_objects, read_manifest, write_manifest
+from bp_job_tracker import get_prior_results
+from bp_s3_data import parse_s3_uri
+
+## Memoizes the results of the evaluation stages. A stage's result is determined by the
+## model containers, the evaluation data and the stage config, so a run whose inputs hash to
+## the key of an earlier completed run can reuse that run's output instead of launching a
+## Batch Transform or Clarify job. Evaluation outputs are written to a fixed prefix that later
+## runs overwrite, so a memo is only honored while the output still matches the fingerprint
+## recorded when the job completed.
+
+# keys of a stage config that change on every run without changing the result
+VOLATILE_KEYS = ["job_name", "job-results", "eval-cache", "transform-plan"]
+
+logger = logging.getLogger(__name__)
+
+def get_output_uri(payload, stage_key) :
+
+    ws_params = payload["workspace-config"]
+    return "s3://{}/{}/{}".format(ws_params["s3_bucket"],
+                                  ws_params["s3_prefix"],
+                                  payload[stage_key]["output_prefix"])
+
+def get_model_fingerprint(sm, s3, model_name) :
+
+    ## Model names and the locations of their artifacts are unique to each run, so a model is
+    ## identified by its containers' images and environments and by the content of their
+    ## artifacts: the ETag and size of each ModelDataUrl.
+    desc = sm.describe_model(ModelName=model_name)
+    containers = desc["Containers"] if "Containers" in desc else [desc["PrimaryContainer"]]
+
+    parts = []
+    for c in containers :
+        part = {k: c.get(k) for k in ["Image", "Environment"]}
+        if c.get("ModelDataUrl") :
+            bucket, key = parse_s3_uri(c["ModelDataUrl"])
+            head = s3.head_object(Bucket=bucket, Key=key)
+            part["ModelData"] = [head["ETag"], head["ContentLength"]]
+        parts.append(part)
+
+    return fingerprint(parts)
+
+def get_output_fingerprint(s3, output_uri) :
+
+    try :
+        return fingerprint_objects(s3, *parse_s3_uri(output_uri))
+    except (ClientError, NoDataFound) as e :
+        logger.warning("Could not fingerprint the output under %s: %s", output_uri, e)
+        return None
+
+class EvalCache() :
+
+    def __init__(self, s3, sm, stage_key) :
+
+        self.s3 = s3
+        self.sm = sm
+        self.stage_key = stage_key
+
+    def get_key(self, payload, data_uri) :
+
+        stage_config = {k: v for k, v in payload[self.stage_key].items() if k not in VOLATILE_KEYS}
+        return fingerprint(self.stage_key,
+                           get_model_fingerprint(self.sm, self.s3, payload["model-config"]["model_name"]),
+                           fingerprint_objects(self.s3, *parse_s3_uri(data_uri)),
+                           payload["automl-config"]["target_name"],
+                           stage_config)
+
+    def _location(self, payload, key) :
+
+        ws_params = payload["workspace-config"]
+        return ws_params["s3_bucket"], f"{ws_params['s3_prefix']}/meta/eval-cache/{self.stage_key}/{key}.json"
+
+    def lookup(self, payload, key) :
+
+        memo = read_manifest(self.s3, *self._location(payload, key))
+        if not memo :
+            return None
+
+        output_fp = get_output_fingerprint(self.s3, memo["output_uri"])
+        if output_fp is None or output_fp != memo["output_fingerprint"] :
+            return None
+
+        return memo
+
+    def record(self, payload, key, job_name, results) :
+
+        output_uri = get_output_uri(payload, self.stage_key)
+        return write_manifest(self.s3, *self._location(payload, key), {
+            "key": key,
+            "job_name": job_name,
+            "output_uri": output_uri,
+            "output_fingerprint": get_output_fingerprint(self.s3, output_uri),
+            "job-results": results
+        })
+
+    def begin(self, event, reuse_results=True) :
+
+        ## Called at the start of every invocation. Returns the cache record carried over from
+        ## the previous poll, or computes the key on the first invocation and looks it up.
+        prior = get_prior_results(event["Input"], ["taskresult", "Payload", self.stage_key, "eval-cache"])
+        if prior :
+            return prior, None
+
+        payload = event["Input"]["Payload"]
+        params = payload[self.stage_key]
+        data_uri = params.get("test_data_uri") or payload["automl-config"]["data_uri"]
+
+        # failing to read the model or the data disables memoization, it never fails the stage
+        try :
+            key = self.get_key(payload, data_uri)
+        except (ClientError, NoDataFound) as e :
+            logger.warning("Results of %s are not memoized: %s", self.stage_key, e)
+            return {"key": None, "hit": False}, None
+
+        memo = self.lookup(payload, key) if reuse_results else None
+        cache = {"key": key, "hit": memo is not None}
+        if memo :
+            cache["source_job"] = memo["job_name"]
+
+        return cache, memo
+
+    def end(self, event, cache, job_name, results) :
+
+        if results["status"] == "Completed" and cache["key"] and not cache["hit"] :
+            self.record(event["Input"]["Payload"], cache["key"], job_name, results)
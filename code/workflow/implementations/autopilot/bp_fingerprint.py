@@ -0,0 +1,40 @@
+import hashlib
+import json
+from time import gmtime, strftime
+
+from bp_s3_data import list_objects
+
+## Content fingerprints identify the inputs of a stage, so that the outputs of an earlier
+## run with the same inputs can be reused. Manifests record which run produced an output
+## for a fingerprint; callers must verify that the run succeeded before reusing it.
+
+class NoDataFound(Exception): pass
+
+def fingerprint(*parts) :
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def fingerprint_objects(client, bucket, prefix) :
+
+    ## ETags change with the content of an object, so the sorted (key, ETag, size) listing
+    ## identifies the data under the prefix without reading it. Keys are relative to the
+    ## prefix, so the same data written under another run's prefix has the same fingerprint.
+    objects = sorted((obj["Key"][len(prefix):], obj["ETag"], obj["Size"]) for obj in list_objects(client, bucket, prefix)
+                     if obj["Size"] > 0 and not obj["Key"].endswith("/"))
+    if not objects :
+        raise NoDataFound(f"No data found under s3://{bucket}/{prefix}.")
+
+    return fingerprint(objects)
+
+def read_manifest(client, bucket, key) :
+
+    try :
+        return json.load(client.get_object(Bucket=bucket, Key=key)["Body"])
+    except client.exceptions.NoSuchKey :
+        return None
+
+def write_manifest(client, bucket, key, manifest) :
+
+    manifest["updated"] = strftime("%Y-%m-%d-%H-%M-%S", gmtime())
+    client.put_object(Body=json.dumps(manifest), Bucket=bucket, Key=key)
+
+    return manifest
@@ -5,9 +5,14 @@ from time import gmtime, strftime, time
 import uuid
 from urllib.parse import urlparse
 
-import boto3
-
-s3 = boto3.client("s3")
+from bp_clients import LazyClient, get_region, track_api_calls
+from bp_fingerprint import fingerprint, fingerprint_objects, read_manifest, write_manifest
+from bp_resource_planner import measure_dataset, plan_resources
+from bp_s3_data import DATA_FORMATS, get_data_format, parse_s3_uri
+from bp_telemetry import span, track_telemetry
+
+s3 = LazyClient("s3")
+sm = LazyClient("sagemaker")
 class BlueprintConfig :
 
     _instance = None
@@ -49,7 +54,9 @@ class BlueprintConfig :
                 cls.flow_name = config["dataprep-config"]["definition_file"]
                 cls.output_node_id = config["dataprep-config"]["output_node_id"]
                 cls.dp_instance_type = config["dataprep-config"]["instance_type"]
-                cls.dp_instance_count = int(config["dataprep-config"]["instance_count"])
+                # "auto" settings are resolved by the resource planner
+                dp_instance_count = config["dataprep-config"]["instance_count"]
+                cls.dp_instance_count = dp_instance_count if dp_instance_count == "auto" else int(dp_instance_count)
                 cls.dp_data_version = config["dataprep-config"]["data_version"]
 
                 cls.automl_base_job_name = config["automl-config"]["job_base_name"]
@@ -91,7 +98,7 @@ class DataWranglerFlowConfig() :
         self.name =  name if name else f"dw-process-{guid}"
 
         self.base_config = base_config
-        self.region = boto3.Session().region_name
+        self.region = get_region()
         self.flow_uri = f"s3://{self.base_config.w_bucket}/{self.base_config.w_prefix}/meta/{self.base_config.flow_name}"
         self.container_uri = self.get_data_prep_container_uri(self.region)
 
@@ -103,10 +110,70 @@ class DataWranglerFlowConfig() :
         
         self.output_name = self.base_config.output_node_id
         self.output_path = self.get_dp_output_path(guid)
+        self.output_content_type = DATA_FORMATS[get_data_format(self.base_config.dict)]["datawrangler"]
 
     def get_dp_output_path(self, guid) :
         
         return f"s3://{self.base_config.d_bucket}/{self.base_config.prepped_out_prefix}/{guid}"
+    
+    def get_fingerprint(self) :
+        
+        # the prepped output is determined by the raw data, the flow and the container running it,
+        # and by its format, which leaves the fingerprints of CSV outputs as they were
+        raw_fp = fingerprint_objects(s3, self.base_config.d_bucket, f"{self.base_config.raw_in_prefix}/")
+        output_format = [self.output_content_type] if self.output_content_type != "CSV" else []
+        return fingerprint(raw_fp, self.flow, self.output_name, self.container_uri, *output_format)
+    
+    def get_manifest_key(self, fp) :
+        return f"{self.base_config.w_prefix}/meta/dataprep/{fp}.json"
+    
+    def find_prepped_output(self, fp) :
+        
+        manifest = read_manifest(s3, self.base_config.w_bucket, self.get_manifest_key(fp))
+        if not manifest :
+            return None
+        
+        # only the output of a job that completed is reused
+        try :
+            job = sm.describe_processing_job(ProcessingJobName=manifest["processing_job_name"])
+        except sm.exceptions.ClientError :
+            return None
+        if job["ProcessingJobStatus"] != "Completed" :
+            return None
+        
+        # the output may have been deleted since
+        bucket, prefix = parse_s3_uri(manifest["output_uri"])
+        if not s3.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1).get("Contents") :
+            return None
+        
+        # same shape as the result of the Data Prep task
+        return {
+            "ProcessingJobName": job["ProcessingJobName"],
+            "ProcessingJobArn": job["ProcessingJobArn"],
+            "ProcessingJobStatus": job["ProcessingJobStatus"],
+            "ProcessingOutputConfig": job["ProcessingOutputConfig"]
+        }
+    
+    def get_cache_config(self, reuse_outputs=True) :
+        
+        ## The fingerprint is the dataset version. When a completed job already produced the
+        ## prepped data for it, the workflow skips Data Prep and passes on that job's result.
+        ## Otherwise, this run's job is recorded as the producer of the fingerprint.
+        fp = self.get_fingerprint()
+        cached = self.find_prepped_output(fp) if reuse_outputs else None
+        
+        if not cached :
+            write_manifest(s3, self.base_config.w_bucket, self.get_manifest_key(fp), {
+                "fingerprint": fp,
+                "processing_job_name": self.name,
+                "output_uri": self.output_path
+            })
+        
+        return {
+            "data_version": fp,
+            "cache_hit": cached is not None,
+            "cached-result": cached if cached else {}
+        }
       
 
     def get_data_prep_container_uri(self, region):
@@ -276,7 +343,7 @@ class DataWranglerFlowConfig() :
     def get_config(self) :
 
         processing_dir = "/opt/ml/processing"
-        output_content_type = "CSV"
+        output_content_type = self.output_content_type
         
         input_dict = []
         inputs = self.create_processing_inputs(processing_dir, self.flow, self.flow_uri)
@@ -324,14 +391,31 @@ def get_json_from_s3(s3obj_uri) :
 def get_base_config(config_uri) :
     return get_json_from_s3(config_uri)
 
+@track_telemetry("init")
+@track_api_calls
 def lambda_handler(event, context):
 
     try :
-        base_config = BlueprintConfig().get_config(event)
+        with span("load_config") :
+            base_config = BlueprintConfig().get_config(event)
     except KeyError:
         raise KeyError(f"Incorrect Step Functions input {event}. Expected S3Uri pointing to config file under key config_uri")
     
-    dw_config = DataWranglerFlowConfig(base_config).get_config()
-    base_config.dict["dataprep-config"]["data-wrangler-job-def"] = dw_config
+    dp_config = base_config.dict["dataprep-config"]
+    with span("prepare_flow") :
+        dw_flow_config = DataWranglerFlowConfig(base_config)
+        dp_config["data-wrangler-job-def"] = dw_flow_config.get_config()
+    with span("fingerprint") :
+        dp_config.update(dw_flow_config.get_cache_config(dp_config.get("reuse_outputs", True)))
+    
+    # instances are sized to the raw data, and to the prepped data when it is reused
+    with span("plan_resources") :
+        cached = dp_config["cached-result"]
+        prepped = measure_dataset(s3, cached["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]) if cached else None
+        resource_plan = plan_resources(s3, base_config.dict, prepped)
+    if resource_plan :
+        base_config.dict["resource-plan"] = resource_plan
+        dp_config["data-wrangler-job-def"]["ClusterConfig"].update(InstanceType=dp_config["instance_type"],
+                                                                   InstanceCount=dp_config["instance_count"])
     
     return base_config.dict
\ No newline at end of file
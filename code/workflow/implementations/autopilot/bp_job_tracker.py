@@ -0,0 +1,233 @@
+import random
+from time import sleep, time
+
+from botocore.exceptions import ClientError
+
+class TaskTimedOut(Exception): pass
+
+## Describe/list operations for each kind of SageMaker job tracked by the blueprint.
+JOB_TYPES = {
+    "processing": {
+        "describe": "describe_processing_job",
+        "name_arg": "ProcessingJobName",
+        "status": "ProcessingJobStatus",
+        "list": "list_processing_jobs",
+        "summaries": "ProcessingJobSummaries"
+    },
+    "transform": {
+        "describe": "describe_transform_job",
+        "name_arg": "TransformJobName",
+        "status": "TransformJobStatus",
+        "list": "list_transform_jobs",
+        "summaries": "TransformJobSummaries"
+    },
+    "automl": {
+        "describe": "describe_auto_ml_job",
+        "name_arg": "AutoMLJobName",
+        "status": "AutoMLJobStatus",
+        "list": "list_auto_ml_jobs",
+        "summaries": "AutoMLJobSummaries"
+    }
+}
+
+TERMINAL_STATUSES = ('Completed', 'Failed', 'Stopped')
+THROTTLING_ERRORS = ('ThrottlingException', 'Throttling', 'TooManyRequestsException')
+
+DEFAULT_MONITOR_CONFIG = {
+    "mode": "non-blocking",
+    "min_poll_interval": 10,
+    "max_poll_interval": 120,
+    "backoff_rate": 1.5,
+    "jitter": 0.2,
+    "seed_fraction": 0.25,
+    "status_cache_ttl": 30,
+    "expected_durations": {
+        "automl": 3600,
+        "transform": 600,
+        "processing": 900
+    }
+}
+
+def get_monitor_config(config) :
+
+    monitor_config = dict(DEFAULT_MONITOR_CONFIG)
+    if "pipeline-config" in config and "monitor-config" in config["pipeline-config"] :
+        monitor_config.update(config["pipeline-config"]["monitor-config"])
+
+    return monitor_config
+
+def next_poll_interval(job_type, polls, monitor_config, rand=random.random) :
+
+    ## The first poll waits for seed_fraction of the job's expected duration, when it has one;
+    ## later polls back off exponentially from min_poll_interval to max_poll_interval, which
+    ## bounds how late the Wait loop notices a finished job. Jitter is applied last, so it keeps
+    ## concurrent workflows from polling in lockstep even at max_poll_interval.
+    min_interval = monitor_config["min_poll_interval"]
+    max_interval = monitor_config["max_poll_interval"]
+
+    expected = monitor_config["expected_durations"].get(job_type)
+    if expected and polls == 0 :
+        interval = expected * monitor_config["seed_fraction"]
+    else :
+        backoffs = polls - 1 if expected else polls
+        interval = min(max_interval, max(min_interval, min_interval * (monitor_config["backoff_rate"] ** backoffs)))
+
+    jitter = monitor_config["jitter"]
+    interval *= 1 + jitter * (2 * rand() - 1)
+
+    return max(int(interval), 1)
+
+class JobTracker() :
+
+    ## Maximum number of list pages to scan before falling back to per-job describe calls.
+    MAX_LIST_PAGES = 3
+    LIST_PAGE_SIZE = 100
+
+    def __init__(self, client, cache_ttl=None, clock=None, rand=None) :
+
+        self.client = client
+        self.cache_ttl = cache_ttl if cache_ttl is not None else DEFAULT_MONITOR_CONFIG["status_cache_ttl"]
+        self.clock = clock if clock else time
+        self.rand = rand if rand else random.random
+
+        # (job_type, job_name) -> (status, fetched_at)
+        self._statuses = {}
+        # (job_type, name_contains) -> set of job names that have not reached a terminal status
+        self._tracked = {}
+
+    def track(self, job_type, job_name, name_contains=None) :
+
+        group = (job_type, name_contains if name_contains else job_name)
+        self._tracked.setdefault(group, set()).add(job_name)
+        return group
+
+    def _cached_status(self, job_type, job_name) :
+
+        entry = self._statuses.get((job_type, job_name))
+        if entry and (entry[0] in TERMINAL_STATUSES or self.clock() - entry[1] < self.cache_ttl) :
+            return entry[0]
+
+    def _describe(self, job_type, job_name) :
+
+        spec = JOB_TYPES[job_type]
+        desc = getattr(self.client, spec["describe"])(**{spec["name_arg"]: job_name})
+        self._statuses[(job_type, job_name)] = (desc[spec["status"]], self.clock())
+        return desc[spec["status"]]
+
+    ## Whether the job was created by this or an earlier invocation. Only SageMaker's not-found
+    ## error means it was not: a throttled describe is left to check, which keeps the prior
+    ## status, rather than re-submitting a job whose name is taken. The job is not tracked, so
+    ## a missing one never joins a group refresh.
+    def exists(self, job_type, job_name) :
+
+        if self._cached_status(job_type, job_name) :
+            return True
+
+        try :
+            self._describe(job_type, job_name)
+        except ClientError as e :
+            error = e.response["Error"]
+            if error["Code"] == "ValidationException" and "Could not find" in error.get("Message", "") :
+                return False
+            if error["Code"] not in THROTTLING_ERRORS :
+                raise
+
+        return True
+
+    ## Refresh every tracked job in a group with one paginated list call filtered on the
+    ## group's common name fragment. Summaries of untracked jobs that match the filter are
+    ## cached too, so workflows sharing a base job name answer each other's status checks.
+    def refresh(self, group) :
+
+        job_type, name_contains = group
+        spec = JOB_TYPES[job_type]
+        pending = set(self._tracked.get(group, set()))
+
+        kwargs = {  "NameContains": name_contains,
+                    "SortBy": "CreationTime",
+                    "SortOrder": "Descending",
+                    "MaxResults": JobTracker.LIST_PAGE_SIZE}
+
+        now = self.clock()
+        for _ in range(JobTracker.MAX_LIST_PAGES) :
+
+            resp = getattr(self.client, spec["list"])(**kwargs)
+            for summary in resp[spec["summaries"]] :
+                name = summary[spec["name_arg"]]
+                self._statuses[(job_type, name)] = (summary[spec["status"]], now)
+                pending.discard(name)
+
+            if not pending or "NextToken" not in resp :
+                break
+            kwargs["NextToken"] = resp["NextToken"]
+
+        # jobs that fell outside of the scanned pages
+        for name in pending :
+            self._describe(job_type, name)
+
+        self._tracked[group] = {name for name in self._tracked.get(group, set())
+                                if self._statuses[(job_type, name)][0] not in TERMINAL_STATUSES}
+
+    def get_status(self, job_type, job_name, name_contains=None) :
+
+        status = self._cached_status(job_type, job_name)
+        if status :
+            return status
+
+        group = self.track(job_type, job_name, name_contains)
+        if len(self._tracked[group]) > 1 :
+            self.refresh(group)
+            return self._statuses[(job_type, job_name)][0]
+
+        status = self._describe(job_type, job_name)
+        if status in TERMINAL_STATUSES :
+            self._tracked[group].discard(job_name)
+
+        return status
+
+    ## Non-blocking status check. The workflow re-invokes the stage from a Wait state loop
+    ## until the job reaches a terminal status. The number of polls is carried in the
+    ## results so the backoff survives across stateless invocations.
+    def check(self, job_type, job_name, monitor_config, prior_results=None, name_contains=None) :
+
+        polls = prior_results["polls"] + 1 if prior_results and "polls" in prior_results else 0
+
+        try :
+            status = self.get_status(job_type, job_name, name_contains)
+        except ClientError as e :
+            if e.response["Error"]["Code"] not in THROTTLING_ERRORS :
+                raise
+            status = prior_results["status"] if prior_results and "status" in prior_results else "InProgress"
+
+        return {"status": status,
+                "polls": polls,
+                "poll_interval": next_poll_interval(job_type, polls, monitor_config, self.rand)}
+
+    def wait(self, job_type, job_name, context, monitor_config, name_contains=None) :
+
+        results = None
+        while True :
+
+            results = self.check(job_type, job_name, monitor_config, results, name_contains)
+            if results["status"] in TERMINAL_STATUSES :
+                break
+
+            # the seeded first wait can exceed the Lambda's time, blocking polls are capped
+            sleep_time = min(results["poll_interval"], monitor_config["max_poll_interval"])
+            if context.get_remaining_time_in_millis() > 2000*sleep_time :
+                sleep(sleep_time)
+            else :
+                raise TaskTimedOut("Task timed out.")
+
+        return {"status": results["status"]}
+
+## Results of the previous status check, present when a stage is re-invoked from the
+## workflow's Wait state loop.
+def get_prior_results(state, path) :
+
+    for key in path :
+        if not isinstance(state, dict) or key not in state :
+            return None
+        state = state[key]
+
+    return state
@@ -0,0 +1,242 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bp_s3_data import list_objects, open_object, parse_s3_uri
+
+## Metrics summary of the Batch Transform predictions, written next to them so the notebook
+## loads a few KB instead of every prediction. The shards are streamed in chunks, one thread
+## per shard, into fixed-size accumulators, so memory does not grow with the predictions.
+##
+## Keys with a segment starting with "_" are not predictions: the summary itself is written
+## under the output prefix in _summary/.
+SUMMARY_KEY = "_summary/metrics.json"
+SUMMARY_VERSION = 1
+MAX_WORKERS = 8
+
+DEFAULT_METRICS_CONFIG = {
+    "enabled": True,
+    "gt_index": 0,
+    "pred_index": 1,
+    "n_bins": 1000,
+    "calibration_bins": 10,
+    "threshold": 0.5,
+    "chunk_rows": 100000
+}
+
+def get_metrics_config(params) :
+
+    metrics_config = dict(DEFAULT_METRICS_CONFIG)
+    metrics_config.update(params.get("metrics-config", {}))
+
+    return metrics_config
+
+def is_prediction_key(key, prefix) :
+
+    # unless the prefix ends with "/", the first segment continues the prefix's last one
+    segments = key[len(prefix):].split("/")
+    segments = segments if not prefix or prefix.endswith("/") else segments[1:]
+    return not key.endswith("/") and not any(segment.startswith("_") for segment in segments)
+
+class ScoreHistogram() :
+
+    ## Same bins, counting and serialization as utils.metrics.ScoreHistogram in the notebook,
+    ## which loads the summary with ScoreHistogram.from_dict.
+    EDGE_DECIMALS = 9
+
+    def __init__(self, n_bins, lo=0.0, hi=1.0) :
+
+        self.n_bins = n_bins
+        self.lo = lo
+        self.hi = hi
+        self.pos = np.zeros(n_bins, dtype=np.int64)
+        self.neg = np.zeros(n_bins, dtype=np.int64)
+
+    def _bin(self, scores) :
+        # rounded first, so that a score on a bin edge, such as 0.29 * 100 = 28.999..., is
+        # counted in the bin that starts at the edge
+        idx = np.floor(np.round((np.asarray(scores, dtype=float) - self.lo) / (self.hi - self.lo) * self.n_bins, ScoreHistogram.EDGE_DECIMALS))
+        return np.clip(idx, 0, self.n_bins - 1).astype(np.int64)
+
+    def update(self, y, scores) :
+
+        idx = self._bin(scores)
+        self.pos += np.bincount(idx[y], minlength=self.n_bins)
+        self.neg += np.bincount(idx[~y], minlength=self.n_bins)
+
+        return self
+
+    def merge(self, other) :
+
+        self.pos += other.pos
+        self.neg += other.neg
+
+        return self
+
+    def to_dict(self) :
+        return {
+            "n_bins": self.n_bins,
+            "lo": self.lo,
+            "hi": self.hi,
+            "pos": self.pos.tolist(),
+            "neg": self.neg.tolist()
+        }
+
+    def counts(self, threshold) :
+
+        b = int(self._bin([threshold])[0])
+        tp, fp = int(self.pos[b:].sum()), int(self.neg[b:].sum())
+        n_pos, n_neg = int(self.pos.sum()), int(self.neg.sum())
+
+        return {"tp": tp, "fp": fp, "fn": n_pos - tp, "tn": n_neg - fp,
+                "error_bound": int(self.pos[b] + self.neg[b])}
+
+    def auc(self) :
+
+        n_pos, n_neg = int(self.pos.sum()), int(self.neg.sum())
+        fpr = np.r_[0.0, np.cumsum(self.neg[::-1]) / max(n_neg, 1)]
+        tpr = np.r_[0.0, np.cumsum(self.pos[::-1]) / max(n_pos, 1)]
+        auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+        error_bound = float(np.sum(self.pos * self.neg) / (2 * n_pos * n_neg)) if n_pos and n_neg else 0.0
+
+        return auc, error_bound
+
+class PredictionSummary() :
+
+    ## Score histograms per class, plus count, positives and score sum per calibration bin.
+    def __init__(self, n_bins, calibration_bins) :
+
+        self.hist = ScoreHistogram(n_bins)
+        self.calibration = ScoreHistogram(calibration_bins)
+        self.score_sum = np.zeros(calibration_bins)
+        self.rows = 0
+        self.skipped_rows = 0
+
+    def update(self, chunk, gt_index, pred_index) :
+
+        import pandas as pd
+
+        # lines that are not predictions, such as the one for the input's header, don't parse
+        y = pd.to_numeric(chunk[gt_index], errors="coerce")
+        scores = pd.to_numeric(chunk[pred_index], errors="coerce")
+        valid = (y.notnull() & scores.notnull()).values
+        self.skipped_rows += int((~valid).sum())
+
+        y = y.values[valid].astype(bool)
+        scores = scores.values[valid].astype(float)
+        self.hist.update(y, scores)
+        self.calibration.update(y, scores)
+        self.score_sum += np.bincount(self.calibration._bin(scores), weights=scores,
+                                      minlength=self.calibration.n_bins)
+        self.rows += len(scores)
+
+        return self
+
+    def merge(self, other) :
+
+        self.hist.merge(other.hist)
+        self.calibration.merge(other.calibration)
+        self.score_sum += other.score_sum
+        self.rows += other.rows
+        self.skipped_rows += other.skipped_rows
+
+        return self
+
+    def calibration_table(self) :
+
+        count = self.calibration.pos + self.calibration.neg
+        edges = np.linspace(self.calibration.lo, self.calibration.hi, self.calibration.n_bins + 1)
+        with np.errstate(invalid="ignore", divide="ignore") :
+            mean_score = np.where(count > 0, self.score_sum / count, np.nan)
+            positive_rate = np.where(count > 0, self.calibration.pos / count, np.nan)
+
+        # empty bins are null in the JSON
+        return {
+            "lo": edges[:-1].round(6).tolist(),
+            "hi": edges[1:].round(6).tolist(),
+            "count": count.tolist(),
+            "mean_score": [None if np.isnan(v) else round(float(v), 6) for v in mean_score],
+            "positive_rate": [None if np.isnan(v) else round(float(v), 6) for v in positive_rate]
+        }
+
+def summarize_shard(client, bucket, key, metrics_config) :
+
+    import pandas as pd
+
+    summary = PredictionSummary(metrics_config["n_bins"], metrics_config["calibration_bins"])
+    gt_index, pred_index = metrics_config["gt_index"], metrics_config["pred_index"]
+    chunks = pd.read_csv(open_object(client, bucket, key),
+                         header=None,
+                         usecols=[gt_index, pred_index],
+                         chunksize=metrics_config["chunk_rows"],
+                         dtype=str,
+                         skip_blank_lines=True)
+    for chunk in chunks :
+        summary.update(chunk, gt_index, pred_index)
+
+    return summary
+
+def summarize_predictions(client, output_uri, metrics_config, job_name=None) :
+
+    bucket, prefix = parse_s3_uri(output_uri)
+    keys = [obj["Key"] for obj in list_objects(client, bucket, prefix)
+            if obj["Size"] > 0 and is_prediction_key(obj["Key"], prefix)]
+    if not keys :
+        raise ValueError(f"No predictions found under {output_uri}.")
+
+    workers = min(MAX_WORKERS, len(keys))
+    with ThreadPoolExecutor(max_workers=workers) as pool :
+        shards = list(pool.map(lambda key: summarize_shard(client, bucket, key, metrics_config), keys))
+
+    summary = shards[0]
+    for shard in shards[1:] :
+        summary.merge(shard)
+
+    threshold = metrics_config["threshold"]
+    counts = summary.hist.counts(threshold)
+    predicted_pos = counts["tp"] + counts["fp"]
+    n_pos, n_neg = counts["tp"] + counts["fn"], counts["tn"] + counts["fp"]
+    auc, auc_error_bound = summary.hist.auc()
+
+    return {
+        "version": SUMMARY_VERSION,
+        "job_name": job_name,
+        "source_uri": output_uri,
+        "objects": len(keys),
+        "rows": summary.rows,
+        "skipped_rows": summary.skipped_rows,
+        "gt_index": metrics_config["gt_index"],
+        "pred_index": metrics_config["pred_index"],
+        "auc": auc,
+        "auc_error_bound": auc_error_bound,
+        "threshold": threshold,
+        "confusion_matrix": [[counts["tn"], counts["fp"]],
+                             [counts["fn"], counts["tp"]]],
+        "metrics": {
+            "tpr": counts["tp"] / n_pos if n_pos else 0.0,
+            "fpr": counts["fp"] / n_neg if n_neg else 0.0,
+            "precision": counts["tp"] / predicted_pos if predicted_pos else 1.0,
+            "accuracy": (counts["tp"] + counts["tn"]) / summary.rows if summary.rows else 0.0,
+            "error_bound": counts["error_bound"]
+        },
+        "histogram": summary.hist.to_dict(),
+        "calibration": summary.calibration_table()
+    }
+
+def get_summary_uri(output_uri) :
+    return f"{output_uri.rstrip('/')}/{SUMMARY_KEY}"
+
+def write_summary(client, output_uri, summary) :
+
+    bucket, key = parse_s3_uri(get_summary_uri(output_uri))
+    client.put_object(Bucket=bucket, Key=key, Body=json.dumps(summary).encode("utf-8"),
+                      ContentType="application/json")
+
+    return f"s3://{bucket}/{key}"
+
+def delete_summary(client, output_uri) :
+
+    # a summary left from an earlier run must not be read as the summary of a new job
+    bucket, key = parse_s3_uri(get_summary_uri(output_uri))
+    client.delete_object(Bucket=bucket, Key=key)
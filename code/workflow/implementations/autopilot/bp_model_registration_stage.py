@@ -2,30 +2,54 @@
 import json
 from time import gmtime, strftime, time
 
-import boto3
+from bp_clients import LazyClient, get_sagemaker_session, track_api_calls
+from bp_telemetry import span, track_telemetry
 
-from sagemaker import AutoML
-from sagemaker import Session
+sm = LazyClient("sagemaker")
 
+def model_exists(model_name) :
+    
+    try :
+        sm.describe_model(ModelName=model_name)
+        return True
+    except sm.exceptions.ClientError as e :
+        ## Only a missing model means "register it". Throttling, access and other errors must
+        ## not be mistaken for a missing model, or the stage recreates a model that exists.
+        error = e.response["Error"]
+        if error["Code"] == "ValidationException" and "Could not find" in error.get("Message", "") :
+            return False
+        raise
+
+@track_telemetry("model-registration")
+@track_api_calls
 def lambda_handler(event, context):
     
     try :
         model_config = event["Input"]["taskresult"]["Payload"]["model-config"]
         automl_config = event["Input"]["taskresult"]["Payload"]["automl-config"]
         security_config = event["Input"]["taskresult"]["Payload"]["security-config"]
+        
+        # a retried invocation finds the model already registered and skips loading the SDK
+        if model_exists(model_config["model_name"]) :
+            return event["Input"]["taskresult"]["Payload"]
+        
+        with span("import_sdk") :
+            from sagemaker import AutoML
     
-        session = Session()
-        automl_job = AutoML.attach(automl_config["job_name"],
-                                sagemaker_session=session)
-                                
-        model = automl_job.create_model(model_config["model_name"], 
-                                inference_response_keys=model_config["inference_response_keys"])
-                                
-        model.models[0].env["AUTOML_SPARSE_ENCODE_RECORDIO_PROTOBUF"] = "1"
+            session = get_sagemaker_session()
+            
+        with span("create_model") :
+            automl_job = AutoML.attach(automl_config["job_name"],
+                                    sagemaker_session=session)
+                                    
+            model = automl_job.create_model(model_config["model_name"], 
+                                    inference_response_keys=model_config["inference_response_keys"])
+                                    
+            model.models[0].env["AUTOML_SPARSE_ENCODE_RECORDIO_PROTOBUF"] = "1"
 
-        session.create_model(name=model_config["model_name"], 
-                            role = security_config["iam_role"],
-                            container_defs= model.pipeline_container_def(model_config["instance_type"]))
+            session.create_model(name=model_config["model_name"], 
+                                role = security_config["iam_role"],
+                                container_defs= model.pipeline_container_def(model_config["instance_type"]))
                                         
     except KeyError as e:
         raise KeyError(f"KeyError on input: {event}")
@@ -0,0 +1,198 @@
+import math
+
+from bp_s3_data import list_objects, parse_s3_uri
+from bp_transform_tuning import get_instance_vcpus
+
+## Instance types and counts of the Data Prep, transform and Clarify jobs, sized to the data by
+## the init stage. Settings of "auto" in a stage's config are planned; explicit ones are kept.
+##
+## A stage's throughput model is the MB of data a vCPU processes per second, the memory the job
+## needs per MB of data and the time its instances take to start. The planner scales up first:
+## one instance of the smallest candidate type that processes the data within target_seconds,
+## with the memory it needs. When none does, the largest type is scaled out, up to
+## max_instance_count. Batch Transform distributes whole objects, so a transform is not
+## scaled out beyond the number of objects it reads.
+##
+## The prepped data only exists once Data Prep has run. Unless the init stage reuses the output
+## of an earlier job, its size is estimated from the raw data and prepped_size_ratio, and its
+## objects from the vCPUs of the Data Prep cluster, which writes at least one part per core.
+AUTO = "auto"
+
+MEMORY_PER_VCPU_GB = {"c4": 1.875, "c5": 2, "m4": 4, "m5": 4, "r4": 7.625, "r5": 8}
+
+DEFAULT_PLANNER_CONFIG = {
+    "target_seconds": 900,
+    "prepped_size_ratio": 1.0,
+    "stages": {
+        "dataprep": {
+            "instance_types": ["ml.m5.xlarge", "ml.m5.2xlarge", "ml.m5.4xlarge", "ml.m5.12xlarge", "ml.m5.24xlarge"],
+            "max_instance_count": 8,
+            "mb_per_vcpu_second": 1.0,
+            "memory_factor": 4.0,
+            "startup_seconds": 300
+        },
+        "error-analysis": {
+            "instance_types": ["ml.m5.large", "ml.m5.xlarge", "ml.m5.2xlarge", "ml.m5.4xlarge"],
+            "max_instance_count": 10,
+            "mb_per_vcpu_second": 0.5,
+            "memory_factor": 0.0,
+            "startup_seconds": 300
+        },
+        "bias-analysis": {
+            "instance_types": ["ml.c5.xlarge", "ml.c5.2xlarge", "ml.c5.4xlarge", "ml.c5.9xlarge", "ml.c5.18xlarge"],
+            "max_instance_count": 4,
+            "mb_per_vcpu_second": 0.5,
+            "memory_factor": 5.0,
+            "startup_seconds": 240
+        },
+        "xai": {
+            "instance_types": ["ml.c5.xlarge", "ml.c5.2xlarge", "ml.c5.4xlarge", "ml.c5.9xlarge", "ml.c5.18xlarge"],
+            "max_instance_count": 4,
+            "mb_per_vcpu_second": 0.05,
+            "memory_factor": 5.0,
+            "startup_seconds": 240
+        }
+    }
+}
+
+## Stage: path of its instance settings in the payload, the dataset it processes, and whether
+## its instances split the data by object.
+PLANNED_STAGES = {
+    "dataprep": (["dataprep-config"], "raw", False),
+    "error-analysis": (["error-analysis-config", "transform-config"], "test", True),
+    "bias-analysis": (["bias-analysis-config"], "prepped", False),
+    "xai": (["xai-config"], "prepped", False)
+}
+
+def get_planner_config(payload) :
+
+    planner_config = dict(DEFAULT_PLANNER_CONFIG)
+    params = payload.get("pipeline-config", {}).get("resource-planner", {})
+    planner_config.update({k: v for k, v in params.items() if k != "stages"})
+
+    # a stage's model is merged with its defaults, so the config can set a single parameter
+    planner_config["stages"] = {}
+    for stage, model in DEFAULT_PLANNER_CONFIG["stages"].items() :
+        planner_config["stages"][stage] = dict(model, **params.get("stages", {}).get(stage, {}))
+
+    return planner_config
+
+def get_instance_memory_gb(instance_type) :
+
+    family = instance_type.split(".")[1] if instance_type.count(".") == 2 else ""
+    return get_instance_vcpus(instance_type) * MEMORY_PER_VCPU_GB.get(family, 4)
+
+def measure_dataset(client, data_uri) :
+
+    bucket, prefix = parse_s3_uri(data_uri)
+    sizes = [obj["Size"] for obj in list_objects(client, bucket, prefix)
+             if obj["Size"] > 0 and not obj["Key"].endswith("/")]
+
+    return {"uri": data_uri, "bytes": sum(sizes), "objects": len(sizes), "estimated": False}
+
+def estimate_seconds(dataset, instance_type, instance_count, model) :
+
+    mb = dataset["bytes"] / 2**20
+    rate = model["mb_per_vcpu_second"] * get_instance_vcpus(instance_type) * instance_count
+    return model["startup_seconds"] + mb / rate
+
+def plan_stage(dataset, params, model, target_seconds, split_by_object=False) :
+
+    mb = dataset["bytes"] / 2**20
+    memory_gb = mb * model["memory_factor"] / 1024
+    max_count = model["max_instance_count"]
+    if split_by_object :
+        max_count = max(min(max_count, dataset["objects"]), 1)
+
+    explicit_type = params.get("instance_type", AUTO) != AUTO
+    explicit_count = params.get("instance_count", AUTO) != AUTO
+    types = [params["instance_type"]] if explicit_type else model["instance_types"]
+
+    def fits(instance_type, instance_count) :
+        return (get_instance_memory_gb(instance_type) * instance_count >= memory_gb
+                and estimate_seconds(dataset, instance_type, instance_count, model) <= target_seconds)
+
+    # scale up: one instance, or the count set in the config, of the smallest type that fits
+    instance_count = int(params["instance_count"]) if explicit_count else 1
+    fitting = [t for t in types if fits(t, instance_count)]
+    if fitting :
+        instance_type = fitting[0]
+        reason = f"{instance_type} x {instance_count} is the smallest candidate that processes it within {target_seconds}s"
+    elif explicit_count :
+        instance_type = types[-1]
+        reason = f"no candidate processes it within {target_seconds}s on {instance_count}, {instance_type} is the largest"
+    else :
+        # scale out: as many of the largest type as the data needs, within the limits
+        instance_type = types[-1]
+        run_seconds = max(target_seconds - model["startup_seconds"], 1)
+        needed = max(math.ceil(mb / (model["mb_per_vcpu_second"] * get_instance_vcpus(instance_type) * run_seconds)),
+                     math.ceil(memory_gb / get_instance_memory_gb(instance_type)), 1)
+        instance_count = min(needed, max_count)
+        reason = f"no single instance processes it within {target_seconds}s, {instance_type} is scaled out to {instance_count}"
+        if needed > max_count :
+            limit = f"the {max_count} objects it reads" if max_count < model["max_instance_count"] else "max_instance_count"
+            reason += f", capped by {limit}, which exceeds the target"
+    if model["memory_factor"] :
+        reason += f"; it needs {memory_gb:.1f} GB of memory"
+
+    pinned = [k for k, explicit in (("instance_type", explicit_type), ("instance_count", explicit_count)) if explicit]
+    if pinned :
+        reason += f" ({' and '.join(pinned)} set in the config)"
+
+    size = f"{'an estimated ' if dataset['estimated'] else ''}{mb:.1f} MB in {dataset['objects']} objects"
+    return {
+        "instance_type": instance_type,
+        "instance_count": instance_count,
+        "dataset_mb": round(mb, 1),
+        "memory_gb": round(memory_gb, 2),
+        "estimated_seconds": round(estimate_seconds(dataset, instance_type, instance_count, model)),
+        "reason": f"{size}: {reason}."
+    }
+
+def plan_resources(client, payload, prepped=None) :
+
+    ## Plans the instances of every stage and writes them into the stage's config. Nothing is
+    ## measured when no stage has a setting of "auto". prepped is the measured prepped dataset,
+    ## when the output of an earlier Data Prep is reused.
+    planner_config = get_planner_config(payload)
+    target_seconds = planner_config["target_seconds"]
+
+    def get_params(path) :
+        params = payload
+        for key in path :
+            params = params[key]
+        return params
+
+    if not any(AUTO in (get_params(path).get("instance_type", AUTO), get_params(path).get("instance_count", AUTO))
+               for path, _, _ in PLANNED_STAGES.values()) :
+        return None
+
+    data_config = payload["data-config"]
+    datasets = {"raw": measure_dataset(client, f"s3://{data_config['s3_bucket']}/{data_config['raw_in_prefix']}/")}
+
+    plan = {}
+    for stage, (path, dataset, split_by_object) in PLANNED_STAGES.items() :
+
+        # without test data of its own, the error analysis runs on the prepped data
+        if dataset == "test" :
+            test_data_uri = payload["error-analysis-config"].get("test_data_uri")
+            if test_data_uri :
+                datasets["test"] = measure_dataset(client, test_data_uri)
+            else :
+                dataset = "prepped"
+        if dataset == "prepped" and "prepped" not in datasets :
+            datasets["prepped"] = prepped if prepped else {
+                "uri": None,
+                "bytes": int(datasets["raw"]["bytes"] * planner_config["prepped_size_ratio"]),
+                "objects": get_instance_vcpus(plan["dataprep"]["instance_type"]) * plan["dataprep"]["instance_count"],
+                "estimated": True
+            }
+
+        params = get_params(path)
+        plan[stage] = dict(plan_stage(datasets[dataset], params, planner_config["stages"][stage],
+                                      target_seconds, split_by_object),
+                           dataset=dataset)
+        params["instance_type"] = plan[stage]["instance_type"]
+        params["instance_count"] = plan[stage]["instance_count"]
+
+    return {"target_seconds": target_seconds, "datasets": datasets, "stages": plan}
@@ -0,0 +1,267 @@
+import csv
+import io
+from urllib.parse import urlparse
+
+## S3 requires every part of a multipart upload, except the last, to be at least 5 MB.
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+## Headers are read with ranged GETs that start small and double until the first line is
+## complete, up to MAX_HEADER_BYTES.
+HEADER_RANGE = 4 * 1024
+MAX_HEADER_BYTES = 1024 * 1024
+
+## The prepped data is CSV with a header, or Parquet when dataprep-config sets output_format.
+## Content types of each format for Data Wrangler, Autopilot and Clarify. Autopilot reads
+## CSV without a content type, as it did before Parquet was supported.
+DATA_FORMATS = {
+    "csv": {"datawrangler": "CSV", "automl": None, "clarify": "text/csv"},
+    "parquet": {"datawrangler": "PARQUET", "automl": "x-application/vnd.amazon+parquet", "clarify": "application/x-parquet"}
+}
+DEFAULT_DATA_FORMAT = "csv"
+CHUNK_ROWS = 50000
+
+def parse_s3_uri(s3_uri) :
+
+    parsed = urlparse(s3_uri, allow_fragments=False)
+    if parsed.query:
+        prefix= parsed.path.lstrip('/') + '?' + parsed.query
+    else:
+        prefix= parsed.path.lstrip('/')
+
+    return parsed.netloc, prefix
+
+## Yields every object under the prefix. Listing calls are paginated, so prefixes holding
+## more than 1000 objects are not truncated.
+def list_objects(client, bucket, prefix='') :
+
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix) :
+        for obj in page.get("Contents", []) :
+            yield obj
+
+def first_object(client, bucket, prefix='') :
+
+    for obj in list_objects(client, bucket, prefix) :
+        if obj["Size"] > 0 and not obj["Key"].endswith("/") :
+            return obj
+
+    return None
+
+def get_data_format(payload) :
+
+    data_format = payload.get("dataprep-config", {}).get("output_format", DEFAULT_DATA_FORMAT).lower()
+    if data_format not in DATA_FORMATS :
+        raise ValueError(f"{data_format} is not a supported output_format. Use one of {list(DATA_FORMATS)}.")
+
+    return data_format
+
+def read_header(client, data_uri, range_size=HEADER_RANGE, max_bytes=MAX_HEADER_BYTES, data_format=DEFAULT_DATA_FORMAT) :
+
+    bucket, prefix = parse_s3_uri(data_uri)
+    obj = first_object(client, bucket, prefix)
+    if not obj :
+        raise Exception(f"No data found under {data_uri}.")
+
+    # the columns of a Parquet file are in its footer
+    if data_format == "parquet" :
+        import pyarrow.parquet as pq
+        f = S3ObjectFile(client, bucket, obj["Key"], obj["Size"])
+        return {
+            "data_uri": data_uri,
+            "source": f"s3://{bucket}/{obj['Key']}",
+            "columns": pq.read_schema(f).names,
+            "bytes_read": f.bytes_read
+        }
+
+    size = range_size
+    while True :
+
+        end = min(size, obj["Size"]) - 1
+        data = client.get_object(Bucket=bucket, Key=obj["Key"], Range=f"bytes=0-{end}")["Body"].read()
+        newline = data.find(b"\n")
+        if newline >= 0 or end + 1 >= obj["Size"] :
+            break
+        if size >= max_bytes :
+            raise Exception(f"The header of s3://{bucket}/{obj['Key']} is longer than {max_bytes} bytes.")
+        size *= 2
+
+    line = data[:newline] if newline >= 0 else data
+    return {
+        "data_uri": data_uri,
+        "source": f"s3://{bucket}/{obj['Key']}",
+        "columns": next(csv.reader([line.decode("utf-8-sig").rstrip("\r")])),
+        "bytes_read": len(data)
+    }
+
+## Columns of the dataset under data_uri, from the schema resolved earlier in the workflow
+## when there is one.
+def get_columns(client, data_uri, schema=None, data_format=DEFAULT_DATA_FORMAT) :
+
+    if schema and schema["data_uri"] == data_uri :
+        return schema["columns"]
+
+    return read_header(client, data_uri, data_format=data_format)["columns"]
+
+def open_object(client, bucket, key) :
+    return client.get_object(Bucket=bucket, Key=key)["Body"]
+
+class S3ObjectFile(io.RawIOBase) :
+
+    ## Seekable, read-only view of an object, read with ranged GETs. pyarrow reads the footer
+    ## of a Parquet file through it, and then only the column chunks of the columns it needs.
+    def __init__(self, client, bucket, key, size) :
+
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.pos = 0
+        self.bytes_read = 0
+
+    def readable(self) :
+        return True
+
+    def seekable(self) :
+        return True
+
+    def tell(self) :
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET) :
+
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.size}[whence]
+        self.pos = max(base + offset, 0)
+        return self.pos
+
+    def read(self, n=-1) :
+
+        end = self.size if n is None or n < 0 else min(self.pos + n, self.size)
+        if self.pos >= end :
+            return b""
+
+        data = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.pos}-{end - 1}")["Body"].read()
+        self.pos += len(data)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer) :
+
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def read_object_frames(client, bucket, obj, data_format=DEFAULT_DATA_FORMAT, columns=None, chunk_rows=CHUNK_ROWS) :
+
+    ## DataFrames of up to chunk_rows rows of one listed object. With columns, only those are
+    ## parsed, and the other columns of a Parquet file are not downloaded.
+    if data_format == "parquet" :
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(S3ObjectFile(client, bucket, obj["Key"], obj["Size"]))
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns) :
+            yield batch.to_pandas()
+    else :
+        import pandas as pd
+        # every shard carries its own header
+        for chunk in pd.read_csv(open_object(client, bucket, obj["Key"]), chunksize=chunk_rows, usecols=columns) :
+            yield chunk
+
+def read_frames(client, data_uri, data_format=DEFAULT_DATA_FORMAT, columns=None, chunk_rows=CHUNK_ROWS) :
+
+    bucket, prefix = parse_s3_uri(data_uri)
+    for obj in list_objects(client, bucket, prefix) :
+        if obj["Size"] > 0 and not obj["Key"].endswith("/") :
+            yield from read_object_frames(client, bucket, obj, data_format, columns, chunk_rows)
+
+def convert_to_csv(client, data_uri, dst_uri, data_format=DEFAULT_DATA_FORMAT, chunk_rows=CHUNK_ROWS) :
+
+    ## Writes the dataset under data_uri as CSV shards with a header under dst_uri, one per
+    ## object, so consumers that only read CSV split the data as they would the original.
+    bucket, prefix = parse_s3_uri(data_uri)
+    dst_bucket, dst_prefix = parse_s3_uri(dst_uri.rstrip("/"))
+
+    objects = 0
+    for obj in list_objects(client, bucket, prefix) :
+
+        if obj["Size"] == 0 or obj["Key"].endswith("/") :
+            continue
+
+        name = obj["Key"].split("/")[-1].rsplit(".", 1)[0]
+        with S3MultipartWriter(client, dst_bucket, f"{dst_prefix}/{name}.csv") as writer :
+            header = True
+            for df in read_object_frames(client, bucket, obj, data_format, chunk_rows=chunk_rows) :
+                writer.write(df.to_csv(index=False, header=header).encode("utf-8"))
+                header = False
+        objects += 1
+
+    if not objects :
+        raise Exception(f"No data found under {data_uri}.")
+
+    return f"s3://{dst_bucket}/{dst_prefix}/"
+
+class S3MultipartWriter() :
+
+    ## Buffers at most one part in memory, so arbitrarily large objects can be written from
+    ## a Lambda function with a small, constant memory footprint.
+    def __init__(self, client, bucket, key, part_size=DEFAULT_PART_SIZE) :
+
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+
+        self.buffer = bytearray()
+        self.parts = []
+        self.bytes_written = 0
+        # file-like enough for writers such as pyarrow's, which check closed and tell()
+        self.closed = False
+        self.upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+
+        if exc_type :
+            self.abort()
+        else :
+            self.close()
+
+    def _upload_part(self, data) :
+
+        part_number = len(self.parts) + 1
+        etag = self.client.upload_part(Body=bytes(data),
+                                       Bucket=self.bucket,
+                                       Key=self.key,
+                                       PartNumber=part_number,
+                                       UploadId=self.upload_id)["ETag"]
+        self.parts.append({"ETag": etag, "PartNumber": part_number})
+
+    def tell(self) :
+        return self.bytes_written
+
+    def write(self, data) :
+
+        self.buffer.extend(data)
+        self.bytes_written += len(data)
+
+        while len(self.buffer) >= self.part_size :
+            self._upload_part(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+
+    def close(self) :
+
+        self.closed = True
+        if self.buffer or not self.parts :
+            self._upload_part(self.buffer)
+            self.buffer = bytearray()
+
+        self.client.complete_multipart_upload(Bucket=self.bucket,
+                                              Key=self.key,
+                                              UploadId=self.upload_id,
+                                              MultipartUpload={"Parts": self.parts})
+
+    def abort(self) :
+
+        self.closed = True
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
@@ -0,0 +1,178 @@
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter, time
+
+from bp_clients import counters
+from bp_job_tracker import get_prior_results
+
+## Per-stage timing and memory, carried in the workflow payload. Every invocation of a stage
+## appends one record to the payload's "telemetry" list:
+##
+##   {"stage", "start": epoch seconds, "ms", "n": invocations folded into the record,
+##    "peak_mb": tracemalloc peak, "rss_mb": max resident memory of the container,
+##    "api": {service: [calls, ms, bytes]},
+##    "spans": [[name, start ms, ms, bytes, api calls], ...]}
+##
+## Records are lists and short keys because the payload is bounded by the 256KB Step Functions
+## state limit. A stage polled in a Wait state loop adds a record per poll, so past
+## max_records_per_stage the newest records of a stage are folded into its last record.
+DEFAULT_TELEMETRY_CONFIG = {
+    "enabled": True,
+    "trace_memory": True,
+    "max_records_per_stage": 10
+}
+
+_invocation = {"start": None, "spans": []}
+
+def get_telemetry_config(event) :
+
+    telemetry_config = dict(DEFAULT_TELEMETRY_CONFIG)
+
+    # the init stage runs before the blueprint config is loaded and uses the defaults
+    wf_state = event.get("Input", {}) if isinstance(event, dict) else {}
+    for path in (["Payload"], ["config", "Payload"], ["taskresult", "Payload"]) :
+        payload = get_prior_results(wf_state, path)
+        if isinstance(payload, dict) and "pipeline-config" in payload :
+            telemetry_config.update(payload["pipeline-config"].get("telemetry", {}))
+            break
+
+    return telemetry_config
+
+def _ms(seconds) :
+    return round(seconds * 1000, 2)
+
+def _api_calls() :
+    return sum(counters["calls"].values())
+
+class Span() :
+
+    def __init__(self, name, nbytes=0) :
+        self.name = name
+        self.bytes = nbytes
+
+    def add_bytes(self, nbytes) :
+        self.bytes += nbytes
+
+@contextmanager
+def span(name, nbytes=0) :
+
+    ## Times a section of a stage. Outside of an instrumented handler, the span is a no-op.
+    s = Span(name, nbytes)
+    started, calls = perf_counter(), _api_calls()
+    try :
+        yield s
+    finally :
+        if _invocation["start"] is not None :
+            _invocation["spans"].append([name,
+                                         _ms(started - _invocation["start"]),
+                                         _ms(perf_counter() - started),
+                                         s.bytes,
+                                         _api_calls() - calls])
+
+def _api_usage() :
+
+    usage = {}
+    for call, n in counters["calls"].items() :
+        service = call.split(":")[0]
+        usage.setdefault(service, [0, 0.0, 0])[0] += n
+    for service, seconds in counters["seconds"].items() :
+        usage.setdefault(service, [0, 0.0, 0])[1] = _ms(seconds)
+    for service, nbytes in counters["bytes"].items() :
+        usage.setdefault(service, [0, 0.0, 0])[2] = nbytes
+
+    return usage
+
+def _fold(record, other) :
+
+    spans = {s[0]: list(s) for s in record["spans"]}
+    for s in other["spans"] :
+        if s[0] in spans :
+            for i in (2, 3, 4) :
+                spans[s[0]][i] += s[i]
+            spans[s[0]][2] = round(spans[s[0]][2], 2)
+        else :
+            spans[s[0]] = list(s)
+
+    api = {k: list(v) for k, v in record["api"].items()}
+    for service, usage in other["api"].items() :
+        totals = api.setdefault(service, [0, 0.0, 0])
+        api[service] = [totals[0] + usage[0], round(totals[1] + usage[1], 2), totals[2] + usage[2]]
+
+    folded = dict(record)
+    folded.update(ms=round(record["ms"] + other["ms"], 2),
+                  n=record["n"] + other["n"],
+                  peak_mb=max(record["peak_mb"] or 0, other["peak_mb"] or 0) or None,
+                  rss_mb=max(record["rss_mb"], other["rss_mb"]),
+                  api=api,
+                  spans=list(spans.values()))
+    return folded
+
+def add_record(payload, record, event, max_records) :
+
+    ## The payload a stage returns is not always the one that carries the telemetry of the
+    ## previous polls of the same stage, which is in the prior result of the polling loop.
+    ## Telemetry only grows along the workflow, so the longest history is the current one.
+    wf_state = event.get("Input", {}) if isinstance(event, dict) else {}
+    histories = [payload.get("telemetry")] + [get_prior_results(wf_state, [key, "Payload", "telemetry"])
+                                              for key in ("taskresult", "automlresult")]
+    histories = [h for h in histories if isinstance(h, list)]
+    telemetry = list(max(histories, key=lambda h: sum(r.get("n", 1) for r in h))) if histories else []
+
+    same_stage = [i for i, r in enumerate(telemetry) if r["stage"] == record["stage"]]
+    if len(same_stage) >= max_records :
+        telemetry[same_stage[-1]] = _fold(telemetry[same_stage[-1]], record)
+    else :
+        telemetry.append(record)
+
+    payload["telemetry"] = telemetry
+
+def track_telemetry(stage) :
+
+    ## Records the invocation of a stage's lambda_handler and appends it to the payload it
+    ## returns. Applied on top of track_api_calls, which resets the API counters.
+    def decorator(handler) :
+
+        @wraps(handler)
+        def wrapper(event, context) :
+
+            telemetry_config = get_telemetry_config(event)
+            if not telemetry_config["enabled"] :
+                return handler(event, context)
+
+            # tracemalloc slows down allocations, so memory tracing can be turned off
+            trace_memory = telemetry_config["trace_memory"] and not tracemalloc.is_tracing()
+            if trace_memory :
+                tracemalloc.start()
+
+            started = time()
+            _invocation["start"], _invocation["spans"] = perf_counter(), []
+            try :
+                payload = handler(event, context)
+            finally :
+                elapsed = perf_counter() - _invocation["start"]
+                peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+                if trace_memory :
+                    tracemalloc.stop()
+                spans, _invocation["start"] = _invocation["spans"], None
+
+            if isinstance(payload, dict) :
+                record = {
+                    "stage": stage,
+                    "start": round(started, 3),
+                    "ms": _ms(elapsed),
+                    "n": 1,
+                    "peak_mb": round(peak / 2**20, 2) if peak is not None else None,
+                    # ru_maxrss is in KB on Linux
+                    "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                    "api": _api_usage(),
+                    "spans": spans
+                }
+                add_record(payload, record, event, telemetry_config["max_records_per_stage"])
+
+            return payload
+
+        return wrapper
+
+    return decorator
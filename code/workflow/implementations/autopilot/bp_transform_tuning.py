@@ -0,0 +1,111 @@
+import math
+import re
+
+from bp_s3_data import list_objects, parse_s3_uri
+
+## Batch Transform sends one HTTP request per record with the SingleRecord strategy, so the
+## per-request overhead of the inference pipeline dominates for narrow tabular rows. With
+## MultiRecord, records are batched into mini-batches of up to MaxPayloadInMB, and up to
+## MaxConcurrentTransforms requests run in parallel on every instance.
+##
+## The settings are derived from the row width, measured on a sample of the data, and the size
+## of the dataset: one request per vCPU, and mini-batches small enough that every request slot
+## gets several of them, between 1 MB and the 6 MB the inference containers accept by default.
+## SageMaker requires MaxConcurrentTransforms * MaxPayloadInMB <= 100.
+SAMPLE_BYTES = 256 * 1024
+MIN_PAYLOAD_MB = 1
+MAX_PAYLOAD_MB = 6
+MAX_TOTAL_PAYLOAD_MB = 100
+MIN_BATCHES_PER_WORKER = 4
+
+AUTO = "auto"
+
+def get_instance_vcpus(instance_type) :
+
+    ## ml.m5.xlarge has 4 vCPUs, ml.m5.4xlarge 16; large and smaller sizes have 2.
+    size = instance_type.split(".")[-1]
+    match = re.match(r"^(\d*)xlarge$", size)
+    if not match :
+        return 2
+
+    return 4 * int(match.group(1)) if match.group(1) else 4
+
+def measure_rows(client, data_uri, sample_bytes=SAMPLE_BYTES) :
+
+    ## Average row width from the first bytes of the first shard, after its header, and the
+    ## size of the dataset from the listing.
+    bucket, prefix = parse_s3_uri(data_uri)
+    objects = [obj for obj in list_objects(client, bucket, prefix) if obj["Size"] > 0 and not obj["Key"].endswith("/")]
+    if not objects :
+        raise Exception(f"No data found under {data_uri}.")
+
+    first = objects[0]
+    end = min(sample_bytes, first["Size"]) - 1
+    sample = client.get_object(Bucket=bucket, Key=first["Key"], Range=f"bytes=0-{end}")["Body"].read()
+
+    # only complete lines are counted, unless the sample is the whole object
+    if end + 1 < first["Size"] :
+        sample = sample[:sample.rfind(b"\n") + 1]
+    header = sample.find(b"\n") + 1
+    lines = sample[header:].count(b"\n") + (0 if sample.endswith(b"\n") or end + 1 < first["Size"] else 1)
+    row_bytes = (len(sample) - header) / lines if lines else max(len(sample) - header, 1)
+
+    dataset_bytes = sum(obj["Size"] for obj in objects)
+    return {
+        "objects": len(objects),
+        "dataset_bytes": dataset_bytes,
+        "row_bytes": round(row_bytes, 1),
+        "rows": int(max(dataset_bytes - header * len(objects), 0) / row_bytes) if row_bytes else 0
+    }
+
+def plan_transform(measurements, xform_params) :
+
+    ## Settings set explicitly in transform-config are kept; "auto" or missing ones are tuned.
+    strategy = xform_params.get("strategy", AUTO)
+    max_payload = xform_params.get("max_payload")
+    max_concurrent = xform_params.get("max_concurrent_transforms")
+
+    # records can only be batched when the input is split into lines
+    if strategy in (AUTO, None) :
+        strategy = "MultiRecord" if xform_params.get("split_type") == "Line" else "SingleRecord"
+
+    vcpus = get_instance_vcpus(xform_params["instance_type"])
+    # Batch Transform distributes whole objects, so instances beyond the number of objects idle
+    instances = max(min(xform_params["instance_count"], measurements["objects"]), 1)
+
+    if not max_payload :
+        if strategy == "MultiRecord" :
+            bytes_per_worker = measurements["dataset_bytes"] / (instances * vcpus)
+            max_payload = math.ceil(bytes_per_worker / MIN_BATCHES_PER_WORKER / 2**20)
+            max_payload = min(max(max_payload, MIN_PAYLOAD_MB), MAX_PAYLOAD_MB)
+        else :
+            max_payload = MIN_PAYLOAD_MB
+        # a mini-batch holds at least one record
+        max_payload = min(max(max_payload, math.ceil(measurements["row_bytes"] / 2**20)), MAX_TOTAL_PAYLOAD_MB)
+
+    if not max_concurrent :
+        max_concurrent = max(min(vcpus, MAX_TOTAL_PAYLOAD_MB // max_payload), 1)
+
+    records_per_batch = int(max_payload * 2**20 / measurements["row_bytes"]) if strategy == "MultiRecord" else 1
+    return dict(measurements,
+                strategy=strategy,
+                max_payload=int(max_payload),
+                max_concurrent_transforms=int(max_concurrent),
+                vcpus=vcpus,
+                instances=instances,
+                records_per_batch=max(min(records_per_batch, measurements["rows"]), 1))
+
+def get_throughput(job_desc, records, estimated=False) :
+
+    ## Records per second of the job's run time, from the start to the end of the transform.
+    started, ended = job_desc.get("TransformStartTime"), job_desc.get("TransformEndTime")
+    if not started or not ended or not records :
+        return None
+
+    seconds = (ended - started).total_seconds()
+    return {
+        "records": records,
+        "seconds": round(seconds, 1),
+        "records_per_sec": round(records / seconds, 1) if seconds > 0 else None,
+        "estimated_records": estimated
+    }
@@ -1,50 +1,32 @@
 # Author: Dylan Tong, AWS
 import json
-from time import sleep
-from urllib.parse import urlparse
 
-import pandas as pd
+from bp_clients import LazyClient, get_sagemaker_session, track_api_calls
+from bp_eval_cache import EvalCache
+from bp_job_tracker import JobTracker, get_monitor_config, get_prior_results
+from bp_s3_data import DATA_FORMATS, get_columns, get_data_format
+from bp_telemetry import span, track_telemetry
 
-import boto3
+sm = LazyClient("sagemaker")
+s3 = LazyClient("s3")
+tracker = JobTracker(sm)
+eval_cache = EvalCache(s3, sm, "xai-config")
 
-from sagemaker import clarify
-from sagemaker import Session
-
-sm = boto3.client("sagemaker")
-s3 = boto3.client("s3")
-
-class TaskTimedOut(Exception): pass
-
-def get_first_matching_s3_key(bucket, prefix=''):
-        
-    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': 1}
-    resp = s3.list_objects_v2(**kwargs)
-    for obj in resp['Contents']:
-        return obj['Key']
-
-def get_samples(data_uri, num_samples) :
-    
-    #obtains sample rows from the first object of many at the specified location
-    parsed = urlparse(data_uri, allow_fragments=False)
-    if parsed.query:
-        prefix= parsed.path.lstrip('/') + '?' + parsed.query
-    else:
-        prefix= parsed.path.lstrip('/')
-        
-    key = get_first_matching_s3_key(parsed.netloc,prefix)
-    uri = f"s3://{parsed.netloc}/{key}"
-    return pd.read_csv(uri,nrows=num_samples)
-    
 def create_clarify_xai_job(event) :
     
+    # pandas and the SDK are only needed to create the job, not to monitor it
+    from sagemaker import clarify
+    from bp_baseline import DEFAULT_MAX_OBJECTS, DEFAULT_RESERVOIR_SIZE, build_baseline
+    
     role = event["Input"]["Payload"]["security-config"]["iam_role"]
     data_params = event["Input"]["Payload"]["data-config"]
     ws_params = event["Input"]["Payload"]["workspace-config"]
     model_params = event["Input"]["Payload"]["model-config"]
     automl_params = event["Input"]["Payload"]["automl-config"]
     xai_params = event["Input"]["Payload"]["xai-config"]
+    data_format = get_data_format(event["Input"]["Payload"])
     
-    session = Session()
+    session = get_sagemaker_session()
     clarify_processor = clarify.SageMakerClarifyProcessor(role=role,
                                                         instance_count=xai_params["instance_count"],
                                                         instance_type=xai_params["instance_type"],
@@ -56,10 +38,18 @@ def create_clarify_xai_job(event) :
     
     shap_params = xai_params["shap-config"]
     num_samples = shap_params["num_samples"]
-    df = get_samples(automl_params["data_uri"],shap_params["num_samples"])
     
-    samples = df.iloc[:,:-1].values.tolist()
-    columns = df.columns.to_list()
+    baseline_params = xai_params.get("baseline-config", {})
+    with span("build_baseline") :
+        baseline, _ = build_baseline(s3, 
+                                           automl_params["data_uri"],
+                                           automl_params["target_name"],
+                                           baseline_params.get("num_rows", num_samples),
+                                           baseline_params.get("reservoir_size", DEFAULT_RESERVOIR_SIZE),
+                                           stratify=automl_params["problem_type"] != "Regression",
+                                           data_format=data_format,
+                                           max_objects=baseline_params.get("max_objects", DEFAULT_MAX_OBJECTS))
+    samples = baseline.values.tolist()
     
     shap_config = clarify.SHAPConfig(baseline=samples,
                                     num_samples=num_samples,
@@ -68,8 +58,8 @@ def create_clarify_xai_job(event) :
     data_config = clarify.DataConfig(s3_data_input_path=automl_params["data_uri"], 
                                     s3_output_path=output_uri,
                                     label=automl_params["target_name"],
-                                    headers=columns,
-                                    dataset_type='text/csv')
+                                    headers=get_columns(s3, automl_params["data_uri"], automl_params.get("schema"), data_format),
+                                    dataset_type=DATA_FORMATS[data_format]["clarify"])
         
     model_config = clarify.ModelConfig(model_name=model_params["model_name"],
                                     instance_type=model_params["instance_type"],
@@ -83,39 +73,37 @@ def create_clarify_xai_job(event) :
                                     wait=False,
                                     logs=False)
 
-def monitor_job_status(job_name, context) :
-    
-    sleep_time = 60
-    while True: 
-    
-        status = sm.describe_processing_job(ProcessingJobName = job_name)["ProcessingJobStatus"]
-
-        if status == 'Completed' : 
-            break;
-                    
-        elif status in ('Failed', 'Stopped') :
-            break;
-        else :
-            
-            if context.get_remaining_time_in_millis() > 2000*sleep_time :
-                sleep(sleep_time)
-            else :
-                raise TaskTimedOut("Task timed out.")
-    
-    return {"status":status}
-
-
+@track_telemetry("xai-analysis")
+@track_api_calls
 def lambda_handler(event, context):
     
     xai_params = event["Input"]["Payload"]["xai-config"]
     job_name = xai_params["job_name"]
+    monitor_config = get_monitor_config(event["Input"]["Payload"])
+    reuse_results = event["Input"]["Payload"].get("pipeline-config", {}).get("reuse_eval_results", True)
+    
+    # an earlier run with the same model, data and config already produced this result
+    with span("eval_cache") :
+        cache, memo = eval_cache.begin(event, reuse_results)
+    if memo :
+        xai_params["job-results"] = memo["job-results"]
+        xai_params["eval-cache"] = cache
+        return event["Input"]["Payload"]
+    
+    if not tracker.exists("processing", job_name) :
+        with span("create_job") :
+            create_clarify_xai_job(event)
     
-    try :
-        sm.describe_processing_job(ProcessingJobName = job_name)
-    except Exception as e:
-        create_clarify_xai_job(event) 
+    if monitor_config["mode"] == "blocking" :
+        with span("wait") :
+            results = tracker.wait("processing", job_name, context, monitor_config, xai_params["job_base_name"])
+    else :
+        prior_results = get_prior_results(event["Input"], ["taskresult", "Payload", "xai-config", "job-results"])
+        with span("check_status") :
+            results = tracker.check("processing", job_name, monitor_config, prior_results, xai_params["job_base_name"])
     
-    results = monitor_job_status(job_name, context)
+    eval_cache.end(event, cache, job_name, results)
     
     event["Input"]["Payload"]["xai-config"]["job-results"] = results
+    event["Input"]["Payload"]["xai-config"]["eval-cache"] = cache
     return event["Input"]["Payload"]
\ No newline at end of file
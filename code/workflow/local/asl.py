@@ -0,0 +1,393 @@
+"""Interpreter for the subset of the Amazon States Language used by the blueprint.
+
+States run as generators on a discrete-event scheduler over a virtual clock: a state yields
+("sleep", seconds) to let simulated time pass, and a Parallel state yields
+("parallel", branches) to run its branches concurrently. Supported state types are Task,
+Choice, Wait, Pass, Parallel, Succeed and Fail, with InputPath, Parameters, ResultPath,
+OutputPath, Retry and Catch. The execution history is recorded with the event types and
+details of the Step Functions history API.
+"""
+import copy
+import heapq
+import json
+
+## Maximum size of the data passed between states.
+MAX_PAYLOAD_BYTES = 256 * 1024
+
+class StateMachineError(Exception) :
+
+    def __init__(self, error, cause="") :
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+def get_path(data, path, context=None) :
+
+    ## Reference paths: "$", "$.a.b" and "$$.a.b" for the context object.
+    if path.startswith("$$") :
+        data, path = context, path[1:]
+    if path == "$" :
+        return data
+
+    for key in path[2:].split(".") :
+        if not isinstance(data, dict) or key not in data :
+            raise KeyError(path)
+        data = data[key]
+
+    return data
+
+def set_path(data, path, value) :
+
+    if path == "$" :
+        return value
+
+    data = copy.deepcopy(data) if isinstance(data, dict) else {}
+    node = data
+    keys = path[2:].split(".")
+    for key in keys[:-1] :
+        if not isinstance(node.get(key), dict) :
+            node[key] = {}
+        node = node[key]
+    node[keys[-1]] = value
+
+    return data
+
+def resolve_parameters(template, data, context) :
+
+    if isinstance(template, dict) :
+        resolved = {}
+        for key, value in template.items() :
+            if key.endswith(".$") :
+                try :
+                    resolved[key[:-2]] = get_path(data, value, context)
+                except KeyError :
+                    raise StateMachineError("States.Runtime", f"The JSONPath '{value}' could not be found in the input.")
+            else :
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+
+    if isinstance(template, list) :
+        return [resolve_parameters(value, data, context) for value in template]
+
+    return template
+
+COMPARISONS = {
+    "Equals": lambda a, b: a == b,
+    "LessThan": lambda a, b: a < b,
+    "LessThanEquals": lambda a, b: a <= b,
+    "GreaterThan": lambda a, b: a > b,
+    "GreaterThanEquals": lambda a, b: a >= b
+}
+
+TYPES = {"String": str, "Numeric": (int, float), "Boolean": bool, "Timestamp": str}
+
+def evaluate_rule(rule, data) :
+
+    if "And" in rule :
+        return all(evaluate_rule(r, data) for r in rule["And"])
+    if "Or" in rule :
+        return any(evaluate_rule(r, data) for r in rule["Or"])
+    if "Not" in rule :
+        return not evaluate_rule(rule["Not"], data)
+
+    try :
+        value = get_path(data, rule["Variable"])
+        present = True
+    except KeyError :
+        value, present = None, False
+
+    if "IsPresent" in rule :
+        return present == rule["IsPresent"]
+    if not present :
+        return False
+
+    for op, expected in rule.items() :
+        for type_name, kind in TYPES.items() :
+            if op.startswith(type_name) and op[len(type_name):] in COMPARISONS :
+                if not isinstance(value, kind) or (type_name == "Numeric" and isinstance(value, bool)) :
+                    return False
+                return COMPARISONS[op[len(type_name):]](value, expected)
+
+    raise StateMachineError("States.Runtime", f"Unsupported choice rule {rule}.")
+
+def error_matches(error, error_equals) :
+    return error in error_equals or "States.ALL" in error_equals
+
+class Scheduler() :
+
+    ## Runs generators in virtual time order. Each task is a generator; a task waiting on a
+    ## Parallel state resumes with the list of its branches' results, or with the first
+    ## error raised by a branch.
+    def __init__(self, clock) :
+        self.clock = clock
+        self.queue = []
+        self.seq = 0
+
+    def _push(self, at, task, value=None, error=None) :
+        self.seq += 1
+        heapq.heappush(self.queue, (at, self.seq, task, value, error))
+
+    def _finish(self, task, value, error) :
+
+        parent = task["parent"]
+        if parent is None :
+            task["result"], task["error"] = value, error
+        elif parent.get("failed") :
+            pass
+        elif error :
+            parent["failed"] = True
+            self._push(self.clock(), parent, error=error)
+        else :
+            parent["results"][task["index"]] = value
+            parent["pending"] -= 1
+            if parent["pending"] == 0 :
+                self._push(self.clock(), parent, parent["results"])
+
+    def run(self, gen) :
+
+        root = {"gen": gen, "parent": None}
+        self._push(self.clock(), root)
+
+        while self.queue :
+
+            at, _, task, value, error = heapq.heappop(self.queue)
+            # branches of a failed Parallel state are abandoned
+            if task["parent"] is not None and task["parent"].get("failed") :
+                task["gen"].close()
+                continue
+
+            self.clock.now = at
+            try :
+                cmd = task["gen"].throw(error) if error else task["gen"].send(value)
+            except StopIteration as stop :
+                self._finish(task, stop.value, None)
+                continue
+            except Exception as e :
+                self._finish(task, None, e)
+                continue
+
+            if cmd[0] == "sleep" :
+                self._push(at + cmd[1], task)
+            elif cmd[0] == "parallel" :
+                task["results"] = [None] * len(cmd[1])
+                task["pending"] = len(cmd[1])
+                task["failed"] = False
+                for i, branch in enumerate(cmd[1]) :
+                    self._push(at, {"gen": branch, "parent": task, "index": i})
+                if not cmd[1] :
+                    self._push(at, task, [])
+
+        if root.get("error") :
+            raise root["error"]
+        return root.get("result")
+
+class Execution() :
+
+    def __init__(self, definition, input, clock, tasks, context=None) :
+
+        ## tasks maps a Task resource to a generator function(state_name, parameters, context)
+        ## that returns the result of the task.
+        self.definition = definition
+        self.input = input
+        self.clock = clock
+        self.tasks = tasks
+        self.context = context if context else {}
+
+        self.events = []
+        self.status = "RUNNING"
+        self.output = None
+        self.error = None
+        self.cause = None
+
+    def _event(self, event_type, **details) :
+
+        event = {"timestamp": self.clock.datetime(), "type": event_type, "id": len(self.events) + 1,
+                 "previousEventId": len(self.events)}
+        event.update(details)
+        self.events.append(event)
+
+    def _check_size(self, data, state_name) :
+
+        if len(json.dumps(data)) > MAX_PAYLOAD_BYTES :
+            raise StateMachineError("States.DataLimitExceeded",
+                                    f"The state/task '{state_name}' returned a result with a size exceeding the maximum number of bytes service limit.")
+
+    def run(self) :
+
+        self._event("ExecutionStarted", executionStartedEventDetails={"input": json.dumps(self.input)})
+        try :
+            self.output = Scheduler(self.clock).run(self.run_states(self.definition, self.input))
+            self.status = "SUCCEEDED"
+            self._event("ExecutionSucceeded", executionSucceededEventDetails={"output": json.dumps(self.output)})
+        except StateMachineError as e :
+            self.status, self.error, self.cause = "FAILED", e.error, e.cause
+            self._event("ExecutionFailed", executionFailedEventDetails={"error": e.error, "cause": e.cause})
+
+        return self.output
+
+    def run_states(self, states, data) :
+
+        name = states["StartAt"]
+        while name :
+
+            state = states["States"][name]
+            self._event(f"{state['Type']}StateEntered", stateEnteredEventDetails={"name": name, "input": json.dumps(data)})
+
+            handler = getattr(self, f"_run_{state['Type'].lower()}", None)
+            if not handler :
+                raise StateMachineError("States.Runtime", f"{state['Type']} states are not supported.")
+            data, next_name = yield from handler(name, state, data)
+            self._check_size(data, name)
+
+            self._event(f"{state['Type']}StateExited", stateExitedEventDetails={"name": name, "output": json.dumps(data)})
+            name = next_name
+
+        return data
+
+    def _next(self, state) :
+        return None if state.get("End") or state["Type"] in ("Succeed", "Fail") else state["Next"]
+
+    def _input(self, state, data) :
+        path = state.get("InputPath", "$")
+        return get_path(data, path) if path else {}
+
+    def _filter(self, state, data) :
+        path = state.get("OutputPath", "$")
+        return get_path(data, path) if path else {}
+
+    def _output(self, state, data, result) :
+
+        if "ResultPath" in state and state["ResultPath"] is None :
+            output = data
+        else :
+            output = set_path(data, state.get("ResultPath", "$"), result)
+
+        return self._filter(state, output)
+
+    def _run_pass(self, name, state, data) :
+
+        effective = self._input(state, data)
+        if "Parameters" in state :
+            effective = resolve_parameters(state["Parameters"], effective, self.context)
+        result = state.get("Result", effective)
+
+        return self._output(state, data, result), self._next(state)
+        yield
+
+    def _run_succeed(self, name, state, data) :
+
+        return self._filter(state, self._input(state, data)), None
+        yield
+
+    def _run_fail(self, name, state, data) :
+
+        raise StateMachineError(state.get("Error", "States.Fail"), state.get("Cause", ""))
+        yield
+
+    def _run_choice(self, name, state, data) :
+
+        effective = self._input(state, data)
+        for rule in state.get("Choices", []) :
+            if evaluate_rule(rule, effective) :
+                next_name = rule["Next"]
+                break
+        else :
+            if "Default" not in state :
+                raise StateMachineError("States.NoChoiceMatched", f"No Matches! in state {name}")
+            next_name = state["Default"]
+
+        return self._filter(state, effective), next_name
+        yield
+
+    def _run_wait(self, name, state, data) :
+
+        effective = self._input(state, data)
+        if "Seconds" in state :
+            seconds = state["Seconds"]
+        elif "SecondsPath" in state :
+            seconds = get_path(effective, state["SecondsPath"])
+        else :
+            raise StateMachineError("States.Runtime", f"Unsupported wait in state {name}.")
+
+        yield ("sleep", seconds)
+        return self._filter(state, effective), self._next(state)
+
+    def _run_parallel(self, name, state, data) :
+
+        effective = self._input(state, data)
+        if "Parameters" in state :
+            effective = resolve_parameters(state["Parameters"], effective, self.context)
+
+        self._event("ParallelStateStarted")
+        try :
+            results = yield ("parallel", [self.run_states(branch, copy.deepcopy(effective)) for branch in state["Branches"]])
+        except StateMachineError as e :
+            self._event("ParallelStateFailed")
+            return (yield from self._catch(state, data, e))
+        self._event("ParallelStateSucceeded")
+
+        return self._output(state, data, results), self._next(state)
+
+    def _run_task(self, name, state, data) :
+
+        resource = state["Resource"]
+        if resource not in self.tasks :
+            raise StateMachineError("States.Runtime", f"Unsupported resource {resource}.")
+        resource_type, _, resource_name = resource.split(":::")[-1].partition(":")
+
+        retries = {}
+        context = copy.deepcopy(self.context)
+        context["State"] = {"Name": name, "RetryCount": 0}
+
+        while True :
+
+            effective = self._input(state, data)
+            parameters = resolve_parameters(state.get("Parameters", effective), effective, context)
+            self._event("TaskScheduled", taskScheduledEventDetails={"resourceType": resource_type, "resource": resource_name,
+                                                                     "parameters": json.dumps(parameters)})
+            self._event("TaskStarted", taskStartedEventDetails={"resourceType": resource_type, "resource": resource_name})
+
+            start = self.clock()
+            try :
+                result = yield from self.tasks[resource](name, parameters, context)
+                if "TimeoutSeconds" in state and self.clock() - start > state["TimeoutSeconds"] :
+                    raise StateMachineError("States.Timeout", "")
+            except StateMachineError as e :
+
+                self._event("TaskFailed", taskFailedEventDetails={"resourceType": resource_type, "resource": resource_name,
+                                                                   "error": e.error, "cause": e.cause})
+                retry = self._retrier(state, e, retries)
+                if retry is None :
+                    return (yield from self._catch(state, data, e))
+
+                yield ("sleep", retry)
+                context["State"]["RetryCount"] += 1
+                continue
+
+            self._event("TaskSucceeded", taskSucceededEventDetails={"resourceType": resource_type, "resource": resource_name,
+                                                                     "output": json.dumps(result)})
+            return self._output(state, data, result), self._next(state)
+
+    def _retrier(self, state, error, retries) :
+
+        ## Returns the delay before the next attempt, or None when the error is not retried.
+        for i, retrier in enumerate(state.get("Retry", [])) :
+            if error_matches(error.error, retrier["ErrorEquals"]) :
+
+                attempts = retries.get(i, 0)
+                if attempts >= retrier.get("MaxAttempts", 3) :
+                    return None
+                retries[i] = attempts + 1
+                return retrier.get("IntervalSeconds", 1) * retrier.get("BackoffRate", 2.0) ** attempts
+
+        return None
+
+    def _catch(self, state, data, error) :
+
+        for catcher in state.get("Catch", []) :
+            if error_matches(error.error, catcher["ErrorEquals"]) :
+                output = set_path(data, catcher.get("ResultPath", "$"), {"Error": error.error, "Cause": error.cause})
+                return output, catcher["Next"]
+
+        raise error
+        yield
@@ -0,0 +1,897 @@
+"""In-process stand-ins for the S3, SageMaker and Step Functions APIs used by the blueprint.
+
+The fakes keep their state in memory and run on a virtual clock: SageMaker jobs complete
+after a simulated duration and Step Functions executions run to completion in simulated
+time, so a whole blueprint runs in seconds. Only the operations and response fields that
+the stages, BPRunner and SFNMonitor use are implemented. Calls accept keyword arguments
+only, like botocore clients, and fail with botocore's ClientError.
+"""
+import csv
+import hashlib
+import io
+import json
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+from asl import Execution, StateMachineError
+
+ACCOUNT = "123456789012"
+
+class VirtualClock() :
+
+    def __init__(self, start=1600000000.0) :
+        self.now = float(start)
+
+    def __call__(self) :
+        return self.now
+
+    def advance(self, seconds) :
+        self.now += seconds
+
+    def sleep(self, seconds) :
+        self.advance(seconds)
+
+    def gmtime(self, secs=None) :
+        return time.gmtime(self.now if secs is None else secs)
+
+    def datetime(self, secs=None) :
+        return datetime.fromtimestamp(self.now if secs is None else secs, tz=timezone.utc)
+
+class CallLog() :
+
+    ## API calls made against the fakes, attributed to the scope that made them: the name of
+    ## the workflow state being executed, or "client" for calls made outside of a workflow.
+    def __init__(self) :
+        self.calls = Counter()
+        self.retries = Counter()
+        self.throttled = Counter()
+        self.listeners = []
+        self._scopes = ["client"]
+
+    @contextmanager
+    def scope(self, name) :
+
+        self._scopes.append(name)
+        try :
+            yield
+        finally :
+            self._scopes.pop()
+
+    def record(self, service, op, attempts, throttled) :
+
+        key = (self._scopes[-1], f"{service}:{op}")
+        self.calls[key] += 1
+        self.retries[key] += attempts - 1
+        self.throttled[key] += throttled
+
+        for listener in self.listeners :
+            listener(service, op, attempts, throttled)
+
+    def by_scope(self) :
+
+        scopes = {}
+        for (scope, op), n in self.calls.items() :
+            usage = scopes.setdefault(scope, {"api_calls": 0, "retries": 0, "throttled": 0, "calls": {}})
+            usage["api_calls"] += n
+            usage["retries"] += self.retries[(scope, op)]
+            usage["throttled"] += self.throttled[(scope, op)]
+            usage["calls"][op] = n
+
+        return scopes
+
+class ThrottlePolicy() :
+
+    ## Token bucket per operation: `rate` calls per (virtual) second in bursts of up to
+    ## `burst` calls. Calls are also throttled at random with the given probability.
+    def __init__(self, rate=None, burst=None, probability=0.0, seed=0) :
+
+        self.rate = rate
+        self.burst = burst if burst else (rate if rate else 1)
+        self.probability = probability
+        self.rand = random.Random(seed)
+        self._buckets = {}
+
+    def admit(self, op, now) :
+
+        if self.probability and self.rand.random() < self.probability :
+            return False
+        if not self.rate :
+            return True
+
+        tokens, last = self._buckets.get(op, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1 :
+            self._buckets[op] = (tokens, now)
+            return False
+
+        self._buckets[op] = (tokens - 1, now)
+        return True
+
+def client_error(op, code, message, status=400) :
+    return ClientError({"Error": {"Code": code, "Message": message},
+                        "ResponseMetadata": {"HTTPStatusCode": status}}, op)
+
+def op_name(method) :
+
+    # list_objects_v2 -> ListObjectsV2, describe_auto_ml_job -> DescribeAutoMLJob
+    return "".join(part[:1].upper() + part[1:] for part in method.replace("auto_ml", "autoML").split("_"))
+
+def api(method) :
+
+    ## Marks a method as an API operation: it is subject to throttling and retries, and is
+    ## recorded in the call log.
+    op = op_name(method.__name__)
+
+    @wraps(method)
+    def wrapper(self, **kwargs) :
+        self._admit(op)
+        return method(self, **kwargs)
+
+    return wrapper
+
+class FakeService() :
+
+    SERVICE = None
+
+    ## Throttled calls are retried with capped exponential backoff, like botocore's retry
+    ## modes, up to MAX_ATTEMPTS attempts. The backoff advances the virtual clock.
+    MAX_ATTEMPTS = 10
+    BASE_BACKOFF = 0.05
+    MAX_BACKOFF = 20
+
+    def __init__(self, clock, log, throttle=None) :
+
+        self.clock = clock
+        self.log = log
+        self.throttle = throttle
+        self.exceptions = SimpleNamespace(ClientError=ClientError)
+
+    def _admit(self, op) :
+
+        attempts, throttled = 1, 0
+        while self.throttle and not self.throttle.admit(op, self.clock()) :
+
+            throttled += 1
+            if attempts >= self.MAX_ATTEMPTS :
+                self.log.record(self.SERVICE, op, attempts, throttled)
+                raise client_error(op, "ThrottlingException", "Rate exceeded")
+
+            self.clock.advance(min(self.MAX_BACKOFF, self.BASE_BACKOFF * 2 ** attempts) * self.throttle.rand.random())
+            attempts += 1
+
+        self.log.record(self.SERVICE, op, attempts, throttled)
+
+def etag(data) :
+    return '"{}"'.format(hashlib.md5(data).hexdigest())
+
+class FakePaginator() :
+
+    def __init__(self, method, token_arg, token_key) :
+
+        self.method = method
+        self.token_arg = token_arg
+        self.token_key = token_key
+
+    def paginate(self, **kwargs) :
+
+        while True :
+            page = self.method(**kwargs)
+            yield page
+            if not page.get(self.token_key) :
+                break
+            kwargs[self.token_arg] = page[self.token_key]
+
+class FakeS3(FakeService) :
+
+    SERVICE = "s3"
+
+    def __init__(self, clock, log, throttle=None) :
+
+        super().__init__(clock, log, throttle)
+        self.buckets = {}
+        self.uploads = {}
+
+        self.exceptions.NoSuchKey = type("NoSuchKey", (ClientError,), {})
+        self.exceptions.NoSuchBucket = type("NoSuchBucket", (ClientError,), {})
+
+    def _bucket(self, op, bucket) :
+
+        if bucket not in self.buckets :
+            raise self.exceptions.NoSuchBucket({"Error": {"Code": "NoSuchBucket",
+                                                          "Message": f"The bucket {bucket} does not exist."}}, op)
+        return self.buckets[bucket]
+
+    def _object(self, op, bucket, key) :
+
+        objects = self._bucket(op, bucket)
+        if key not in objects :
+            raise self.exceptions.NoSuchKey({"Error": {"Code": "NoSuchKey",
+                                                       "Message": "The specified key does not exist."}}, op)
+        return objects[key]
+
+    def put(self, bucket, key, data, metadata=None, tag=None) :
+
+        ## Writes an object without going through the API, for seeding data and for the
+        ## outputs of simulated jobs.
+        data = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+        self.buckets.setdefault(bucket, {})[key] = {
+            "Body": data,
+            "ETag": tag if tag else etag(data),
+            "LastModified": self.clock.datetime(),
+            "Metadata": dict(metadata) if metadata else {}
+        }
+
+    def objects(self, bucket, prefix="") :
+        return sorted(k for k in self.buckets.get(bucket, {}) if k.startswith(prefix))
+
+    def read(self, bucket, key) :
+        return self.buckets[bucket][key]["Body"]
+
+    @api
+    def create_bucket(self, Bucket, **kwargs) :
+
+        self.buckets.setdefault(Bucket, {})
+        return {"Location": f"/{Bucket}"}
+
+    @api
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, **kwargs) :
+
+        self._bucket("PutObject", Bucket)
+        if hasattr(Body, "read") :
+            Body = Body.read()
+        self.put(Bucket, Key, Body, Metadata)
+
+        return {"ETag": self.buckets[Bucket][Key]["ETag"]}
+
+    @api
+    def get_object(self, Bucket, Key, Range=None, **kwargs) :
+
+        obj = self._object("GetObject", Bucket, Key)
+        data = obj["Body"]
+        resp = {"ETag": obj["ETag"], "LastModified": obj["LastModified"], "Metadata": dict(obj["Metadata"])}
+
+        if Range :
+            start, end = Range[len("bytes="):].split("-")
+            start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+            resp["ContentRange"] = f"bytes {start}-{end}/{len(data)}"
+            data = data[start:end + 1]
+
+        resp["ContentLength"] = len(data)
+        resp["Body"] = io.BytesIO(data)
+        return resp
+
+    @api
+    def head_object(self, Bucket, Key, **kwargs) :
+
+        obj = self._object("HeadObject", Bucket, Key)
+        return {"ETag": obj["ETag"], "LastModified": obj["LastModified"],
+                "ContentLength": len(obj["Body"]), "Metadata": dict(obj["Metadata"])}
+
+    @api
+    def delete_object(self, Bucket, Key, **kwargs) :
+
+        self._bucket("DeleteObject", Bucket).pop(Key, None)
+        return {}
+
+    @api
+    def copy_object(self, Bucket, Key, CopySource, Metadata=None, MetadataDirective="COPY", **kwargs) :
+
+        src = self._object("CopyObject", CopySource["Bucket"], CopySource["Key"])
+        metadata = Metadata if MetadataDirective == "REPLACE" else src["Metadata"]
+        self._bucket("CopyObject", Bucket)
+        self.put(Bucket, Key, src["Body"], metadata)
+
+        return {"CopyObjectResult": {"ETag": self.buckets[Bucket][Key]["ETag"]}}
+
+    @api
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None, StartAfter=None, **kwargs) :
+
+        objects = self._bucket("ListObjectsV2", Bucket)
+        keys = [k for k in sorted(objects) if k.startswith(Prefix)]
+        after = ContinuationToken if ContinuationToken else StartAfter
+        if after :
+            keys = [k for k in keys if k > after]
+
+        page = keys[:MaxKeys]
+        resp = {"Name": Bucket, "Prefix": Prefix, "MaxKeys": MaxKeys, "KeyCount": len(page),
+                "IsTruncated": len(keys) > MaxKeys}
+        if page :
+            resp["Contents"] = [{"Key": k, "ETag": objects[k]["ETag"], "Size": len(objects[k]["Body"]),
+                                 "LastModified": objects[k]["LastModified"], "StorageClass": "STANDARD"}
+                                for k in page]
+        if resp["IsTruncated"] :
+            resp["NextContinuationToken"] = page[-1]
+
+        return resp
+
+    def get_paginator(self, operation_name) :
+
+        if operation_name != "list_objects_v2" :
+            raise NotImplementedError(f"No paginator for {operation_name}.")
+        return FakePaginator(self.list_objects_v2, "ContinuationToken", "NextContinuationToken")
+
+    @api
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs) :
+
+        self._bucket("CreateMultipartUpload", Bucket)
+        upload_id = hashlib.md5(f"{Bucket}/{Key}/{len(self.uploads)}".encode("utf-8")).hexdigest()
+        self.uploads[upload_id] = {"Bucket": Bucket, "Key": Key, "Metadata": Metadata, "Parts": {}}
+
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def _upload(self, op, upload_id) :
+
+        if upload_id not in self.uploads :
+            raise client_error(op, "NoSuchUpload", "The specified upload does not exist.", 404)
+        return self.uploads[upload_id]
+
+    @api
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body=b"", **kwargs) :
+
+        data = Body.read() if hasattr(Body, "read") else bytes(Body)
+        self._upload("UploadPart", UploadId)["Parts"][PartNumber] = data
+
+        return {"ETag": etag(data)}
+
+    @api
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs) :
+
+        upload = self._upload("CompleteMultipartUpload", UploadId)
+        parts = [upload["Parts"][p["PartNumber"]] for p in MultipartUpload["Parts"]]
+        digest = hashlib.md5(b"".join(hashlib.md5(p).digest() for p in parts)).hexdigest()
+
+        tag = f'"{digest}-{len(parts)}"'
+        self.put(Bucket, Key, b"".join(parts), upload["Metadata"], tag=tag)
+        del self.uploads[UploadId]
+
+        return {"Bucket": Bucket, "Key": Key, "ETag": tag}
+
+    @api
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs) :
+
+        self.uploads.pop(UploadId, None)
+        return {}
+
+## Fields of each kind of SageMaker job, as returned by its describe and list operations.
+JOB_FIELDS = {
+    "processing": {
+        "name": "ProcessingJobName",
+        "arn": "ProcessingJobArn",
+        "status": "ProcessingJobStatus",
+        "start": "ProcessingStartTime",
+        "end": "ProcessingEndTime",
+        "arn_type": "processing-job"
+    },
+    "transform": {
+        "name": "TransformJobName",
+        "arn": "TransformJobArn",
+        "status": "TransformJobStatus",
+        "start": "TransformStartTime",
+        "end": "TransformEndTime",
+        "arn_type": "transform-job"
+    },
+    "automl": {
+        "name": "AutoMLJobName",
+        "arn": "AutoMLJobArn",
+        "status": "AutoMLJobStatus",
+        "start": None,
+        "end": "EndTime",
+        "arn_type": "automl-job"
+    }
+}
+
+## Simulated run time of each kind of job, in seconds, and the time each spends provisioning
+## instances before it starts.
+DEFAULT_DURATIONS = {"processing": 900, "transform": 600, "automl": 3600}
+DEFAULT_STARTUP = {"processing": 120, "transform": 180, "automl": 60}
+
+class FakeSageMaker(FakeService) :
+
+    SERVICE = "sagemaker"
+
+    def __init__(self, clock, log, s3, throttle=None, durations=None, startup=None, jitter=0.0,
+                 failures=None, objective_value=0.93, seed=0, region="us-east-1") :
+
+        super().__init__(clock, log, throttle)
+        self.s3 = s3
+        self.durations = dict(DEFAULT_DURATIONS, **(durations if durations else {}))
+        self.startup = dict(DEFAULT_STARTUP, **(startup if startup else {}))
+        self.jitter = jitter
+        # jobs whose name contains one of these fragments fail
+        self.failures = list(failures) if failures else []
+        self.objective_value = objective_value
+        self.seed = seed
+        self.region = region
+
+        self.jobs = {job_type: {} for job_type in JOB_FIELDS}
+        self.models = {}
+
+    def _arn(self, kind, name) :
+        return f"arn:aws:sagemaker:{self.region}:{ACCOUNT}:{kind}/{name.lower()}"
+
+    def _create_job(self, op, job_type, name, request) :
+
+        if name in self.jobs[job_type] :
+            raise client_error(op, "ResourceInUse", f"Job {name} already exists.")
+
+        rand = random.Random(f"{self.seed}:{job_type}:{name}")
+        duration = self.durations[job_type] * (1 + self.jitter * (2 * rand.random() - 1))
+        self.jobs[job_type][name] = {
+            "type": job_type,
+            "name": name,
+            "request": request,
+            "created": self.clock(),
+            "startup": self.startup[job_type],
+            "duration": duration,
+            "failed": any(fragment in name for fragment in self.failures),
+            "materialized": False
+        }
+
+        return {JOB_FIELDS[job_type]["arn"]: self._arn(JOB_FIELDS[job_type]["arn_type"], name)}
+
+    def _job(self, op, job_type, name) :
+
+        if name not in self.jobs[job_type] :
+            raise client_error(op, "ValidationException", f"Could not find job {name}.")
+        return self.jobs[job_type][name]
+
+    def _status(self, job) :
+
+        if self.clock() < job["created"] + job["startup"] + job["duration"] :
+            return "InProgress"
+        if job["failed"] :
+            return "Failed"
+
+        # outputs are uploaded at the end of the job
+        if not job["materialized"] :
+            job["materialized"] = True
+            getattr(self, f"_write_{job['type']}_outputs")(job)
+        return "Completed"
+
+    def _describe_job(self, job) :
+
+        fields = JOB_FIELDS[job["type"]]
+        status = self._status(job)
+        started = job["created"] + job["startup"]
+
+        desc = dict(job["request"])
+        desc.update({
+            fields["name"]: job["name"],
+            fields["arn"]: self._arn(fields["arn_type"], job["name"]),
+            fields["status"]: status,
+            "CreationTime": self.clock.datetime(job["created"]),
+            "LastModifiedTime": self.clock.datetime(min(self.clock(), started + job["duration"]))
+        })
+        if fields["start"] and self.clock() >= started :
+            desc[fields["start"]] = self.clock.datetime(started)
+        if status != "InProgress" :
+            desc[fields["end"]] = self.clock.datetime(started + job["duration"])
+        if status == "Failed" :
+            desc["FailureReason"] = "Simulated failure."
+
+        return desc
+
+    def _list_jobs(self, job_type, NameContains=None, StatusEquals=None, SortBy="CreationTime",
+                   SortOrder="Descending", MaxResults=10, NextToken=None, **kwargs) :
+
+        fields = JOB_FIELDS[job_type]
+        jobs = [j for j in self.jobs[job_type].values() if not NameContains or NameContains in j["name"]]
+        if SortBy == "Name" :
+            jobs.sort(key=lambda j: j["name"], reverse=(SortOrder == "Descending"))
+        else :
+            jobs.sort(key=lambda j: j["created"], reverse=(SortOrder == "Descending"))
+
+        summaries = []
+        for job in jobs :
+            desc = self._describe_job(job)
+            if StatusEquals and desc[fields["status"]] != StatusEquals :
+                continue
+            summaries.append({k: desc[k] for k in [fields["name"], fields["arn"], fields["status"],
+                                                   "CreationTime", "LastModifiedTime", fields["end"]] if k in desc})
+
+        start = int(NextToken) if NextToken else 0
+        resp = {"page": summaries[start:start + MaxResults]}
+        if start + MaxResults < len(summaries) :
+            resp["NextToken"] = str(start + MaxResults)
+
+        return resp
+
+    def _write_processing_outputs(self, job) :
+
+        request = job["request"]
+        inputs = [i["S3Input"]["S3Uri"] for i in request.get("ProcessingInputs", [])
+                  if "S3Input" in i and i["InputName"] not in ("flow", "analysis_config")]
+
+        for output in request.get("ProcessingOutputConfig", {}).get("Outputs", []) :
+            bucket, prefix = parse_uri(output["S3Output"]["S3Uri"])
+
+            # Data Wrangler writes its output to a child directory of the configured one
+            if "data-wrangler" in request["AppSpecification"]["ImageUri"] :
+                parquet = self._output_content_type(request, output) == "PARQUET"
+                for n, (src_bucket, key) in enumerate(self._data_objects(inputs)) :
+                    data = self.s3.read(src_bucket, key)
+                    if parquet :
+                        self.s3.put(bucket, f"{prefix}/{job['name']}/part-{n:05d}.parquet", to_parquet(data))
+                    else :
+                        self.s3.put(bucket, f"{prefix}/{job['name']}/part-{n:05d}.csv", data)
+            else :
+                self.s3.put(bucket, f"{prefix}/analysis.json", json.dumps({"version": "1.0", "job": job["name"]}))
+
+    def _output_content_type(self, request, output) :
+
+        ## Content type of a Data Wrangler output, from the job's --output-config argument.
+        for arg in request["AppSpecification"].get("ContainerArguments", []) :
+            if arg.startswith("--output-config") :
+                output_config = json.loads(arg[len("--output-config"):].strip().strip("'"))
+                return output_config.get(output["OutputName"], {}).get("content_type", "CSV")
+
+        return "CSV"
+
+    def _write_transform_outputs(self, job) :
+
+        ## Predictions are "label,score" lines. The scores are noisy functions of the label
+        ## in the last column of the input, so that evaluation metrics are meaningful.
+        request = job["request"]
+        src = request["TransformInput"]["DataSource"]["S3DataSource"]["S3Uri"]
+        bucket, prefix = parse_uri(request["TransformOutput"]["S3OutputPath"])
+        rand = random.Random(f"{self.seed}:{job['name']}")
+
+        for src_bucket, key in self._data_objects([src]) :
+
+            lines = []
+            for row in csv.reader(io.StringIO(self.s3.read(src_bucket, key).decode("utf-8"))) :
+                try :
+                    label = int(float(row[-1]))
+                except (ValueError, IndexError) :
+                    continue
+                score = min(1.0, max(0.0, rand.gauss(0.7 if label else 0.3, 0.2)))
+                lines.append(f"{label},{score:.6f}")
+
+            self.s3.put(bucket, f"{prefix}/{key.split('/')[-1]}.out", "\n".join(lines) + "\n")
+
+    def _write_automl_outputs(self, job) :
+
+        ## Model artifacts of the candidates. Their content depends on the training data and
+        ## not on the job, so that retraining on the same data produces the same artifacts.
+        request = job["request"]
+        inputs = [c["DataSource"]["S3DataSource"]["S3Uri"] for c in request["InputDataConfig"]]
+        data = hashlib.sha256()
+        for bucket, key in self._data_objects(inputs) :
+            data.update(self.s3.read(bucket, key))
+
+        for rank in range(3) :
+            for container in self._candidate(job, rank)["InferenceContainers"] :
+                bucket, key = parse_uri(container["ModelDataUrl"])
+                model = f"{data.hexdigest()}:{rank}:{key.split('/')[-1]}"
+                self.s3.put(bucket, key, hashlib.sha256(model.encode("utf-8")).digest())
+
+    def _data_objects(self, uris) :
+
+        for uri in uris :
+            bucket, prefix = parse_uri(uri)
+            for key in self.s3.objects(bucket, prefix) :
+                if not key.endswith("/") and self.s3.read(bucket, key) :
+                    yield bucket, key
+
+    def _candidate(self, job, rank=0) :
+
+        name = job["name"]
+        output = job["request"]["OutputDataConfig"]["S3OutputPath"]
+        images = ["sagemaker-sklearn-automl", "sagemaker-xgboost", "sagemaker-sklearn-automl"]
+
+        # candidates train in overlapping waves between the job's analysis and its finalization
+        started = job["created"] + job["startup"]
+        created = started + job["duration"] * (0.25 + 0.15 * rank)
+        ended = created + job["duration"] * 0.3
+        training_job = f"{name[:20]}-{rank:03d}-training"
+
+        return {
+            "CandidateName": f"{name[:20]}-{rank:03d}-candidate",
+            "CandidateStatus": "Completed",
+            "ObjectiveStatus": "Succeeded",
+            "FinalAutoMLJobObjectiveMetric": {
+                "MetricName": job["request"]["AutoMLJobObjective"]["MetricName"],
+                "Value": round(self.objective_value - 0.01 * rank, 4)
+            },
+            "InferenceContainers": [{
+                "Image": f"683313688378.dkr.ecr.{self.region}.amazonaws.com/{image}:latest",
+                "ModelDataUrl": f"{output}/{name}/candidate-{rank}/model-{n}.tar.gz",
+                "Environment": {"AUTOML_TRANSFORM_MODE": "feature-transform"} if n == 0 else {}
+            } for n, image in enumerate(images)],
+            "CandidateSteps": [{
+                "CandidateStepType": "AWS::SageMaker::TrainingJob",
+                "CandidateStepArn": self._arn("training-job", training_job),
+                "CandidateStepName": training_job
+            }],
+            "CreationTime": self.clock.datetime(created),
+            "EndTime": self.clock.datetime(ended),
+            "LastModifiedTime": self.clock.datetime(ended)
+        }
+
+    @api
+    def create_processing_job(self, ProcessingJobName, **kwargs) :
+        return self._create_job("CreateProcessingJob", "processing", ProcessingJobName, kwargs)
+
+    @api
+    def describe_processing_job(self, ProcessingJobName) :
+        return self._describe_job(self._job("DescribeProcessingJob", "processing", ProcessingJobName))
+
+    @api
+    def list_processing_jobs(self, **kwargs) :
+
+        resp = self._list_jobs("processing", **kwargs)
+        resp["ProcessingJobSummaries"] = resp.pop("page")
+        return resp
+
+    @api
+    def create_transform_job(self, TransformJobName, ModelName, **kwargs) :
+
+        if ModelName not in self.models :
+            raise client_error("CreateTransformJob", "ValidationException", f"Could not find model {ModelName}.")
+        return self._create_job("CreateTransformJob", "transform", TransformJobName, dict(kwargs, ModelName=ModelName))
+
+    @api
+    def describe_transform_job(self, TransformJobName) :
+        return self._describe_job(self._job("DescribeTransformJob", "transform", TransformJobName))
+
+    @api
+    def list_transform_jobs(self, **kwargs) :
+
+        resp = self._list_jobs("transform", **kwargs)
+        resp["TransformJobSummaries"] = resp.pop("page")
+        return resp
+
+    @api
+    def create_auto_ml_job(self, AutoMLJobName, **kwargs) :
+        return self._create_job("CreateAutoMLJob", "automl", AutoMLJobName, kwargs)
+
+    @api
+    def describe_auto_ml_job(self, AutoMLJobName) :
+
+        job = self._job("DescribeAutoMLJob", "automl", AutoMLJobName)
+        desc = self._describe_job(job)
+        desc["AutoMLJobSecondaryStatus"] = desc["AutoMLJobStatus"]
+        if desc["AutoMLJobStatus"] == "Completed" :
+            desc["BestCandidate"] = self._candidate(job)
+
+        return desc
+
+    @api
+    def list_auto_ml_jobs(self, **kwargs) :
+
+        resp = self._list_jobs("automl", **kwargs)
+        resp["AutoMLJobSummaries"] = resp.pop("page")
+        return resp
+
+    @api
+    def list_candidates_for_auto_ml_job(self, AutoMLJobName, **kwargs) :
+
+        job = self._job("ListCandidatesForAutoMLJob", "automl", AutoMLJobName)
+        if self._status(job) != "Completed" :
+            return {"Candidates": []}
+
+        candidates = [self._candidate(job, rank) for rank in range(3)]
+        return {"Candidates": candidates}
+
+    @api
+    def create_model(self, ModelName, ExecutionRoleArn, PrimaryContainer=None, Containers=None, **kwargs) :
+
+        if ModelName in self.models :
+            raise client_error("CreateModel", "ValidationException", f"Model {ModelName} already exists.")
+
+        model = {"ModelName": ModelName,
+                 "ModelArn": self._arn("model", ModelName),
+                 "ExecutionRoleArn": ExecutionRoleArn,
+                 "CreationTime": self.clock.datetime()}
+        if PrimaryContainer :
+            model["PrimaryContainer"] = PrimaryContainer
+        if Containers :
+            model["Containers"] = Containers
+        self.models[ModelName] = model
+
+        return {"ModelArn": model["ModelArn"]}
+
+    @api
+    def describe_model(self, ModelName) :
+
+        if ModelName not in self.models :
+            raise client_error("DescribeModel", "ValidationException", f"Could not find model {ModelName}.")
+        return dict(self.models[ModelName])
+
+def parse_uri(s3_uri) :
+
+    bucket, _, prefix = s3_uri[len("s3://"):].partition("/")
+    return bucket, prefix.rstrip("/")
+
+def to_json(obj) :
+
+    ## Round trip through JSON, as data does when it is passed between states. Timestamps
+    ## are serialized the way the service integrations return them, in epoch milliseconds.
+    return json.loads(json.dumps(obj, default=lambda v: int(v.timestamp() * 1000) if isinstance(v, datetime) else str(v)))
+
+def to_parquet(data) :
+
+    ## CSV with a header as Parquet, as Data Wrangler writes it with the PARQUET content type.
+    import pandas as pd
+
+    buffer = io.BytesIO()
+    pd.read_csv(io.BytesIO(data)).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+class FakeStepFunctions(FakeService) :
+
+    SERVICE = "stepfunctions"
+
+    ## SageMaker service integrations (.sync) poll the job at this interval.
+    SYNC_POLL_INTERVAL = 30
+    ## Lambda tasks take at least this long.
+    INVOKE_LATENCY = 0.05
+
+    def __init__(self, clock, log, sagemaker, functions, throttle=None, region="us-east-1") :
+
+        ## functions maps a Lambda function ARN to a callable(state_name, payload).
+        super().__init__(clock, log, throttle)
+        self.sagemaker = sagemaker
+        self.functions = functions
+        self.region = region
+
+        self.state_machines = {}
+        self.executions = {}
+
+        self.tasks = {
+            "arn:aws:states:::lambda:invoke": self._invoke_lambda,
+            "arn:aws:states:::sagemaker:createProcessingJob.sync": self._run_processing_job
+        }
+
+    def _machine(self, op, arn) :
+
+        if arn not in self.state_machines :
+            raise client_error(op, "StateMachineDoesNotExist", f"State Machine Does Not Exist: '{arn}'")
+        return self.state_machines[arn]
+
+    def _execution(self, op, arn) :
+
+        if arn not in self.executions :
+            raise client_error(op, "ExecutionDoesNotExist", f"Execution Does Not Exist: '{arn}'")
+        return self.executions[arn]
+
+    def _invoke_lambda(self, state_name, params, context) :
+
+        ## The function runs synchronously in real time. The virtual time it spends, in
+        ## throttling backoffs or blocking waits, is rewound and replayed as a sleep so that
+        ## concurrent branches of a Parallel state interleave correctly.
+        fn = self.functions.get(params["FunctionName"])
+        if not fn :
+            raise StateMachineError("Lambda.ResourceNotFoundException", f"Function not found: {params['FunctionName']}")
+
+        start = self.clock()
+        error = None
+        try :
+            with self.log.scope(state_name) :
+                payload = fn(state_name, to_json(params.get("Payload", {})))
+        except Exception as e :
+            error = StateMachineError(type(e).__name__, str(e))
+        elapsed = self.clock() - start
+        self.clock.now = start
+
+        yield ("sleep", max(elapsed, self.INVOKE_LATENCY))
+        if error :
+            raise error
+
+        return {"ExecutedVersion": "$LATEST", "Payload": to_json(payload), "StatusCode": 200}
+
+    def _run_processing_job(self, state_name, params, context) :
+
+        with self.log.scope(state_name) :
+            self.sagemaker.create_processing_job(**params)
+
+        while True :
+
+            with self.log.scope(state_name) :
+                desc = self.sagemaker.describe_processing_job(ProcessingJobName=params["ProcessingJobName"])
+            if desc["ProcessingJobStatus"] in ("Completed", "Failed", "Stopped") :
+                break
+            yield ("sleep", self.SYNC_POLL_INTERVAL)
+
+        if desc["ProcessingJobStatus"] != "Completed" :
+            raise StateMachineError("States.TaskFailed", json.dumps(to_json(desc)))
+
+        return to_json(desc)
+
+    @api
+    def create_state_machine(self, name, definition, roleArn, **kwargs) :
+
+        arn = f"arn:aws:states:{self.region}:{ACCOUNT}:stateMachine:{name}"
+        self.state_machines[arn] = {"name": name, "stateMachineArn": arn, "definition": definition,
+                                    "roleArn": roleArn, "status": "ACTIVE", "type": "STANDARD",
+                                    "creationDate": self.clock.datetime()}
+        return {"stateMachineArn": arn, "creationDate": self.state_machines[arn]["creationDate"]}
+
+    @api
+    def list_state_machines(self, **kwargs) :
+        return {"stateMachines": [{k: m[k] for k in ["name", "stateMachineArn", "type", "creationDate"]}
+                                  for m in self.state_machines.values()]}
+
+    @api
+    def describe_state_machine(self, stateMachineArn) :
+        return dict(self._machine("DescribeStateMachine", stateMachineArn))
+
+    @api
+    def start_execution(self, stateMachineArn, input="{}", name=None, **kwargs) :
+
+        ## Executions run to completion before the call returns. The virtual clock is left
+        ## at the end of the execution.
+        machine = self._machine("StartExecution", stateMachineArn)
+        name = name if name else f"execution-{len(self.executions) + 1:04d}"
+        arn = f"arn:aws:states:{self.region}:{ACCOUNT}:execution:{machine['name']}:{name}"
+        if arn in self.executions :
+            raise client_error("StartExecution", "ExecutionAlreadyExists", f"Execution Already Exists: '{arn}'")
+
+        execution = Execution(json.loads(machine["definition"]), json.loads(input), self.clock, self.tasks,
+                              context={"Execution": {"Id": arn, "Name": name},
+                                       "StateMachine": {"Id": stateMachineArn, "Name": machine["name"]}})
+        start = self.clock.datetime()
+        execution.run()
+
+        self.executions[arn] = {
+            "executionArn": arn,
+            "stateMachineArn": stateMachineArn,
+            "name": name,
+            "status": execution.status,
+            "startDate": start,
+            "stopDate": self.clock.datetime(),
+            "input": input,
+            "events": execution.events
+        }
+        if execution.status == "SUCCEEDED" :
+            self.executions[arn]["output"] = json.dumps(execution.output)
+        else :
+            self.executions[arn]["error"] = execution.error
+            self.executions[arn]["cause"] = execution.cause
+
+        return {"executionArn": arn, "startDate": start}
+
+    @api
+    def describe_execution(self, executionArn) :
+
+        execution = self._execution("DescribeExecution", executionArn)
+        return {k: v for k, v in execution.items() if k != "events"}
+
+    @api
+    def list_executions(self, stateMachineArn, statusFilter=None, maxResults=100, **kwargs) :
+
+        executions = [{k: e[k] for k in ["executionArn", "stateMachineArn", "name", "status", "startDate", "stopDate"]}
+                      for e in self.executions.values()
+                      if e["stateMachineArn"] == stateMachineArn and (not statusFilter or e["status"] == statusFilter)]
+        return {"executions": executions[::-1][:maxResults]}
+
+    @api
+    def get_execution_history(self, executionArn, maxResults=100, reverseOrder=False, nextToken=None,
+                              includeExecutionData=True) :
+
+        events = self._execution("GetExecutionHistory", executionArn)["events"]
+        events = events[::-1] if reverseOrder else events
+
+        start = int(nextToken) if nextToken else 0
+        page = events[start:start + maxResults]
+        if not includeExecutionData :
+            page = [{k: ({d: v for d, v in details.items() if d not in ("input", "output", "parameters")}
+                         if isinstance(details, dict) else details) for k, details in e.items()} for e in page]
+
+        resp = {"events": page}
+        if start + maxResults < len(events) :
+            resp["nextToken"] = str(start + maxResults)
+
+        return resp
+
+## BPRunner selects its workflow engine by the class of the client; botocore names the
+## class of Step Functions clients botocore.client.SFN.
+FakeStepFunctions.__module__ = "botocore.client"
+FakeStepFunctions.__qualname__ = "SFN"
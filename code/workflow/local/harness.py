@@ -0,0 +1,460 @@
+"""Runs the blueprint end to end against the in-process AWS stand-ins of fake_aws.
+
+The state machine is read from the CloudFormation template and executed on the fake Step
+Functions; its Lambda tasks invoke the lambda_handler of the stage modules in this process.
+A run is started through BPRunner, as from the notebook. Every stage invocation is recorded
+with the event it received and the result it returned, so a recorded run can be replayed
+with the same settings and checked for divergences.
+"""
+import copy
+import csv
+import importlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import textwrap
+import uuid
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from fake_aws import ACCOUNT, CallLog, FakeS3, FakeSageMaker, FakeStepFunctions, ThrottlePolicy, VirtualClock
+import sagemaker_sdk
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+STAGE_DIR = os.path.join(ROOT, "code", "workflow", "implementations", "autopilot")
+NOTEBOOK_DIR = os.path.join(ROOT, "notebook")
+TEMPLATE = os.path.join(ROOT, "code", "deploy", "cf", "automl-blueprint.yml")
+CONFIG = os.path.join(ROOT, "config", "blueprint-config.json")
+EVAL_STAGES = ["error-analysis-config", "bias-analysis-config", "xai-config"]
+
+DEFAULT_SETTINGS = {
+    "name": "automl-blueprint",
+    "workspace": "bp-local-workspace",
+    "region": "us-east-1",
+    "rows": 2000,
+    "shards": 4,
+    "seed": 0,
+    "runs": 1,
+    # simulated job run and provisioning times, in seconds, by job type
+    "durations": {},
+    "startup": {},
+    "jitter": 0.1,
+    # service -> {"rate": calls/second, "burst": calls, "probability": p}
+    "throttle": {},
+    # job name fragments of the jobs that fail
+    "failures": [],
+    "objective_value": 0.93,
+    # blueprint config overrides, merged into the config
+    "config": {}
+}
+
+def load_template(path=TEMPLATE) :
+
+    ## Extracts the state machine definition and the Lambda functions from the template.
+    ## The template uses CloudFormation tags, so it is scanned rather than parsed as YAML.
+    with open(path) as f :
+        lines = f.read().splitlines()
+
+    functions, resource, props = {}, None, {}
+    for line in lines :
+        top = re.match(r"^  (\w+):\s*$", line)
+        if top :
+            if props.get("Type") == "'AWS::Lambda::Function'" :
+                functions[resource] = props
+            resource, props = top.group(1), {}
+            continue
+        prop = re.match(r"^    (?:  )?(Type|FunctionName|Handler|Timeout): (.+)$", line)
+        if prop and resource :
+            props[prop.group(1)] = prop.group(2).strip()
+    if props.get("Type") == "'AWS::Lambda::Function'" :
+        functions[resource] = props
+
+    start = next(i for i, line in enumerate(lines) if "DefinitionString: !Sub" in line) + 2
+    end = next(i for i in range(start, len(lines)) if re.match(r"^        - \w+:\s*$", lines[i]))
+    definition = textwrap.dedent("\n".join(lines[start:end]))
+
+    substitutions, name = {}, None
+    for line in lines[end:] :
+        if re.match(r"^  \w+:\s*$", line) :
+            break
+        var = re.match(r"^\s+(?:- )?(\w+):\s*$", line)
+        if var :
+            name = var.group(1)
+        ref = re.search(r"!(GetAtt|Ref) ([\w]+)", line)
+        if ref and name :
+            substitutions[name] = ref.group(2)
+            name = None
+
+    return definition, functions, substitutions
+
+def make_dataset(rows, shards, seed=0) :
+
+    ## Synthetic stand-in for the bank marketing dataset: the columns the bias config refers
+    ## to, a few numeric and categorical features, and a binary target in the last column.
+    rand = random.Random(seed)
+    jobs = ["admin.", "technician", "services", "management", "retired", "student"]
+    marital = ["married", "single", "divorced"]
+    header = ["age", "job", "marital", "balance", "duration", "campaign", "target"]
+
+    shard_rows = [[] for _ in range(shards)]
+    for i in range(rows) :
+        age = rand.randint(18, 90)
+        duration = int(rand.expovariate(1 / 250))
+        campaign = rand.randint(1, 10)
+        score = duration / 500 - campaign / 10 + (0.5 if age > 60 else 0) + rand.gauss(0, 0.5)
+        shard_rows[i % shards].append([age, rand.choice(jobs), rand.choice(marital),
+                                       round(rand.gauss(1500, 3000), 2), duration, campaign, int(score > 0.8)])
+
+    shard_data = []
+    for part in shard_rows :
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(part)
+        shard_data.append(out.getvalue())
+
+    return shard_data
+
+def make_flow(output_node_id) :
+
+    ## Minimal Data Wrangler flow with an S3 source. The simulated Data Wrangler job copies
+    ## its input to its output.
+    node_id = output_node_id.split(".")[0]
+    return {"metadata": {"version": 1},
+            "nodes": [{"node_id": node_id, "type": "SOURCE", "operator": "sagemaker.s3_source_0.1",
+                       "parameters": {"dataset_definition": {"datasetSourceType": "S3", "name": "input_data",
+                                                             "s3ExecutionContext": {"s3Uri": "", "s3ContentType": "csv",
+                                                                                    "s3HasHeader": True}}},
+                       "inputs": [], "outputs": [{"name": "default"}]}]}
+
+def merge(base, overrides) :
+
+    for key, value in overrides.items() :
+        if isinstance(value, dict) and isinstance(base.get(key), dict) :
+            merge(base[key], value)
+        else :
+            base[key] = value
+    return base
+
+class LambdaContext() :
+
+    def __init__(self, clock, function_name, timeout, request_id) :
+
+        self.clock = clock
+        self.function_name = function_name
+        self.aws_request_id = request_id
+        self.memory_limit_in_mb = 128
+        self.deadline = clock() + timeout
+
+    def get_remaining_time_in_millis(self) :
+        return int(max(self.deadline - self.clock(), 0) * 1000)
+
+class SeededUUID() :
+
+    def __init__(self, rand) :
+        self.rand = rand
+
+    def uuid4(self) :
+        return uuid.UUID(int=self.rand.getrandbits(128), version=4)
+
+class LocalBlueprint() :
+
+    def __init__(self, **settings) :
+
+        unknown = set(settings) - set(DEFAULT_SETTINGS)
+        if unknown :
+            raise ValueError(f"Unknown settings: {sorted(unknown)}.")
+        self.settings = merge(copy.deepcopy(DEFAULT_SETTINGS), copy.deepcopy(settings))
+
+    def _throttle(self, service) :
+
+        policy = self.settings["throttle"].get(service)
+        return ThrottlePolicy(seed=f"{self.settings['seed']}:{service}", **policy) if policy else None
+
+    def _load_stages(self) :
+
+        ## Stage modules are imported fresh, as in new Lambda containers, and stay loaded
+        ## across the invocations of the run, as in warm ones.
+        if STAGE_DIR not in sys.path :
+            sys.path.insert(0, STAGE_DIR)
+        for name in [m for m in sys.modules if m.startswith("bp_")] :
+            del sys.modules[name]
+
+        modules = {}
+        for props in self.functions.values() :
+            module_name = props["Handler"].split(".")[0]
+            if module_name.startswith("bp_") :
+                modules[module_name] = importlib.import_module(module_name)
+
+        self.bp_clients = importlib.import_module("bp_clients")
+        for service, client in [("s3", self.s3), ("sagemaker", self.sm), ("stepfunctions", self.sfn)] :
+            self.bp_clients.register_client(service, client)
+        self.log.listeners.append(self._count_call)
+
+        # the stages keep time with the virtual clock and draw from seeded generators
+        rand = random.Random(self.settings["seed"])
+        for name, module in list(sys.modules.items()) :
+            if not name.startswith("bp_") :
+                continue
+            for attr, fake in [("gmtime", self.clock.gmtime), ("sleep", self.clock.sleep), ("time", self.clock)] :
+                if callable(getattr(module, attr, None)) and getattr(module, attr).__module__ == "time" :
+                    setattr(module, attr, fake)
+            if getattr(module, "uuid", None) is uuid :
+                module.uuid = SeededUUID(rand)
+            if hasattr(module, "tracker") :
+                module.tracker = type(module.tracker)(module.sm, clock=self.clock, rand=rand.random)
+
+        return modules
+
+    def _count_call(self, service, op, attempts, throttled) :
+
+        ## Calls made from a stage show up in the stage's own API usage counters.
+        counters = self.bp_clients.counters
+        counters["calls"][f"{service}:{op}"] += 1
+        counters["attempts"] += attempts
+
+    def _seed_workspace(self, config) :
+
+        bucket = self.settings["workspace"]
+        self.s3.create_bucket(Bucket=bucket)
+
+        for n, data in enumerate(make_dataset(self.settings["rows"], self.settings["shards"], self.settings["seed"])) :
+            self.s3.put(bucket, f"{config['data-config']['raw_in_prefix']}/part-{n:05d}.csv", data)
+
+        flow = make_flow(config["dataprep-config"]["output_node_id"])
+        self.s3.put(bucket, f"{config['workspace-config']['s3_prefix']}/meta/{config['dataprep-config']['definition_file']}",
+                    json.dumps(flow))
+        self.s3.put(bucket, f"{config['workspace-config']['s3_prefix']}/config/blueprint-config.json", json.dumps(config))
+
+    def _function_arn(self, name) :
+        return f"arn:aws:lambda:{self.settings['region']}:{ACCOUNT}:function:{name}"
+
+    def _make_invoker(self, module, props) :
+
+        timeout = int(props.get("Timeout", 300))
+
+        def invoke(state_name, payload) :
+
+            self.invocation += 1
+            record = {"execution": self.execution, "invocation": self.invocation, "state": state_name,
+                      "function": props["FunctionName"], "event": copy.deepcopy(payload),
+                      "virtual_start": self.clock() - self.started}
+            context = LambdaContext(self.clock, props["FunctionName"], timeout, f"request-{self.invocation:06d}")
+
+            start = perf_counter()
+            try :
+                with redirect_stdout(io.StringIO()) :
+                    result = module.lambda_handler(payload, context)
+                record["result"] = json.loads(json.dumps(result, default=str))
+                return result
+            except Exception as e :
+                record["error"] = {"type": type(e).__name__, "message": str(e)}
+                raise
+            finally :
+                record["wall_seconds"] = perf_counter() - start
+                record["virtual_seconds"] = self.clock() - self.started - record["virtual_start"]
+                record["api"] = self.bp_clients.get_counters()
+                self.invocations.append(record)
+
+        return invoke
+
+    def setup(self) :
+
+        settings = self.settings
+        os.environ["AWS_REGION"] = settings["region"]
+        os.environ.setdefault("AWS_DEFAULT_REGION", settings["region"])
+        random.seed(settings["seed"])
+
+        self.clock = VirtualClock()
+        self.log = CallLog()
+        self.s3 = FakeS3(self.clock, self.log, self._throttle("s3"))
+        self.sm = FakeSageMaker(self.clock, self.log, self.s3, self._throttle("sagemaker"),
+                                durations=settings["durations"], startup=settings["startup"], jitter=settings["jitter"],
+                                failures=settings["failures"], objective_value=settings["objective_value"],
+                                seed=settings["seed"], region=settings["region"])
+
+        definition, self.functions, substitutions = load_template()
+        lambdas = {}
+        self.sfn = FakeStepFunctions(self.clock, self.log, self.sm, lambdas, self._throttle("stepfunctions"),
+                                     region=settings["region"])
+        modules = self._load_stages()
+
+        values = {}
+        for var, ref in substitutions.items() :
+            if ref in self.functions :
+                props = self.functions[ref]
+                values[var] = self._function_arn(props["FunctionName"])
+                module = modules.get(props["Handler"].split(".")[0])
+                if module :
+                    lambdas[values[var]] = self._make_invoker(module, props)
+            elif ref == "DefaultWorkspace" :
+                values[var] = settings["workspace"]
+            else :
+                values[var] = f"arn:aws:iam::{ACCOUNT}:role/{ref}"
+        definition = re.sub(r"\$\{(\w+)\}", lambda m: json.dumps(values[m.group(1)]), definition)
+
+        with open(CONFIG) as f :
+            config = merge(json.load(f), settings["config"])
+        self._seed_workspace(config)
+        self.sfn.create_state_machine(name=settings["name"], definition=definition,
+                                      roleArn=f"arn:aws:iam::{ACCOUNT}:role/SFNExecutionRole")
+
+        self.invocations = []
+        self.invocation = 0
+        self.execution = 0
+        self.reports = []
+
+    def run(self) :
+
+        ## Runs the blueprint settings["runs"] times in a row, as a user re-running the
+        ## notebook would, and returns one report per run.
+        if NOTEBOOK_DIR not in sys.path :
+            sys.path.insert(0, NOTEBOOK_DIR)
+        from utils.wf import BPRunner, SFNMonitor
+
+        self.setup()
+        with sagemaker_sdk.installed() :
+
+            runner = BPRunner(self.settings["workspace"], db_driver=self.s3, wf_driver=self.sfn)
+            for _ in range(self.settings["runs"]) :
+
+                self.execution += 1
+                self.started = self.clock()
+                first = len(self.invocations)
+                calls_before = copy.deepcopy(self.log.calls), copy.deepcopy(self.log.retries), copy.deepcopy(self.log.throttled)
+
+                start = perf_counter()
+                execution_arn = runner.run_blueprint(self.settings["name"], n_stages=None)
+                wall = perf_counter() - start
+
+                monitor = SFNMonitor(client=self.sfn)
+                self.reports.append(self._report(runner, monitor, execution_arn, wall, self.invocations[first:], calls_before))
+
+        return self.reports
+
+    def _report(self, runner, monitor, execution_arn, wall, invocations, calls_before) :
+
+        desc = self.sfn.describe_execution(executionArn=execution_arn)
+        report = {
+            "execution": execution_arn,
+            "status": desc["status"],
+            "states": monitor.get_n_stages(execution_arn),
+            "wall_seconds": round(wall, 3),
+            "simulated_seconds": round((desc["stopDate"] - desc["startDate"]).total_seconds(), 1),
+            "stages": {}
+        }
+        if desc["status"] == "SUCCEEDED" :
+            report["automl_job"] = runner.get_automl_job_name(execution_arn)
+            report["model"] = runner.get_best_model_name(execution_arn)
+            report["eval_cache"] = self._eval_cache_hits(desc)
+        else :
+            report["error"] = {"error": desc.get("error"), "cause": desc.get("cause")}
+
+        # simulated time from the first time a state is entered to the last time it exits
+        spans = {}
+        for e in self.sfn.executions[execution_arn]["events"] :
+            for key in ("stateEnteredEventDetails", "stateExitedEventDetails") :
+                if key in e :
+                    span = spans.setdefault(e[key]["name"], [e["timestamp"], e["timestamp"]])
+                    span[1] = e["timestamp"]
+
+        for record in invocations :
+            stage = report["stages"].setdefault(record["state"], {"function": record["function"], "invocations": 0,
+                                                                  "errors": 0, "wall_seconds": 0.0})
+            stage["invocations"] += 1
+            stage["errors"] += "error" in record
+            stage["wall_seconds"] += record["wall_seconds"]
+
+        calls, retries, throttled = calls_before
+        for (scope, op), n in self.log.calls.items() :
+            n -= calls[(scope, op)]
+            if not n :
+                continue
+            stage = report["stages"].setdefault(scope, {"invocations": 0, "errors": 0, "wall_seconds": 0.0})
+            stage["api_calls"] = stage.get("api_calls", 0) + n
+            stage["retries"] = stage.get("retries", 0) + self.log.retries[(scope, op)] - retries[(scope, op)]
+            stage["throttled"] = stage.get("throttled", 0) + self.log.throttled[(scope, op)] - throttled[(scope, op)]
+            stage.setdefault("calls", {})[op] = n
+
+        for name, stage in report["stages"].items() :
+            stage["wall_seconds"] = round(stage["wall_seconds"], 4)
+            if name in spans :
+                stage["simulated_seconds"] = round((spans[name][1] - spans[name][0]).total_seconds(), 1)
+
+        return report
+
+    @classmethod
+    def _eval_cache_hits(cls, desc) :
+
+        ## Whether each evaluation stage reused the results of an earlier run, from the
+        ## payloads of the Evaluate branches in the execution's output.
+        hits = {}
+        for branch in json.loads(desc["output"]) :
+            payload = branch.get("taskresult", {}).get("Payload", {})
+            for stage in EVAL_STAGES :
+                if "eval-cache" in payload.get(stage, {}) :
+                    hits[stage] = payload[stage]["eval-cache"]["hit"]
+
+        return hits
+
+    def recording(self) :
+
+        ## Wall times vary from run to run and are left out of the events to replay.
+        return {"settings": self.settings,
+                "invocations": [{k: v for k, v in record.items() if k != "wall_seconds"} for record in self.invocations]}
+
+    def save(self, path) :
+
+        with open(path, "w") as f :
+            json.dump(self.recording(), f, indent=1, sort_keys=True)
+
+## Measurements of real time, such as the stages' telemetry, differ from run to run.
+UNREPLAYABLE_KEYS = {"telemetry"}
+
+def first_difference(a, b, path="$") :
+
+    if type(a) != type(b) :
+        return path
+    if isinstance(a, dict) :
+        for key in sorted((set(a) | set(b)) - UNREPLAYABLE_KEYS) :
+            if key not in a or key not in b :
+                return f"{path}.{key}"
+            diff = first_difference(a[key], b[key], f"{path}.{key}")
+            if diff :
+                return diff
+        return None
+    if isinstance(a, list) :
+        if len(a) != len(b) :
+            return f"{path}[len]"
+        for i, (x, y) in enumerate(zip(a, b)) :
+            diff = first_difference(x, y, f"{path}[{i}]")
+            if diff :
+                return diff
+        return None
+
+    return None if a == b else path
+
+def replay(recording) :
+
+    ## Re-runs a recorded run with the same settings and compares every stage invocation,
+    ## the event received and the result returned, with the recording. Returns the new run
+    ## and the invocations that diverged.
+    bp = LocalBlueprint(**recording["settings"])
+    bp.run()
+
+    replayed = bp.recording()["invocations"]
+    expected = recording["invocations"]
+    divergences = []
+    for i in range(max(len(expected), len(replayed))) :
+
+        if i >= len(expected) or i >= len(replayed) :
+            divergences.append({"invocation": i + 1, "path": "$[missing]"})
+            continue
+        path = first_difference(expected[i], replayed[i])
+        if path :
+            divergences.append({"invocation": i + 1, "state": expected[i]["state"], "path": path})
+
+    return bp, divergences
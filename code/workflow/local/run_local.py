@@ -0,0 +1,114 @@
+"""Runs the whole blueprint locally against in-process stand-ins of S3, SageMaker and Step Functions.
+
+No AWS account is needed: jobs complete after simulated durations on a virtual clock, so a
+run that takes hours on AWS takes seconds here. The report lists, per workflow state, the
+real time spent in the stage's lambda_handler, the simulated time of the state and the API
+calls it made, with retries and throttled attempts:
+
+    python code/workflow/local/run_local.py --rows 5000 --runs 2 --record run.json
+    python code/workflow/local/run_local.py --throttle sagemaker=2:5 --durations automl=1800
+    python code/workflow/local/run_local.py --replay run.json
+
+With --check-eval-cache, every run after the first must reuse the evaluation results of the
+first, since the model and the data are unchanged:
+
+    python code/workflow/local/run_local.py --runs 2 --check-eval-cache
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import LocalBlueprint, replay
+
+def parse_pairs(values, cast=float) :
+    return {k: cast(v) for k, v in (item.split("=") for item in values)} if values else {}
+
+def parse_throttle(values) :
+
+    ## service=rate[:burst[:probability]]
+    throttle = {}
+    for item in values if values else [] :
+        service, spec = item.split("=")
+        parts = [float(p) if p else None for p in spec.split(":")] + [None, None]
+        throttle[service] = {"rate": parts[0], "burst": parts[1], "probability": parts[2] if parts[2] else 0.0}
+    return throttle
+
+def print_report(report) :
+
+    print(f"\n{report['execution']}: {report['status']} in {report['wall_seconds']}s "
+          f"({report['simulated_seconds']}s simulated, {report['states']} states)")
+    if "error" in report :
+        print(f"  error: {report['error']}")
+    if report.get("eval_cache") :
+        print("  eval cache: " + ", ".join(f"{stage} {'hit' if hit else 'miss'}" for stage, hit in report["eval_cache"].items()))
+
+    print(f"  {'stage':<28}{'invocations':>12}{'wall (s)':>10}{'simulated (s)':>15}{'API calls':>11}{'retries':>9}{'throttled':>11}")
+    for name, stage in report["stages"].items() :
+        print(f"  {name:<28}{stage['invocations']:>12}{stage['wall_seconds']:>10.3f}{stage.get('simulated_seconds', 0):>15.1f}"
+              f"{stage.get('api_calls', 0):>11}{stage.get('retries', 0):>9}{stage.get('throttled', 0):>11}")
+
+def main() :
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=1, help="consecutive runs of the blueprint")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--durations", nargs="*", help="job_type=seconds, for processing, transform and automl jobs")
+    parser.add_argument("--startup", nargs="*", help="job_type=seconds of provisioning before a job starts")
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative spread of the job durations")
+    parser.add_argument("--throttle", nargs="*", help="service=rate[:burst[:probability]], e.g. sagemaker=2:5")
+    parser.add_argument("--fail", nargs="*", help="job name fragments of jobs that fail, e.g. bp-clarify-bias")
+    parser.add_argument("--config", help="JSON file of blueprint config overrides")
+    parser.add_argument("--record", help="write the stage invocations to this file")
+    parser.add_argument("--replay", help="re-run a recording and check that every stage receives the same events")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    parser.add_argument("--check-eval-cache", action="store_true",
+                        help="fail unless the evaluation stages of every run after the first are cache hits")
+    args = parser.parse_args()
+
+    if args.replay :
+        with open(args.replay) as f :
+            recording = json.load(f)
+        bp, divergences = replay(recording)
+        reports = bp.reports
+    else :
+        overrides = {}
+        if args.config :
+            with open(args.config) as f :
+                overrides = json.load(f)
+        bp = LocalBlueprint(rows=args.rows, shards=args.shards, runs=args.runs, seed=args.seed,
+                            durations=parse_pairs(args.durations), startup=parse_pairs(args.startup),
+                            jitter=args.jitter, throttle=parse_throttle(args.throttle),
+                            failures=args.fail if args.fail else [], config=overrides)
+        reports = bp.run()
+        divergences = None
+
+    if args.json :
+        print(json.dumps({"reports": reports, "divergences": divergences}, indent=2, default=str))
+    else :
+        for report in reports :
+            print_report(report)
+
+    if args.record :
+        bp.save(args.record)
+        print(f"\nRecorded {len(bp.invocations)} stage invocations to {args.record}")
+
+    if args.check_eval_cache :
+        misses = [(r["execution"], stage) for r in reports[1:] for stage, hit in r.get("eval_cache", {}).items() if not hit]
+        if len(reports) < 2 or misses or not all(r.get("eval_cache") for r in reports[1:]) :
+            print(f"\nEvaluation results were not reused: {misses if misses else 'no run to compare'}")
+            sys.exit(1)
+        print("\nEvery run after the first reused the evaluation results")
+
+    if divergences is not None :
+        if divergences :
+            print(f"\nReplay diverged from the recording at {len(divergences)} invocation(s), first: {divergences[0]}")
+            sys.exit(1)
+        print(f"\nReplay matched all {len(recording['invocations'])} recorded stage invocations")
+
+if __name__ == "__main__" :
+    main()
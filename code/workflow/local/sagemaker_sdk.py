@@ -0,0 +1,171 @@
+"""Stand-in for the parts of the SageMaker Python SDK that the stages use to create jobs.
+
+The stages import the SDK only to create jobs: Clarify processing jobs, Batch Transform
+jobs and the model of an Autopilot job. The SDK makes its own AWS calls, so for local runs
+these classes take its place and translate each call into the corresponding request to the
+session's SageMaker client. Use installed() to make `import sagemaker` resolve to them.
+"""
+import sys
+from contextlib import contextmanager
+from types import ModuleType
+
+CLARIFY_IMAGE = "205585389593.dkr.ecr.{region}.amazonaws.com/sagemaker-clarify-processing:1.0"
+
+class Session() :
+
+    def __init__(self, boto_session=None, sagemaker_client=None, **kwargs) :
+
+        self.boto_session = boto_session
+        self.sagemaker_client = sagemaker_client
+        self.boto_region_name = boto_session.region_name if boto_session else "us-east-1"
+
+    def create_model(self, name, role, container_defs, **kwargs) :
+
+        containers = container_defs if isinstance(container_defs, list) else [container_defs]
+        self.sagemaker_client.create_model(ModelName=name, ExecutionRoleArn=role, Containers=containers)
+        return name
+
+class _Config() :
+
+    ## Clarify config objects only carry their arguments.
+    def __init__(self, **kwargs) :
+        self.__dict__.update(kwargs)
+
+class DataConfig(_Config) : pass
+class ModelConfig(_Config) : pass
+class ModelPredictedLabelConfig(_Config) : pass
+class BiasConfig(_Config) : pass
+class SHAPConfig(_Config) : pass
+
+class SageMakerClarifyProcessor() :
+
+    def __init__(self, role, instance_count, instance_type, sagemaker_session, **kwargs) :
+
+        self.role = role
+        self.instance_count = instance_count
+        self.instance_type = instance_type
+        self.session = sagemaker_session
+
+    def _run(self, job_name, data_config) :
+
+        self.session.sagemaker_client.create_processing_job(
+            ProcessingJobName=job_name,
+            ProcessingResources={"ClusterConfig": {"InstanceType": self.instance_type,
+                                                   "InstanceCount": self.instance_count,
+                                                   "VolumeSizeInGB": 30}},
+            AppSpecification={"ImageUri": CLARIFY_IMAGE.format(region=self.session.boto_region_name)},
+            RoleArn=self.role,
+            ProcessingInputs=[{"InputName": "dataset",
+                               "S3Input": {"S3Uri": data_config.s3_data_input_path,
+                                           "LocalPath": "/opt/ml/processing/input/data",
+                                           "S3DataType": "S3Prefix",
+                                           "S3InputMode": "File"}}],
+            ProcessingOutputConfig={"Outputs": [{"OutputName": "analysis_result",
+                                                 "S3Output": {"S3Uri": data_config.s3_output_path,
+                                                              "LocalPath": "/opt/ml/processing/output",
+                                                              "S3UploadMode": "EndOfJob"}}]},
+            StoppingCondition={"MaxRuntimeInSeconds": 86400})
+
+    def run_bias(self, job_name, data_config, bias_config, model_config=None, model_predicted_label_config=None, **kwargs) :
+        self._run(job_name, data_config)
+
+    def run_explainability(self, job_name, data_config, model_config, explainability_config, **kwargs) :
+        self._run(job_name, data_config)
+
+class Transformer() :
+
+    def __init__(self, model_name, instance_count, instance_type, output_path, sagemaker_session, strategy=None,
+                 assemble_with=None, accept=None, max_concurrent_transforms=None, max_payload=None, **kwargs) :
+
+        self.model_name = model_name
+        self.instance_count = instance_count
+        self.instance_type = instance_type
+        self.output_path = output_path
+        self.session = sagemaker_session
+        self.strategy = strategy
+        self.assemble_with = assemble_with
+        self.accept = accept
+        self.max_concurrent_transforms = max_concurrent_transforms
+        self.max_payload = max_payload
+
+    def transform(self, data, job_name, content_type=None, split_type=None, input_filter=None, join_source=None,
+                  output_filter=None, **kwargs) :
+
+        # like the SDK, settings that are not set are left out of the request
+        limits = {k: v for k, v in [("MaxConcurrentTransforms", self.max_concurrent_transforms),
+                                    ("MaxPayloadInMB", self.max_payload)] if v is not None}
+        self.session.sagemaker_client.create_transform_job(
+            **limits,
+            TransformJobName=job_name,
+            ModelName=self.model_name,
+            BatchStrategy=self.strategy,
+            TransformInput={"DataSource": {"S3DataSource": {"S3DataType": "S3Prefix", "S3Uri": data}},
+                            "ContentType": content_type,
+                            "SplitType": split_type},
+            TransformOutput={"S3OutputPath": self.output_path, "Accept": self.accept, "AssembleWith": self.assemble_with},
+            TransformResources={"InstanceType": self.instance_type, "InstanceCount": self.instance_count},
+            DataProcessing={"InputFilter": input_filter, "JoinSource": join_source, "OutputFilter": output_filter})
+
+class _Model() :
+
+    def __init__(self, container) :
+
+        self.image_uri = container["Image"]
+        self.model_data = container["ModelDataUrl"]
+        self.env = dict(container.get("Environment", {}))
+
+class _PipelineModel() :
+
+    def __init__(self, models) :
+        self.models = models
+
+    def pipeline_container_def(self, instance_type) :
+        return [{"Image": m.image_uri, "ModelDataUrl": m.model_data, "Environment": m.env} for m in self.models]
+
+class AutoML() :
+
+    def __init__(self, job_name, sagemaker_session) :
+
+        self.job_name = job_name
+        self.session = sagemaker_session
+
+    @classmethod
+    def attach(cls, auto_ml_job_name, sagemaker_session=None) :
+        return cls(auto_ml_job_name, sagemaker_session)
+
+    def create_model(self, name, inference_response_keys=None, **kwargs) :
+
+        desc = self.session.sagemaker_client.describe_auto_ml_job(AutoMLJobName=self.job_name)
+        models = [_Model(c) for c in desc["BestCandidate"]["InferenceContainers"]]
+        if inference_response_keys :
+            models[-1].env["SAGEMAKER_INFERENCE_OUTPUT"] = ",".join(inference_response_keys)
+
+        return _PipelineModel(models)
+
+def _module(name, **attrs) :
+
+    module = ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+@contextmanager
+def installed() :
+
+    clarify = _module("sagemaker.clarify", DataConfig=DataConfig, ModelConfig=ModelConfig,
+                      ModelPredictedLabelConfig=ModelPredictedLabelConfig, BiasConfig=BiasConfig,
+                      SHAPConfig=SHAPConfig, SageMakerClarifyProcessor=SageMakerClarifyProcessor)
+    transformer = _module("sagemaker.transformer", Transformer=Transformer)
+    sdk = _module("sagemaker", Session=Session, AutoML=AutoML, clarify=clarify, transformer=transformer)
+    sdk.__path__ = []
+
+    modules = {"sagemaker": sdk, "sagemaker.clarify": clarify, "sagemaker.transformer": transformer}
+    saved = {name: sys.modules.get(name) for name in modules}
+    sys.modules.update(modules)
+    try :
+        yield sdk
+    finally :
+        for name, module in saved.items() :
+            if module is None :
+                sys.modules.pop(name, None)
+            else :
+                sys.modules[name] = module
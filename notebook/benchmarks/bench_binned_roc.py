@@ -0,0 +1,111 @@
+"""Compares the exact and the binned (out-of-core) threshold metrics of ModelInspector.
+
+Writes synthetic Batch Transform results as CSV shards to a temporary directory, then
+reports AUC and confusion-matrix error (with the histogram's error bound), wall time and
+peak Python memory for the exact engine on an in-memory DataFrame and for the streamed
+histogram at several resolutions:
+
+    python notebook/benchmarks/bench_binned_roc.py --rows 2000000 --shards 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.metrics import ScoreHistogram, ThresholdMetrics
+from utils.shards import ShardReader
+
+class LocalObjectStore() :
+
+    ## Serves a local directory through the subset of the S3 client used by ShardReader.
+    def __init__(self, root) :
+        self.root = root
+
+    def get_paginator(self, op) :
+        return self
+
+    def paginate(self, Bucket, Prefix, PaginationConfig=None) :
+        keys = sorted(k for k in os.listdir(self.root) if k.startswith(Prefix))
+        yield {"Contents": [{"Key": k, "Size": os.path.getsize(os.path.join(self.root, k))} for k in keys]}
+
+    def get_object(self, Bucket, Key) :
+        return {"Body": open(os.path.join(self.root, Key), 'rb')}
+
+def write_shards(root, rows, shards, seed) :
+
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 2, rows)
+    # overlapping class-conditional score distributions, rounded like model output
+    scores = np.clip(rng.normal(0.35 + 0.3 * y, 0.18), 0, 1).round(6)
+
+    for i, idx in enumerate(np.array_split(np.arange(rows), shards)) :
+        pd.DataFrame({"label": y[idx], "score": scores[idx]}).to_csv(
+            os.path.join(root, f"part-{i:05d}.csv.out"), index=False)
+
+    return y, scores
+
+def measure(fn) :
+
+    tracemalloc.start()
+    start = perf_counter()
+    result = fn()
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+def main() :
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--bins", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root :
+
+        write_shards(root, args.rows, args.shards, args.seed)
+        reader = ShardReader(LocalObjectStore(root), verbose=False)
+
+        def exact() :
+            df = reader.read_merged_df("local", "part-", skiprows=1, header=None)
+            return ThresholdMetrics(df[0], df[1])
+
+        engine, elapsed, peak = measure(exact)
+        exact_auc = engine.auc()
+        exact_cm = engine.confusion_matrix(args.threshold)
+
+        print(f"{args.rows} rows in {args.shards} shards, threshold {args.threshold}")
+        print(f"{'mode':<14}{'auc':>10}{'auc err':>11}{'bound':>11}{'cm err':>9}{'cm bound':>10}{'time(s)':>9}{'peak MB':>9}")
+        print(f"{'exact':<14}{exact_auc:>10.6f}{'':>11}{'':>11}{'':>9}{'':>10}{elapsed:>9.2f}{peak/2**20:>9.1f}")
+
+        for n_bins in args.bins :
+
+            def binned() :
+                hists = reader.fold_shards("local", "part-",
+                                           lambda: ScoreHistogram(n_bins),
+                                           lambda hist, chunk: hist.update(chunk[0], chunk[1]),
+                                           skiprows=1, header=None)
+                hist = hists[0]
+                for h in hists[1:] :
+                    hist.merge(h)
+                return hist
+
+            hist, elapsed, peak = measure(binned)
+            cm_err = int(np.abs(hist.confusion_matrix(args.threshold) - exact_cm).max())
+            print(f"{'binned/'+str(n_bins):<14}{hist.auc():>10.6f}{abs(hist.auc() - exact_auc):>11.2e}"
+                  f"{hist.auc_error_bound():>11.2e}{cm_err:>9}{hist.counts(args.threshold)['error_bound']:>10}"
+                  f"{elapsed:>9.2f}{peak/2**20:>9.1f}")
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,71 @@
+"""Import-time breakdown of the notebook utils, with a regression guard.
+
+Imports each utils module in a fresh interpreter under -X importtime and reports its total
+import time and the slowest imports by cumulative time. Exits with a non-zero status if
+any heavy dependency is loaded at import time, or if a module exceeds --budget-ms:
+
+    python notebook/benchmarks/bench_import_time.py --top 10 --budget-ms 500
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+NOTEBOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODULES = ["utils.bpconfig", "utils.prep", "utils.wf", "utils.trust"]
+
+# dependencies that must only be imported by the features that use them
+HEAVY = ["sagemaker", "shap", "seaborn", "matplotlib", "ipywidgets", "sklearn", "tqdm", "boto3", "pandas"]
+
+PROBE = "import sys; import {module}; print(','.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy}))))"
+
+def import_profile(module) :
+
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY)],
+                          cwd=NOTEBOOK_DIR, capture_output=True, text=True)
+    if proc.returncode :
+        raise Exception(f"Failed to import {module}:\n{proc.stderr[-2000:]}")
+
+    ## -X importtime writes "import time: self [us] | cumulative | imported package" lines
+    imports = []
+    for line in proc.stderr.splitlines() :
+        if not line.startswith("import time:") or "imported package" in line :
+            continue
+        _, self_us, cumulative_us, name = [f.strip() for f in line.replace("import time:", "|").split("|")]
+        imports.append((name, int(self_us), int(cumulative_us)))
+
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return imports, loaded
+
+def main() :
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    failures = []
+    for module in MODULES :
+
+        imports, loaded = import_profile(module)
+        total_ms = sum(self_us for _, self_us, _ in imports) / 1000
+
+        print(f"\n{module}: {total_ms:.1f} ms across {len(imports)} imports")
+        print(f"  {'cumulative(ms)':>14}{'self(ms)':>10}  module")
+        for name, self_us, cumulative_us in sorted(imports, key=lambda i: -i[2])[:args.top] :
+            print(f"  {cumulative_us/1000:>14.1f}{self_us/1000:>10.1f}  {name}")
+
+        if loaded :
+            failures.append(f"{module} imports {', '.join(loaded)} at module load")
+        if args.budget_ms is not None and total_ms > args.budget_ms :
+            failures.append(f"{module} takes {total_ms:.1f} ms to import (budget {args.budget_ms} ms)")
+
+    if failures :
+        print("\nRegressions:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+    print("\nNo heavy dependencies loaded at import time.")
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,305 @@
+"""Benchmarks the analysis paths of the notebook on synthetic data and keeps a history.
+
+For every dataset size, generates Batch Transform results, Clarify SHAP values and Autopilot
+candidates, then measures wall time (best and median of --repeat runs) and peak Python
+memory (tracemalloc, in a separate run) of:
+
+    merged_df             BPRunner._get_merged_df over the result shards
+    roc_curve             ModelInspector.get_roc_curve, including the sort of the scores
+    confusion_matrix      the confusion matrices of display_interactive_cm, over every slider step
+    explain_prediction    ModelInspector.explain_prediction, cold (download) and warm (cached)
+    automl_job_baseline   ModelInspector.get_automl_job_baseline against a fake SageMaker
+                          paginator, cold (listing) and warm (catalog)
+
+Results are appended to a JSON-lines history and compared with the previous entry of each
+case and size, so regressions show up over time:
+
+    python notebook/benchmarks/bench_notebook_paths.py --sizes 10000 100000 1000000
+    python notebook/benchmarks/bench_notebook_paths.py --sizes 100000000 --cases merged_df roc_curve
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from time import perf_counter, strftime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_binned_roc import LocalObjectStore, write_shards
+from utils import trust
+from utils.cache import ArtifactCache
+from utils.trust import ModelInspector
+from utils.wf import BPRunner
+
+CASES = ["merged_df", "roc_curve", "confusion_matrix", "explain_prediction", "automl_job_baseline"]
+DEFAULT_HISTORY = os.path.join(ArtifactCache.DEFAULT_DIR, "benchmarks", "notebook-paths.jsonl")
+
+N_FEATURES = 20
+STEPS_PER_CANDIDATE = 3
+
+class ETagObjectStore(LocalObjectStore) :
+
+    ## Adds the ETags and conditional GETs used by ArtifactCache to the local object store.
+    def _etag(self, key) :
+        stat = os.stat(os.path.join(self.root, key))
+        return '"{}"'.format(hashlib.md5(f"{key}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest())
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None) :
+
+        if not os.path.exists(os.path.join(self.root, Key)) :
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "The specified key does not exist."},
+                               "ResponseMetadata": {"HTTPStatusCode": 404}}, "GetObject")
+
+        etag = self._etag(Key)
+        if IfNoneMatch == etag :
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"},
+                               "ResponseMetadata": {"HTTPStatusCode": 304}}, "GetObject")
+
+        resp = super().get_object(Bucket, Key)
+        resp["ETag"] = etag
+        return resp
+
+class FakeCandidatePaginator() :
+
+    ## Serves list_candidates_for_auto_ml_job in pages, as SageMaker does, for a job with
+    ## n_candidates candidates of STEPS_PER_CANDIDATE steps, one of them a training job.
+    def __init__(self, n_candidates, n_pipelines=10, seed=0) :
+
+        self.n_candidates = n_candidates
+        self.n_pipelines = n_pipelines
+        self.values = np.random.default_rng(seed).uniform(0.7, 0.95, n_candidates)
+        self.calls = 0
+
+    def describe_auto_ml_job(self, AutoMLJobName) :
+
+        self.calls += 1
+        return {"AutoMLJobName": AutoMLJobName, "AutoMLJobStatus": "Completed"}
+
+    def list_candidates_for_auto_ml_job(self, AutoMLJobName, MaxResults=10, NextToken=None, **kwargs) :
+
+        self.calls += 1
+        start = int(NextToken) if NextToken else 0
+        end = min(start + MaxResults, self.n_candidates)
+
+        candidates = []
+        for i in range(start, end) :
+            step = f"{AutoMLJobName}-dpp{i % self.n_pipelines}-{i}-{i:08x}"
+            candidates.append({
+                "CandidateName": f"{AutoMLJobName}-{i}",
+                "FinalAutoMLJobObjectiveMetric": {"MetricName": "validation:auc", "Value": float(self.values[i])},
+                "CandidateSteps": [
+                    {"CandidateStepType": "AWS::SageMaker::ProcessingJob", "CandidateStepName": f"{step}-pr"},
+                    {"CandidateStepType": "AWS::SageMaker::TrainingJob", "CandidateStepName": step},
+                    {"CandidateStepType": "AWS::SageMaker::TransformJob", "CandidateStepName": f"{step}-tr"}
+                ][:STEPS_PER_CANDIDATE]
+            })
+
+        resp = {"Candidates": candidates}
+        if end < self.n_candidates :
+            resp["NextToken"] = str(end)
+        return resp
+
+def write_xai(root, rows, seed) :
+
+    rng = np.random.default_rng(seed)
+    columns = [f"feature_{i}" for i in range(N_FEATURES)]
+    summary = {"explanations": {"kernel_shap": {"label0": {
+        "expected_value": 0.42,
+        "global_shap_values": {c: float(v) for c, v in zip(columns, rng.uniform(0, 0.1, N_FEATURES))}
+    }}}}
+
+    os.makedirs(os.path.join(root, "xai", "explanations_shap"), exist_ok=True)
+    with open(os.path.join(root, "xai", "analysis.json"), "w") as f :
+        json.dump(summary, f)
+
+    # written in blocks so that large sizes are generated in bounded memory
+    path = os.path.join(root, "xai", "explanations_shap", "out.csv")
+    block = 1000000
+    for start in range(0, rows, block) :
+        n = min(block, rows - start)
+        pd.DataFrame(rng.normal(0, 0.05, (n, N_FEATURES)).round(6), columns=columns).to_csv(
+            path, mode="a", header=start == 0, index=False)
+
+def get_inspector(root, cache_dir, dsmlp) :
+
+    ModelInspector._instance = None
+    ModelInspector._results_source = None
+    return ModelInspector.get_inspector({
+        "workspace": "local",
+        "prefixes": {"results_path": "part-", "bias_path": "bias", "xai_path": "xai"},
+        "results-config": {"gt_index": 0, "pred_index": 1},
+        "drivers": {"db": ETagObjectStore(root), "dsmlp": dsmlp},
+        "cache": {"cache_dir": os.path.join(cache_dir, "artifacts")},
+        "catalog": {"cache_dir": os.path.join(cache_dir, "candidates"), "verbose": False}
+    })
+
+def measure(fn, setup=None, repeat=3) :
+
+    ## One untimed run loads the lazily imported modules. The timed runs follow, then one
+    ## more run under tracemalloc for the peak memory, so that tracing does not slow down the
+    ## timed runs. Progress messages of the readers are discarded.
+    times = []
+    with redirect_stdout(io.StringIO()) :
+
+        fn(setup() if setup else None)
+        for _ in range(repeat) :
+            state = setup() if setup else None
+            start = perf_counter()
+            fn(state)
+            times.append(perf_counter() - start)
+
+        state = setup() if setup else None
+        tracemalloc.start()
+        fn(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {"seconds_min": min(times), "seconds_median": statistics.median(times), "peak_mb": peak / 2**20}
+
+def run_cases(cases, rows, args, root, cache_dir) :
+
+    shards = max(1, min(args.shards, rows // 1000))
+    write_shards(root, rows, shards, args.seed)
+    if "explain_prediction" in cases :
+        write_xai(root, rows, args.seed)
+
+    n_candidates = max(1, min(rows // STEPS_PER_CANDIDATE, args.max_candidates))
+    dsmlp = FakeCandidatePaginator(n_candidates, seed=args.seed)
+    inspector = get_inspector(root, cache_dir, dsmlp)
+    results = {}
+
+    if "merged_df" in cases :
+        results["merged_df"] = measure(lambda _: BPRunner._get_merged_df("local", "part-", ETagObjectStore(root)),
+                                       repeat=args.repeat)
+
+    if cases & {"roc_curve", "confusion_matrix"} :
+
+        with redirect_stdout(io.StringIO()) :
+            ModelInspector._results_df = BPRunner._get_merged_df("local", "part-", ETagObjectStore(root), show_header=False)
+        def fresh_engine() :
+            ModelInspector._metrics_engine = None
+
+        if "roc_curve" in cases :
+            results["roc_curve"] = measure(lambda _: inspector.get_roc_curve(display=False), fresh_engine, args.repeat)
+
+        if "confusion_matrix" in cases :
+            # the slider steps of display_interactive_cm with its default settings
+            thresholds = np.arange(0.0, 1.0 + 1e-9, 0.05)
+            def sweep(_) :
+                engine = inspector._metrics()
+                for t in thresholds :
+                    engine.confusion_matrix(t)
+            results["confusion_matrix"] = measure(sweep, fresh_engine, args.repeat)
+
+    if "explain_prediction" in cases :
+
+        row = rows // 2
+        def cold() :
+            inspector.cache.clear()
+            ModelInspector._frames = {}
+        results["explain_prediction/cold"] = measure(lambda _: inspector.explain_prediction(row), cold, args.repeat)
+        with redirect_stdout(io.StringIO()) :
+            inspector.explain_prediction(row)
+        results["explain_prediction/warm"] = measure(lambda _: inspector.explain_prediction(row), repeat=args.repeat)
+
+    if "automl_job_baseline" in cases :
+
+        candidate_ids = [f"dpp{i}" for i in range(dsmlp.n_pipelines)]
+        def cold() :
+            inspector.catalog.clear()
+            dsmlp.calls = 0
+        results["automl_job_baseline/cold"] = measure(
+            lambda _: inspector.get_automl_job_baseline("bench-job", candidate_ids), cold, args.repeat)
+        results["automl_job_baseline/cold"]["api_calls"] = dsmlp.calls
+        results["automl_job_baseline/warm"] = measure(
+            lambda _: inspector.get_automl_job_baseline("bench-job", candidate_ids), repeat=args.repeat)
+
+    return results
+
+def git_revision() :
+
+    try :
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError :
+        return None
+
+def load_history(path) :
+
+    previous = {}
+    if os.path.exists(path) :
+        with open(path) as f :
+            for line in f :
+                entry = json.loads(line)
+                previous[(entry["case"], entry["rows"])] = entry
+    return previous
+
+def main() :
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="rows of results and SHAP values, from 10^4 to 10^8")
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--max-candidates", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON-lines file the results are appended to")
+    parser.add_argument("--regression", type=float, default=1.25,
+                        help="flag cases that got slower or bigger than this ratio of the previous entry")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="ignore slowdowns of fewer seconds than this, which are within timing noise")
+    args = parser.parse_args()
+
+    try :
+        import shap
+    except ImportError :
+        # the force plot is the only part of explain_prediction that needs shap
+        print("shap is not installed: explain_prediction is measured without the force plot.")
+        trust.shap = SimpleNamespace(force_plot=lambda *a, **kw: None)
+    else :
+        import matplotlib
+        matplotlib.use("Agg")
+
+    previous = load_history(args.history)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    run = {"timestamp": strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(),
+           "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__}
+
+    print(f"{'case':<28}{'rows':>11}{'best (s)':>10}{'median (s)':>12}{'peak MB':>9}{'vs prev':>9}")
+    with open(args.history, "a") as history :
+        for rows in args.sizes :
+            with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as cache_dir :
+
+                for case, result in run_cases(set(args.cases), rows, args, root, cache_dir).items() :
+
+                    entry = dict(run, case=case, rows=rows, repeat=args.repeat, **result)
+                    history.write(json.dumps(entry) + "\n")
+
+                    prev = previous.get((case, rows))
+                    ratio = entry["seconds_min"] / prev["seconds_min"] if prev and prev["seconds_min"] else None
+                    flag = ""
+                    slower = prev and ratio > args.regression and entry["seconds_min"] - prev["seconds_min"] > args.min_delta
+                    bigger = prev and entry["peak_mb"] > args.regression * max(prev["peak_mb"], 1)
+                    if slower or bigger :
+                        flag = "  REGRESSION"
+                    print(f"{case:<28}{rows:>11}{entry['seconds_min']:>10.4f}{entry['seconds_median']:>12.4f}"
+                          f"{entry['peak_mb']:>9.1f}{(f'{ratio:.2f}x' if ratio else '-'):>9}{flag}")
+
+    print(f"\nHistory: {args.history}")
+
+if __name__ == "__main__" :
+    main()
@@ -1,6 +1,8 @@
 import json
 
-from sagemaker.s3 import S3Downloader, S3Uploader
+from utils.lazy import lazy_import
+
+sagemaker_s3 = lazy_import("sagemaker.s3")
 
     
 class BPConfig() :
@@ -39,7 +41,7 @@ class BPConfig() :
         if not config_uri :
             config_uri = cls.default_config_uri(cls.workspace)
         
-        S3Downloader.download(config_uri, cls.local_dir)
+        sagemaker_s3.S3Downloader.download(config_uri, cls.local_dir)
 
         fname = f"{cls.local_dir}/blueprint-config.json"
         return fname
@@ -56,7 +58,7 @@ class BPConfig() :
     @classmethod
     def _write_to_remote_storage(cls, local, remote) :
         # Currently, supports Amazon S3 exclusively
-        S3Uploader.upload(local, remote)    
+        sagemaker_s3.S3Uploader.upload(local, remote)    
         
     @classmethod 
     def _write_to_local_storage(cls, full_path) :
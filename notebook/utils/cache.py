@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import uuid
+from time import time
+from urllib.parse import urlparse
+
+class ArtifactCache() :
+
+    ## Local on-disk cache for run artifacts stored in S3. Entries are keyed by S3 URI and
+    ## revalidated with conditional GETs (If-None-Match), so unchanged artifacts are never
+    ## downloaded twice. Within revalidate_after seconds of the last validation, cached
+    ## copies are served without any network round trip. The least recently used entries
+    ## are evicted once the cache grows beyond max_bytes. The cache is meant for the small
+    ## artifacts the notebook reads repeatedly, such as the Clarify analysis.json, the SHAP
+    ## values and the metrics summary; Batch Transform results are streamed from S3 instead.
+
+    DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "automl-blueprint")
+    MAX_BYTES = 2 * 1024**3
+    REVALIDATE_AFTER = 300
+    INDEX_FILE = "index.json"
+
+    def __init__(self, db_driver, cache_dir=None, max_bytes=None, revalidate_after=None) :
+
+        self.db = db_driver
+        self.cache_dir = cache_dir if cache_dir else ArtifactCache.DEFAULT_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else ArtifactCache.MAX_BYTES
+        self.revalidate_after = revalidate_after if revalidate_after is not None else ArtifactCache.REVALIDATE_AFTER
+
+        self.hits = 0
+        self.revalidations = 0
+        self.downloads = 0
+
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _index_path(self) :
+        return os.path.join(self.cache_dir, ArtifactCache.INDEX_FILE)
+
+    def _load_index(self) :
+
+        try :
+            with open(self._index_path(), 'r') as f:
+                index = json.loads(f.read())
+        except (OSError, ValueError) :
+            return {}
+
+        # drop entries whose files were removed outside of the cache
+        return {uri: e for uri, e in index.items() if os.path.exists(self._file_path(e))}
+
+    def _save_index(self) :
+
+        tmp = f"{self._index_path()}.{uuid.uuid4().hex}"
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(self._index))
+        os.replace(tmp, self._index_path())
+
+    def _file_path(self, entry) :
+        return os.path.join(self.cache_dir, entry["file"])
+
+    def size(self) :
+        return sum(e["size"] for e in self._index.values())
+
+    def _evict(self, keep=None) :
+
+        total = self.size()
+        for uri, entry in sorted(self._index.items(), key=lambda item: item[1]["last_access"]) :
+            if total <= self.max_bytes :
+                break
+            if uri == keep :
+                continue
+
+            try :
+                os.remove(self._file_path(entry))
+            except OSError :
+                pass
+            total -= entry["size"]
+            del self._index[uri]
+
+    def _download(self, s3_uri, bucket, key, etag=None) :
+
+        kwargs = {"Bucket": bucket, "Key": key}
+        if etag :
+            kwargs["IfNoneMatch"] = etag
+
+        # botocore is already loaded by the client, importing it here keeps it off module load
+        from botocore.exceptions import ClientError
+
+        try :
+            resp = self.db.get_object(**kwargs)
+        except ClientError as e :
+            if e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304 or \
+               e.response.get("Error", {}).get("Code") in ("304", "NotModified") :
+                return None
+            raise
+
+        fname = uuid.uuid4().hex
+        tmp = os.path.join(self.cache_dir, f"{fname}.part")
+        size = 0
+        with open(tmp, 'wb') as f:
+            for chunk in iter(lambda: resp["Body"].read(1024*1024), b"") :
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, os.path.join(self.cache_dir, fname))
+
+        return {"file": fname, "etag": resp["ETag"], "size": size}
+
+    def _validate(self, s3_uri) :
+
+        ## The cached entry of s3_uri, downloaded or revalidated as needed. Its file is not
+        ## protected from eviction by other threads until it is opened under the lock.
+        parsed = urlparse(s3_uri, allow_fragments=False)
+        bucket, key = parsed.netloc, parsed.path.lstrip('/')
+        now = time()
+
+        with self._lock :
+            entry = self._index.get(s3_uri)
+
+        if entry and now - entry["validated"] < self.revalidate_after :
+            self.hits += 1
+        else :
+            fetched = self._download(s3_uri, bucket, key, entry["etag"] if entry else None)
+            if fetched :
+                self.downloads += 1
+                if entry :
+                    try :
+                        os.remove(self._file_path(entry))
+                    except OSError :
+                        pass
+                entry = fetched
+            else :
+                self.revalidations += 1
+            entry["validated"] = now
+
+        return entry
+
+    def open(self, s3_uri, mode='rb') :
+
+        ## Returns an open file of the cached copy. The file is opened under the lock, before any
+        ## eviction can remove it, and an open file stays readable after its entry is evicted.
+        ## An entry that another thread evicted in the meantime is downloaded again.
+        while True :
+
+            entry = self._validate(s3_uri)
+            with self._lock :
+                try :
+                    f = open(self._file_path(entry), mode)
+                except FileNotFoundError :
+                    if self._index.get(s3_uri) is entry :
+                        del self._index[s3_uri]
+                    continue
+
+                entry["last_access"] = time()
+                self._index[s3_uri] = entry
+                self._evict(keep=s3_uri)
+                self._save_index()
+
+            return f
+
+    def get_path(self, s3_uri) :
+
+        ## The path of the cached copy, for single-threaded callers: a later call can evict it.
+        ## Concurrent readers use open.
+        with self.open(s3_uri) as f :
+            return f.name
+
+    def get_etag(self, s3_uri) :
+
+        with self._lock :
+            entry = self._index.get(s3_uri)
+        return entry["etag"] if entry else None
+
+    def get_bytes(self, s3_uri) :
+
+        with self.open(s3_uri, 'rb') as f:
+            return f.read()
+
+    def get_json(self, s3_uri) :
+
+        with self.open(s3_uri, 'r') as f:
+            return json.loads(f.read())
+
+    def clear(self) :
+
+        with self._lock :
+            for entry in self._index.values() :
+                try :
+                    os.remove(self._file_path(entry))
+                except OSError :
+                    pass
+            self._index = {}
+            self._save_index()
@@ -0,0 +1,195 @@
+import os
+from re import compile
+from time import perf_counter
+
+from utils.cache import ArtifactCache
+from utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+class CandidateCatalog() :
+
+    ## Local catalog of the candidates of AutoML jobs. Candidates are listed once per job and
+    ## kept as one row per training step in a columnar file. Completed jobs never change, so
+    ## their catalogs are reused across sessions without calling SageMaker again. Queries are
+    ## answered in-process from an index of step names by candidate pipeline id.
+
+    PAGINATION_SIZE = 100
+    TRAINING_STEP = "AWS::SageMaker::TrainingJob"
+    TERMINAL_STATUSES = ["Completed"]
+    COLUMNS = ["candidate_name", "step_name", "pipeline", "metric_name", "value"]
+
+    # Autopilot step names embed the id of the candidate pipeline, e.g. automl-bp--dpp7-1-784f...
+    PIPELINE_ID = compile(r"dpp\d+")
+
+    def __init__(self, dsmlp_driver, cache_dir=None, verbose=True) :
+
+        self.dsmlp = dsmlp_driver
+        self.cache_dir = cache_dir if cache_dir else os.path.join(ArtifactCache.DEFAULT_DIR, "candidates")
+        self.verbose = verbose
+        self.last_query_seconds = None
+
+        self._catalogs = {}
+        self._indexes = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _fetch(self, job_name) :
+
+        rows = []
+        kwargs = {"AutoMLJobName": job_name,
+                  "StatusEquals": "Completed",
+                  "MaxResults": CandidateCatalog.PAGINATION_SIZE}
+        while True :
+
+            resp = self.dsmlp.list_candidates_for_auto_ml_job(**kwargs)
+            for c in resp["Candidates"] :
+
+                metric = c.get("FinalAutoMLJobObjectiveMetric", {})
+                for s in c["CandidateSteps"] :
+                    if s["CandidateStepType"] == CandidateCatalog.TRAINING_STEP :
+                        pipeline = CandidateCatalog.PIPELINE_ID.search(s["CandidateStepName"])
+                        rows.append([c["CandidateName"],
+                                     s["CandidateStepName"],
+                                     pipeline.group(0) if pipeline else None,
+                                     metric.get("MetricName"),
+                                     metric.get("Value")])
+
+            if "NextToken" not in resp :
+                break
+            kwargs["NextToken"] = resp["NextToken"]
+
+        return pd.DataFrame(rows, columns=CandidateCatalog.COLUMNS)
+
+    def _paths(self, job_name) :
+
+        base = os.path.join(self.cache_dir, job_name)
+        return f"{base}.parquet", f"{base}.pkl"
+
+    def _load(self, job_name) :
+
+        parquet_path, pickle_path = self._paths(job_name)
+        if os.path.exists(parquet_path) :
+            return pd.read_parquet(parquet_path)
+        if os.path.exists(pickle_path) :
+            return pd.read_pickle(pickle_path)
+
+        return None
+
+    def _save(self, job_name, df) :
+
+        parquet_path, pickle_path = self._paths(job_name)
+        try :
+            df.to_parquet(parquet_path, index=False)
+        except ImportError :
+            # pandas needs pyarrow or fastparquet for parquet
+            df.to_pickle(pickle_path)
+
+    def get_candidates(self, job_name) :
+
+        if job_name in self._catalogs :
+            return self._catalogs[job_name]
+
+        df = self._load(job_name)
+        if df is None :
+
+            status = self.dsmlp.describe_auto_ml_job(AutoMLJobName=job_name)["AutoMLJobStatus"]
+            df = self._fetch(job_name)
+
+            # catalogs of jobs that are still running are not final and are never persisted
+            if status not in CandidateCatalog.TERMINAL_STATUSES :
+                return df
+            self._save(job_name, df)
+
+        self._catalogs[job_name] = df
+        self._indexes[job_name] = df.groupby("pipeline").indices
+
+        return df
+
+    def _rows(self, job_name, candidate_id) :
+
+        df = self.get_candidates(job_name)
+        index = self._indexes.get(job_name, {})
+
+        if candidate_id in index :
+            return df.iloc[index[candidate_id]]
+
+        # ids that are not pipeline ids are matched against the step names
+        return df[df["step_name"].str.contains(candidate_id, regex=True)]
+
+    def _timed(self, fn, *args) :
+
+        start = perf_counter()
+        result = fn(*args)
+        self.last_query_seconds = perf_counter() - start
+
+        if self.verbose :
+            print(f"Query answered in {self.last_query_seconds*1000:.1f} ms.")
+
+        return result
+
+    def get_baselines(self, job_name, candidate_ids, maximize_objective=True) :
+
+        def query() :
+
+            baselines = {}
+            for i in candidate_ids :
+
+                rows = self._rows(job_name, i).dropna(subset=["value"])
+                if rows.empty :
+                    baselines[i] = {"value": None}
+                    continue
+
+                best = rows.loc[rows["value"].idxmax() if maximize_objective else rows["value"].idxmin()]
+                baselines[i] = {"value": float(best["value"]), "metric": best["metric_name"]}
+
+            return baselines
+
+        return self._timed(query)
+
+    def get_best_step(self, job_name, candidate_id, maximize_objective=True) :
+
+        ## Same result as the JMESPath max_by query over list-candidates-for-auto-ml-job.
+        def query() :
+
+            rows = self._rows(job_name, candidate_id).dropna(subset=["value"])
+            if rows.empty :
+                return None
+
+            best = rows.loc[rows["value"].idxmax() if maximize_objective else rows["value"].idxmin()]
+            return {"step_name": [best["step_name"]], "obj_value": float(best["value"])}
+
+        return self._timed(query)
+
+    def get_top_k(self, job_name, k=10, maximize_objective=True, candidate_id=None) :
+
+        def query() :
+
+            rows = self.get_candidates(job_name) if not candidate_id else self._rows(job_name, candidate_id)
+            rows = rows.dropna(subset=["value"])
+            return rows.nlargest(k, "value") if maximize_objective else rows.nsmallest(k, "value")
+
+        return self._timed(query)
+
+    def get_leaderboard(self, job_name, maximize_objective=True) :
+
+        ## Best candidate per pipeline, ranked by the objective metric.
+        def query() :
+
+            rows = self.get_candidates(job_name).dropna(subset=["value", "pipeline"])
+            rows = rows.sort_values("value", ascending=not maximize_objective)
+            board = rows.groupby("pipeline", sort=False).head(1)
+            board = board.assign(trials=board["pipeline"].map(rows["pipeline"].value_counts()))
+
+            return board.reset_index(drop=True)
+
+        return self._timed(query)
+
+    def clear(self, job_name=None) :
+
+        names = [job_name] if job_name else list(self._catalogs.keys())
+        for name in names :
+            self._catalogs.pop(name, None)
+            self._indexes.pop(name, None)
+            for path in self._paths(name) :
+                if os.path.exists(path) :
+                    os.remove(path)
@@ -0,0 +1,38 @@
+import importlib
+import sys
+
+class LazyModule() :
+
+    ## Stands in for a module until one of its attributes is first used, so heavy
+    ## dependencies are only imported by the features that need them.
+
+    def __init__(self, name) :
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self) :
+
+        if self._module is None :
+            # importlib holds the import lock, so concurrent first uses import the module once
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr) :
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value) :
+        setattr(self._load(), attr, value)
+
+    def __dir__(self) :
+        return dir(self._load())
+
+    def __repr__(self) :
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name) :
+
+    if name in sys.modules :
+        return sys.modules[name]
+
+    return LazyModule(name)
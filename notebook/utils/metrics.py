@@ -0,0 +1,220 @@
+import numpy as np
+
+class ThresholdMetrics() :
+
+    ## Sorts the predictions once and keeps cumulative true/false positive counts. Every
+    ## threshold metric (confusion matrix, ROC, PR, lift and gain) is then a binary search
+    ## into the sorted scores followed by constant-time lookups.
+
+    def __init__(self, y, scores) :
+
+        y = np.asarray(y).astype(bool)
+        scores = np.asarray(scores, dtype=float)
+
+        order = np.argsort(-scores, kind="mergesort")
+        self.scores = scores[order]
+        self.cum_tp = np.cumsum(y[order], dtype=np.int64)
+        self.cum_fp = np.arange(1, len(order)+1, dtype=np.int64) - self.cum_tp
+
+        self.n = len(order)
+        self.n_pos = int(self.cum_tp[-1]) if self.n else 0
+        self.n_neg = self.n - self.n_pos
+
+        # ascending view for searchsorted
+        self._ascending = self.scores[::-1]
+
+    def _n_predicted_positive(self, threshold) :
+        return self.n - int(np.searchsorted(self._ascending, threshold, side="left"))
+
+    def counts(self, threshold) :
+
+        k = self._n_predicted_positive(threshold)
+        tp = int(self.cum_tp[k-1]) if k else 0
+        fp = int(self.cum_fp[k-1]) if k else 0
+
+        return {"tp": tp, "fp": fp, "fn": self.n_pos - tp, "tn": self.n_neg - fp}
+
+    def confusion_matrix(self, threshold) :
+
+        c = self.counts(threshold)
+        return np.array([[c["tn"], c["fp"]],
+                         [c["fn"], c["tp"]]])
+
+    def metrics_at(self, threshold) :
+
+        c = self.counts(threshold)
+        predicted_pos = c["tp"] + c["fp"]
+
+        c["tpr"] = c["tp"] / self.n_pos if self.n_pos else 0.0
+        c["fpr"] = c["fp"] / self.n_neg if self.n_neg else 0.0
+        c["precision"] = c["tp"] / predicted_pos if predicted_pos else 1.0
+        c["accuracy"] = (c["tp"] + c["tn"]) / self.n if self.n else 0.0
+
+        return c
+
+    def _distinct(self) :
+        # index of the last prediction in each run of tied scores
+        return np.r_[np.flatnonzero(np.diff(self.scores)), self.n - 1]
+
+    def roc_curve(self) :
+
+        idx = self._distinct()
+        fpr = np.r_[0.0, self.cum_fp[idx] / max(self.n_neg, 1)]
+        tpr = np.r_[0.0, self.cum_tp[idx] / max(self.n_pos, 1)]
+        thresholds = np.r_[self.scores[0] + 1, self.scores[idx]]
+
+        return fpr, tpr, thresholds
+
+    def auc(self) :
+
+        fpr, tpr, _ = self.roc_curve()
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    def pr_curve(self) :
+
+        idx = self._distinct()
+        tp = self.cum_tp[idx]
+        precision = tp / (idx + 1)
+        recall = tp / max(self.n_pos, 1)
+
+        return precision, recall, self.scores[idx]
+
+    def lift_gain(self, n_bins=10) :
+
+        ## Cumulative gain and lift for the top q fraction of predictions, q = 1/n_bins ... 1.
+        depth = np.arange(1, n_bins+1) / n_bins
+        k = np.maximum(np.ceil(depth * self.n).astype(np.int64), 1)
+        gain = self.cum_tp[k-1] / max(self.n_pos, 1)
+        lift = gain / depth
+
+        return depth, gain, lift
+
+class ScoreHistogram() :
+
+    ## Fixed-resolution histogram of prediction scores per class. Memory is constant in the
+    ## number of predictions, histograms of different shards can be built independently and
+    ## merged, and every threshold metric is exact at bin edges. Between edges, the error is
+    ## bounded by the number of predictions that fall in the same bin as the threshold.
+
+    N_BINS = 1000
+    EDGE_DECIMALS = 9
+
+    def __init__(self, n_bins=None, lo=0.0, hi=1.0) :
+
+        self.n_bins = n_bins if n_bins else ScoreHistogram.N_BINS
+        self.lo = lo
+        self.hi = hi
+        self.pos = np.zeros(self.n_bins, dtype=np.int64)
+        self.neg = np.zeros(self.n_bins, dtype=np.int64)
+
+    def _bin(self, scores) :
+        # scores outside of [lo, hi] are counted in the first and last bin
+        # rounded first, so that a score on a bin edge, such as 0.29 * 100 = 28.999..., is
+        # counted in the bin that starts at the edge
+        idx = np.floor(np.round((np.asarray(scores, dtype=float) - self.lo) / (self.hi - self.lo) * self.n_bins, ScoreHistogram.EDGE_DECIMALS))
+        return np.clip(idx, 0, self.n_bins - 1).astype(np.int64)
+
+    def update(self, y, scores) :
+
+        y = np.asarray(y).astype(bool)
+        idx = self._bin(scores)
+        self.pos += np.bincount(idx[y], minlength=self.n_bins)
+        self.neg += np.bincount(idx[~y], minlength=self.n_bins)
+
+        return self
+
+    def merge(self, other) :
+
+        if (self.n_bins, self.lo, self.hi) != (other.n_bins, other.lo, other.hi) :
+            raise Exception("Only histograms with the same bins can be merged.")
+
+        self.pos += other.pos
+        self.neg += other.neg
+
+        return self
+
+    def to_dict(self) :
+        return {
+            "n_bins": self.n_bins,
+            "lo": self.lo,
+            "hi": self.hi,
+            "pos": self.pos.tolist(),
+            "neg": self.neg.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, d) :
+
+        hist = cls(d["n_bins"], d["lo"], d["hi"])
+        hist.pos = np.asarray(d["pos"], dtype=np.int64)
+        hist.neg = np.asarray(d["neg"], dtype=np.int64)
+
+        return hist
+
+    @property
+    def n_pos(self) :
+        return int(self.pos.sum())
+
+    @property
+    def n_neg(self) :
+        return int(self.neg.sum())
+
+    @property
+    def n(self) :
+        return self.n_pos + self.n_neg
+
+    def edges(self) :
+        return np.linspace(self.lo, self.hi, self.n_bins + 1)
+
+    def counts(self, threshold) :
+
+        ## Predictions in bins at or above the threshold's bin are counted as positive. Only
+        ## the predictions in the threshold's own bin can be misclassified, which gives the
+        ## error bound.
+        b = int(self._bin([threshold])[0])
+        tp = int(self.pos[b:].sum())
+        fp = int(self.neg[b:].sum())
+
+        return {"tp": tp, "fp": fp, "fn": self.n_pos - tp, "tn": self.n_neg - fp,
+                "error_bound": int(self.pos[b] + self.neg[b])}
+
+    def confusion_matrix(self, threshold) :
+
+        c = self.counts(threshold)
+        return np.array([[c["tn"], c["fp"]],
+                         [c["fn"], c["tp"]]])
+
+    def metrics_at(self, threshold) :
+
+        c = self.counts(threshold)
+        predicted_pos = c["tp"] + c["fp"]
+
+        c["tpr"] = c["tp"] / self.n_pos if self.n_pos else 0.0
+        c["fpr"] = c["fp"] / self.n_neg if self.n_neg else 0.0
+        c["precision"] = c["tp"] / predicted_pos if predicted_pos else 1.0
+        c["accuracy"] = (c["tp"] + c["tn"]) / self.n if self.n else 0.0
+
+        return c
+
+    def roc_curve(self) :
+
+        # one point per lower bin edge, from the highest threshold down
+        tp = np.cumsum(self.pos[::-1])
+        fp = np.cumsum(self.neg[::-1])
+        fpr = np.r_[0.0, fp / max(self.n_neg, 1)]
+        tpr = np.r_[0.0, tp / max(self.n_pos, 1)]
+        thresholds = np.r_[self.hi + (self.hi - self.lo) / self.n_bins, self.edges()[-2::-1]]
+
+        return fpr, tpr, thresholds
+
+    def auc(self) :
+
+        fpr, tpr, _ = self.roc_curve()
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    def auc_error_bound(self) :
+
+        ## The trapezoid scores every positive/negative pair sharing a bin as a tie (1/2),
+        ## while the exact AUC scores it 0 or 1.
+        pairs = self.n_pos * self.n_neg
+        return float(np.sum(self.pos * self.neg) / (2 * pairs)) if pairs else 0.0
@@ -3,7 +3,9 @@ import os
 
 from utils.bpconfig import BPConfig
 
-from sagemaker.s3 import S3Downloader
+from utils.lazy import lazy_import
+
+sagemaker_s3 = lazy_import("sagemaker.s3")
 
 # the sample v1.0 flow included as an example for this blueprint
 FLOW_NAME = "uci-bank-marketing-dataset.flow"
@@ -14,7 +16,7 @@ def copy_sample_flow_to_local(workspace, local_dir) :
         
     fname = f"{local_dir}/{FLOW_NAME}"
     flow_uri = f"s3://{workspace}/{config.ws_prefix()}/meta/{FLOW_NAME}"
-    S3Downloader.download(flow_uri, local_dir)
+    sagemaker_s3.S3Downloader.download(flow_uri, local_dir)
 
     # Change the flow definition so that it references the dataset copied over by the user
     def _update_sample_flow_def(fname, s3_uri) :
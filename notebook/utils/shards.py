@@ -0,0 +1,144 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+class ShardReader() :
+
+    # boto3 clients default to a pool of 10 connections per host
+    MAX_WORKERS = 10
+    PAGINATION_SIZE = 1000
+    CHUNK_ROWS = 100000
+
+    def __init__(self, db_driver, max_workers=None, verbose=True, cache=None) :
+
+        self.db = db_driver
+        self.cache = cache
+        self.max_workers = max_workers if max_workers else ShardReader.MAX_WORKERS
+        self.verbose = verbose
+        self.stats = {}
+
+    @classmethod
+    def _is_artifact(cls, key, prefix) :
+        
+        # unless the prefix ends with "/", the first segment continues the prefix's last one
+        segments = key[len(prefix):].split("/")
+        segments = segments if not prefix or prefix.endswith("/") else segments[1:]
+        return any(segment.startswith("_") for segment in segments)
+    
+    def list_shards(self, bucket, prefix) :
+
+        keys = []
+        paginator = self.db.get_paginator("list_objects_v2")
+        pages = paginator.paginate(Bucket=bucket,
+                                   Prefix=prefix,
+                                   PaginationConfig={"PageSize": ShardReader.PAGINATION_SIZE})
+        for page in pages :
+            for obj in page.get("Contents", []) :
+                # skip folder placeholders, empty parts, and artifacts such as _summary/ next to the shards
+                if obj["Size"] > 0 and not obj["Key"].endswith("/") and not self._is_artifact(obj["Key"], prefix) :
+                    keys.append(obj["Key"])
+
+        return keys
+
+    def _fetch(self, bucket, key) :
+
+        if self.cache :
+            return self.cache.get_bytes(f"s3://{bucket}/{key}")
+
+        return self.db.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    def _read_shard(self, bucket, key, read_csv_args, data_format="csv", columns=None) :
+
+        data = self._fetch(bucket, key)
+        # pyarrow only decodes the column chunks of the selected columns
+        if data_format == "parquet" :
+            return len(data), pd.read_parquet(io.BytesIO(data), columns=columns, engine="pyarrow")
+
+        if columns is not None :
+            read_csv_args = dict(read_csv_args, usecols=columns)
+        return len(data), pd.read_csv(io.BytesIO(data), **read_csv_args)
+
+    def read_shards(self, bucket, keys, data_format="csv", columns=None, **read_csv_args) :
+
+        ## Shards are downloaded and parsed concurrently. map() returns them in the order of
+        ## keys, so the merged result is deterministic regardless of completion order.
+        if not keys :
+            return []
+
+        workers = min(self.max_workers, len(keys))
+        with ThreadPoolExecutor(max_workers=workers) as pool :
+            return list(pool.map(lambda key: self._read_shard(bucket, key, read_csv_args, data_format, columns), keys))
+
+    def _open(self, bucket, key) :
+
+        if self.cache :
+            return self.cache.open(f"s3://{bucket}/{key}")
+
+        return self.db.get_object(Bucket=bucket, Key=key)["Body"]
+
+    def _fold_shard(self, bucket, key, init, fold, read_csv_args) :
+
+        acc = init()
+        body = self._open(bucket, key)
+        try :
+            for chunk in pd.read_csv(body, **read_csv_args) :
+                acc = fold(acc, chunk)
+        finally :
+            body.close()
+
+        return acc
+
+    def fold_shards(self, bucket, prefix, init, fold, chunksize=None, **read_csv_args) :
+
+        ## Out-of-core alternative to read_merged_df. Each shard is streamed in chunks of
+        ## chunksize rows into its own accumulator, created by init() and updated with
+        ## fold(acc, chunk). Shards are processed concurrently and their accumulators are
+        ## returned in the order of the keys, for the caller to merge.
+        start = time()
+        keys = self.list_shards(bucket, prefix)
+        if not keys :
+            raise Exception(f"No data found under s3://{bucket}/{prefix}.")
+
+        read_csv_args["chunksize"] = chunksize if chunksize else ShardReader.CHUNK_ROWS
+        workers = min(self.max_workers, len(keys))
+        with ThreadPoolExecutor(max_workers=workers) as pool :
+            accs = list(pool.map(lambda key: self._fold_shard(bucket, key, init, fold, read_csv_args), keys))
+
+        elapsed = time() - start
+        self.stats = {"shards": len(keys), "seconds": elapsed}
+
+        if self.verbose :
+            print(f"Streamed {len(keys)} shards from s3://{bucket}/{prefix} in {elapsed:.2f}s.")
+
+        return accs
+
+    def read_merged_df(self, bucket, prefix, data_format="csv", columns=None, **read_csv_args) :
+
+        ## Shards are CSV, parsed with read_csv_args, or Parquet. With columns, only those
+        ## columns are parsed.
+        start = time()
+        keys = self.list_shards(bucket, prefix)
+        if not keys :
+            raise Exception(f"No data found under s3://{bucket}/{prefix}.")
+
+        shards = self.read_shards(bucket, keys, data_format, columns, **read_csv_args)
+        df = pd.concat([shard for _, shard in shards])
+
+        elapsed = time() - start
+        nbytes = sum(n for n, _ in shards)
+        self.stats = {
+            "shards": len(keys),
+            "bytes": nbytes,
+            "seconds": elapsed,
+            "bytes_per_sec": nbytes / elapsed if elapsed > 0 else float("inf")
+        }
+
+        if self.verbose :
+            print(f"Read {len(keys)} shards ({nbytes/2**20:.1f} MB) from s3://{bucket}/{prefix} "
+                  f"in {elapsed:.2f}s ({self.stats['bytes_per_sec']/2**20:.1f} MB/s).")
+
+        return df
@@ -1,25 +1,25 @@
-import json
-import os
-import subprocess
-from re import search
-
-import matplotlib.pyplot as plt
-import ipywidgets as widgets
-from ipywidgets import interact, interactive, fixed, interact_manual
-import seaborn as sns
-
-import pandas as pd
 import numpy as np
-import shap
-from sklearn.metrics import roc_curve, auc, RocCurveDisplay, confusion_matrix
 
-import boto3
+from utils.lazy import lazy_import
+from utils.cache import ArtifactCache
+from utils.catalog import CandidateCatalog
+from utils.metrics import ScoreHistogram, ThresholdMetrics
+from utils.shards import ShardReader
 
-from sagemaker.s3 import S3Downloader
+# plotting, widget, explainability and AWS dependencies are only imported on first use
+plt = lazy_import("matplotlib.pyplot")
+widgets = lazy_import("ipywidgets")
+ipd = lazy_import("IPython.display")
+sns = lazy_import("seaborn")
+pd = lazy_import("pandas")
+shap = lazy_import("shap")
+skmetrics = lazy_import("sklearn.metrics")
+boto3 = lazy_import("boto3")
         
 class ModelInspector() :
 
     PAGINATION_SIZE = 100
+    SUMMARY_KEY = "_summary/metrics.json"
     _instance = None
 
     def __init__(self):
@@ -31,6 +31,12 @@ class ModelInspector() :
         if not cls._instance :
             cls._instance = cls.__new__(cls)
         
+        source = (config["workspace"], config["prefixes"]["results_path"])
+        if source != getattr(cls, "_results_source", None) :
+            cls._results_df = None
+            cls._metrics_engine = None
+            cls._results_source = source
+            
         cls.bucket = config["workspace"]
         cls.results_prefix = config["prefixes"]["results_path"]
         cls.bias_prefix = config["prefixes"]["bias_path"]
@@ -38,53 +44,67 @@ class ModelInspector() :
         
         cls.gt_idx = config["results-config"]["gt_index"]
         cls.pred_idx = config["results-config"]["pred_index"]
+        
+        binned = config["results-config"].get("binned", None)
+        use_summary = config["results-config"].get("use_summary", True)
+        if binned != getattr(cls, "_binned", None) or use_summary != getattr(cls, "_use_summary", None) :
+            cls._metrics_engine = None
+        cls._binned = binned
+        cls._use_summary = use_summary
 
         db_driver = config["drivers"]["db"]
         dsmlp_driver = config["drivers"]["dsmlp"]
         cls.db = boto3.client("s3") if not db_driver else db_driver
         cls.dsmlp = boto3.client("sagemaker") if not dsmlp_driver else dsmlp_driver
-                
-        cls.results_df = cls._get_merged_df(cls.bucket, cls.results_prefix)
+        
+        cache_config = config["cache"] if "cache" in config else {}
+        cls.cache = ArtifactCache(cls.db, **cache_config)
+        cls._frames = {}
+        cls.catalog = CandidateCatalog(cls.dsmlp, **config.get("catalog", {}))
         
         return cls._instance 
     
+    ## Results are loaded on first use rather than every time the inspector is configured.
+    @property
+    def results_df(self) :
+        
+        if self._results_df is None :
+            type(self)._results_df = self._get_merged_df(self.bucket, self.results_prefix)
+        return self._results_df
+        
     def get_results(self) :
         return self.results_df
     
+    ## maxkeys is no longer used: the reader paginates over every shard under the prefix.
+    ## Result shards are read once per result set and can be larger than the artifact cache,
+    ## so they are streamed from S3 rather than cached.
     @classmethod
-    def _get_merged_df(cls, bucket, prefix, has_header=True, maxkeys=10) :
+    def _get_merged_df(cls, bucket, prefix, has_header=True, maxkeys=None) :
         
-        files = []
-        skip = 0
-        kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': maxkeys}
-        resp = cls.db.list_objects_v2(**kwargs)
-        for obj in resp['Contents'] :
-            
-            if (has_header) :
-                skip = 1
-
-            files.append(pd.read_csv("s3://{}/{}".format(bucket, obj["Key"]), skiprows=skip, header=None))
-                
-        df = pd.concat(files)
-
-        return df
+        skip = 1 if has_header else 0
+        return ShardReader(cls.db).read_merged_df(bucket, prefix, skiprows=skip, header=None)
     
     def get_roc_curve(self, gt_index=0, pred_index=1, display=True, model_name="autopilot-model") :
             
-        y = self._y()
-        yh = self._yh()
-        
-        fpr, tpr, thresholds = roc_curve(y, yh)
-        roc_auc = auc(fpr, tpr)
+        engine = self._metrics()
+        fpr, tpr, thresholds = engine.roc_curve()
+        roc_auc = engine.auc()
 
-        viz = RocCurveDisplay(fpr=fpr, tpr=tpr, roc_auc=roc_auc, estimator_name=model_name) 
+        try :
+            viz = skmetrics.RocCurveDisplay(fpr=fpr, tpr=tpr, roc_auc=roc_auc, name=model_name)
+        except TypeError :
+            # scikit-learn before 1.7 only accepts estimator_name
+            viz = skmetrics.RocCurveDisplay(fpr=fpr, tpr=tpr, roc_auc=roc_auc, estimator_name=model_name)
 
         if display :
             viz.plot()
             
         return viz, roc_auc, fpr, tpr, thresholds
         
-    def visualize_auc(self, fpr, tpr, thresholds) :
+    def visualize_auc(self, fpr=None, tpr=None, thresholds=None) :
+        
+        if fpr is None :
+            fpr, tpr, thresholds = self._metrics().roc_curve()
         
         df = pd.DataFrame({
             "False Positive Rate":fpr,
@@ -104,50 +124,147 @@ class ModelInspector() :
     def _yh(self) :
         return self.results_df[self.pred_idx]
     
+    ## The Error Analysis stage summarizes the predictions into a score histogram, which serves
+    ## the widgets without downloading the results. Set "use_summary" to false in results-config
+    ## for exact metrics. Without a summary, the predictions are sorted once per result set and
+    ## every threshold after that is a lookup. When results-config sets "binned" to a number of
+    ## bins, the results are never loaded into memory and a streamed histogram is used instead.
+    def _metrics(self) :
+        
+        if self._metrics_engine is None :
+            summary = self.get_metrics_summary() if self._use_summary else None
+            if summary :
+                type(self)._metrics_engine = ScoreHistogram.from_dict(summary["histogram"])
+                print(f"Metrics are approximated from the Error Analysis summary, a histogram of "
+                      f"{self._metrics_engine.n_bins} bins. Set use_summary to false in results-config for exact metrics.")
+            elif self._binned :
+                type(self)._metrics_engine = self.get_binned_metrics(n_bins=self._binned)
+                print(f"Metrics are approximated from a histogram of {self._metrics_engine.n_bins} bins streamed from the results.")
+            else :
+                type(self)._metrics_engine = ThresholdMetrics(self._y(), self._yh())
+                print(f"Metrics are exact, computed from the {len(self.results_df)} predictions.")
+        return self._metrics_engine
+    
+    ## Results of runs before the summary, or with it disabled, have none. Any other failure to
+    ## read it is raised rather than falling back to downloading every prediction.
+    def get_metrics_summary(self) :
+        
+        from botocore.exceptions import ClientError
+        
+        summary_uri = f"s3://{self.bucket}/{self.results_prefix}/{self.SUMMARY_KEY}"
+        try :
+            summary = self.cache.get_json(summary_uri)
+        except ClientError as e :
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404") :
+                raise
+            return None
+        
+        # a summary of other columns than the configured ones does not describe these results
+        if (summary.get("gt_index"), summary.get("pred_index")) != (self.gt_idx, self.pred_idx) :
+            return None
+        
+        return summary
+    
+    def get_calibration_table(self) :
+        
+        summary = self.get_metrics_summary()
+        if not summary :
+            return None
+        
+        return pd.DataFrame(summary["calibration"])
+    
+    def get_binned_metrics(self, n_bins=None, chunksize=None, has_header=True) :
+        
+        gt_idx, pred_idx = self.gt_idx, self.pred_idx
+        
+        def fold(hist, chunk) :
+            return hist.update(chunk[gt_idx], chunk[pred_idx])
+        
+        reader = ShardReader(self.db)
+        hists = reader.fold_shards(self.bucket, 
+                                   self.results_prefix, 
+                                   lambda: ScoreHistogram(n_bins), 
+                                   fold,
+                                   chunksize=chunksize,
+                                   skiprows=1 if has_header else 0,
+                                   header=None,
+                                   usecols=[gt_idx, pred_idx])
+        
+        hist = hists[0]
+        for h in hists[1:] :
+            hist.merge(h)
+        
+        return hist
+    
+    @classmethod
+    def _cm_labels(cls, cm) :
+        
+        names = ['True Neg','False Pos','False Neg','True Pos']
+        total = max(np.sum(cm), 1)
+        
+        return [f"{name}\n{value:0.0f}\n{value/total:.2%}" for name, value in zip(names, cm.flatten())]
+    
     def display_interactive_cm(self, start=0.5, min=0.0, max=1.0, step=0.05) :
 
-        y = self._y()
-        yh = self._yh()
+        engine = self._metrics()
+        cm = engine.confusion_matrix(start)
         
-        def cm_heatmap_fn(Threshold) :
-
-            cm = confusion_matrix(y, yh >= Threshold).astype(int)
-
-            names = ['True Neg','False Pos','False Neg','True Pos']
-            counts = ["{0:0.0f}".format(value)
-                            for value in cm.flatten()]
-
-            pcts = ["{0:.2%}".format(value)
-                                 for value in cm.flatten()/np.sum(cm)]
-
-            labels = [f"{v1}\n{v2}\n{v3}"
-                      for v1, v2, v3 in zip(names,counts,pcts)]
-
-            labels = np.asarray(labels).reshape(2,2)
-            sns.heatmap(cm, annot=labels, fmt='', cmap='Blues')
+        ## The heatmap is drawn once. Moving the slider only swaps the cell values, color
+        ## limits and annotations of the existing figure instead of redrawing it.
+        fig, ax = plt.subplots()
+        sns.heatmap(cm, annot=np.asarray(self._cm_labels(cm)).reshape(2,2), fmt='', cmap='Blues', ax=ax)
+        plt.close(fig)
+        
+        mesh = ax.collections[0]
+        cmap = mesh.get_cmap()
+        out = widgets.Output()
+        
+        def update_cm(change) :
+            
+            cm = engine.confusion_matrix(change["new"])
+            mesh.set_array(cm.flatten())
+            mesh.set_clim(cm.min(), cm.max())
+            
+            for text, label, value in zip(ax.texts, self._cm_labels(cm), cm.flatten()) :
+                text.set_text(label)
+                # keep the annotations readable against the new cell color
+                r, g, b, _ = cmap(mesh.norm(value))
+                text.set_color("black" if 0.299*r + 0.587*g + 0.114*b > 0.408 else "white")
+            
+            fig.canvas.draw_idle()
+            with out :
+                out.clear_output(wait=True)
+                ipd.display(fig)
 
         thresh_slider = widgets.FloatSlider(value=start,
                                             min=min,
                                             max=max,
-                                            step=step)
-
-        interact(cm_heatmap_fn, Threshold=thresh_slider)
+                                            step=step,
+                                            description="Threshold")
+        thresh_slider.observe(update_cm, names="value")
+        
+        with out :
+            ipd.display(fig)
+        ipd.display(widgets.VBox([thresh_slider, out]))
         
     def _download_clarify_xai_summary(self) :
         
+        summary_uri = f"s3://{self.bucket}/{self.xai_prefix}/analysis.json"
         try :
-    
-            summary_uri = f"s3://{self.bucket}/{self.xai_prefix}/analysis.json"
-            S3Downloader.download(summary_uri, os.getcwd())
-
-            with open('analysis.json', 'r') as f:
-                summary = json.loads(f.read())
-
-            return summary
+            return self.cache.get_json(summary_uri)
     
         except Exception as e:
-            print(f"{e}: Failed to download {xai_summary}")
+            print(f"{e}: Failed to download {summary_uri}")
+    
+    ## Parsed artifacts are kept in memory for as long as the cached copy's ETag is unchanged.
+    def _get_cached_df(self, s3_uri) :
+        
+        with self.cache.open(s3_uri) as f :
+            etag = self.cache.get_etag(s3_uri)
+            if s3_uri not in self._frames or self._frames[s3_uri][0] != etag :
+                self._frames[s3_uri] = (etag, pd.read_csv(f))
             
+        return self._frames[s3_uri][1]
     
     def explain_prediction(self, data_row_id) :
     
@@ -155,7 +272,7 @@ class ModelInspector() :
         
         columns = list(xai_summary['explanations']['kernel_shap']['label0']["global_shap_values"].keys())
         xai_results = f"s3://{self.bucket}/{self.xai_prefix}/explanations_shap/out.csv"
-        shap_df = pd.read_csv(xai_results)
+        shap_df = self._get_cached_df(xai_results)
 
         y = self._y()
         yh = self._yh()
@@ -181,55 +298,21 @@ class ModelInspector() :
     def _get_comparator(cls, maximize_objective=True) :    
         return cls._gte if maximize_objective else cls._lte
     
-    def _init_baseline_summary(self, ids) :
-
-        baselines = {}
-        for i in ids :
-            baselines[i] = {"value": None}
-        return baselines
-
     def get_automl_job_baseline(self, job_name, candidate_ids, maximize_objective=True) :
-        
-        comparator = self._get_comparator(maximize_objective)
-        baselines = self._init_baseline_summary(candidate_ids)
-
-        trial_details = self.dsmlp.list_candidates_for_auto_ml_job(
-                                    AutoMLJobName=job_name,
-                                    StatusEquals="Completed",
-                                    MaxResults=ModelInspector.PAGINATION_SIZE)
-        while True :
-
-            candidates = trial_details["Candidates"]
-            for c in candidates :
-                
-                steps = c["CandidateSteps"]
-                for s in steps :
-                    for i in candidate_ids :
-                        
-                        if s["CandidateStepType"] == "AWS::SageMaker::TrainingJob" and search(i, s["CandidateStepName"]) :
-                            metric = c['FinalAutoMLJobObjectiveMetric']['Value']      
-                            if not baselines[i]["value"] or comparator(metric, baselines[i]["value"]) :
-                                baselines[i]["metric"] = c['FinalAutoMLJobObjectiveMetric']['MetricName']
-                                baselines[i]["value"] = metric
-
-            if "NextToken" not in trial_details :
-                break
-
-            next_token = trial_details["NextToken"]
-            trial_details = self.dsmlp.list_candidates_for_auto_ml_job(
-                                AutoMLJobName = job_name,
-                                StatusEquals = "Completed",
-                                MaxResults = ModelInspector.PAGINATION_SIZE,
-                                NextToken = next_token)
-            
-        return baselines
+        return self.catalog.get_baselines(job_name, candidate_ids, maximize_objective)
+    
+    def get_automl_job_leaderboard(self, job_name, maximize_objective=True) :
+        return self.catalog.get_leaderboard(job_name, maximize_objective)
     
+    def get_automl_job_top_k(self, job_name, k=10, maximize_objective=True, candidate_id=None) :
+        return self.catalog.get_top_k(job_name, k, maximize_objective, candidate_id)
+    
+    ## Returns the equivalent AWS CLI command for reference. The query itself is answered from
+    ## the candidate catalog instead of running the CLI.
     def get_aws_cli_query_for_baselines(self, job_name, candidate_id) :
         
         jmespath_query = "max_by(Candidates[].{step_name:CandidateSteps[?CandidateStepType == 'AWS::SageMaker::TrainingJob'].CandidateStepName[?contains(@,'"+candidate_id+"')==\`true\`],obj_value:FinalAutoMLJobObjectiveMetric.Value}[?not_null(step_name)], &obj_value)"
         
         cmd = "aws sagemaker list-candidates-for-auto-ml-job --auto-ml-job-name {} --query \"{}\"".format(job_name,jmespath_query)
         
-        stdout = subprocess.check_output(cmd, shell=True)
-        
-        return (cmd, json.loads(stdout))
+        return (cmd, self.catalog.get_best_step(job_name, candidate_id))
@@ -1,13 +1,15 @@
 from utils.bpconfig import BPConfig
+from utils.shards import ShardReader
 
 import json
-from tqdm.notebook import trange, tqdm
 from time import sleep, time
 from urllib.parse import urlparse
 
-import pandas as pd
+from utils.lazy import lazy_import
 
-import boto3
+pd = lazy_import("pandas")
+boto3 = lazy_import("boto3")
+tqdm_notebook = lazy_import("tqdm.notebook")
 
 class BPRunner :
     
@@ -40,11 +42,24 @@ class BPRunner :
         BPRunner.ENGINES["botocore.client.SFN"]["init"] = cls._configure_sfn_driver
     #######################################################################
     
-    def __init__(self, workspace, db_driver=None, wf_driver=None) :
+    ## SageMaker jobs run by the workflow's stages, by state name: the job type and where the
+    ## job name is found in the execution output.
+    JOB_STAGES = {
+        "Data Prep": ("processing", ["dataprep-config", "data-wrangler-job-def", "ProcessingJobName"]),
+        "AutoML": ("automl", ["model-config", "job-results", "job_name"]),
+        "Error Analysis": ("transform", ["error-analysis-config", "job_name"]),
+        "Bias Analysis": ("processing", ["bias-analysis-config", "job_name"]),
+        "XAI Analysis": ("processing", ["xai-config", "job_name"])
+    }
+    
+    HISTORY_PAGE_SIZE = 1000
+    
+    def __init__(self, workspace, db_driver=None, wf_driver=None, ml_driver=None) :
         
         #default StepFunctions as the workflow engine           
         self.client = wf_driver if wf_driver else  boto3.client(BPRunner.ENGINES["sfn"])
         self.db = db_driver if db_driver else boto3.client("s3")
+        self.ml = ml_driver if ml_driver else boto3.client("sagemaker")
     
         self.client_type = self.classname(self.client)
         if not self.client_type in BPRunner.ENGINES :
@@ -54,7 +69,7 @@ class BPRunner :
         self._load_config()
         BPRunner.ENGINES[self.client_type]["init"](wf_driver)
             
-    def run_blueprint(self, name, n_stages, wait=False) :
+    def run_blueprint(self, name, n_stages=None, wait=False) :
         
         if BPRunner.ENGINES[self.client_type]["type"] == "stepfunctions" :
             wf_id = self.find_sfn_arn(name)
@@ -63,8 +78,7 @@ class BPRunner :
             
             if wait :
                 monitor = BPRunner.ENGINES[self.client_type]["monitor"]
-                # TODO: need a generic way to obtain the workflow steps. Currently, the progress bar is
-                # hardcoded to 9 steps.
+                # without n_stages, the monitor counts the states of a successful run from the definition
                 monitor.run(execution_id, n_stages)
                 
         return execution_id
@@ -107,29 +121,310 @@ class BPRunner :
         
         return json.loads(exec_details["output"])[0]["Payload"]["model-config"]["model_name"]
     
+    ## Timing and memory of every stage invocation, as recorded by the stages in the
+    ## "telemetry" section of the workflow payload. One row per span, with a "handler" row
+    ## for the whole invocation and an "api:<service>" row for the time in each service's API.
+    def get_telemetry(self, run_id) :
+        
+        exec_details = self.client.describe_execution(executionArn=run_id)
+        status = exec_details["status"] if "status" in exec_details else "UNKNOWN"
+        
+        if status != "SUCCEEDED" :
+            raise Exception(f"{run_id} must have a SUCCEEDED status. Status is {status}.")
+        
+        output = json.loads(exec_details["output"])
+        
+        # the evaluation branches share the history of the stages before the Parallel state
+        records = {}
+        for branch in output if isinstance(output, list) else [output] :
+            for payload in [branch.get("Payload", {}), branch.get("taskresult", {}).get("Payload", {})] :
+                for record in payload.get("telemetry", []) :
+                    records[(record["stage"], record["start"])] = record
+        
+        rows = []
+        for record in sorted(records.values(), key=lambda r: r["start"]) :
+            
+            invocation = {  "stage": record["stage"],
+                            "start": pd.to_datetime(record["start"], unit="s"),
+                            "invocations": record["n"],
+                            "peak_mb": record["peak_mb"],
+                            "rss_mb": record["rss_mb"]}
+            
+            api_calls = sum(usage[0] for usage in record["api"].values())
+            rows.append(dict(invocation, span="handler", offset_ms=0.0, duration_ms=record["ms"], bytes=None, api_calls=api_calls))
+            
+            for name, offset, duration, nbytes, calls in record["spans"] :
+                rows.append(dict(invocation, span=name, offset_ms=offset, duration_ms=duration, bytes=nbytes, api_calls=calls))
+            
+            for service, (calls, duration, nbytes) in record["api"].items() :
+                rows.append(dict(invocation, span=f"api:{service}", offset_ms=None, duration_ms=duration, bytes=nbytes, api_calls=calls))
+        
+        return pd.DataFrame(rows, columns=["stage", "start", "invocations", "span", "offset_ms", "duration_ms",
+                                           "bytes", "api_calls", "peak_mb", "rss_mb"])
+    
+    ## Instances the init stage planned for each stage, from the "resource-plan" section of the
+    ## workflow payload, with the dataset they were sized to and the reason for the choice.
+    def get_resource_plan(self, run_id) :
+
+        exec_details = self.client.describe_execution(executionArn=run_id)
+        status = exec_details["status"] if "status" in exec_details else "UNKNOWN"
+        
+        if status != "SUCCEEDED" :
+            raise Exception(f"{run_id} must have a SUCCEEDED status. Status is {status}.")
+        
+        output = json.loads(exec_details["output"])
+        payload = (output[0] if isinstance(output, list) else output).get("Payload", {})
+
+        plan = payload.get("resource-plan")
+        if not plan :
+            raise Exception(f"{run_id} has no resource plan. Set instance_type or instance_count to \"auto\" to plan them.")
+
+        rows = []
+        for stage, choice in plan["stages"].items() :
+            dataset = plan["datasets"][choice["dataset"]]
+            rows.append({"stage": stage,
+                         "instance_type": choice["instance_type"],
+                         "instance_count": choice["instance_count"],
+                         "dataset": choice["dataset"],
+                         "dataset_mb": choice["dataset_mb"],
+                         "objects": dataset["objects"],
+                         "estimated_size": dataset["estimated"],
+                         "memory_gb": choice["memory_gb"],
+                         "estimated_seconds": choice["estimated_seconds"],
+                         "within_target": choice["estimated_seconds"] <= plan["target_seconds"],
+                         "reason": choice["reason"]})
+
+        return pd.DataFrame(rows)
+
+    def _get_history(self, run_id) :
+        
+        events = []
+        kwargs = {  "executionArn": run_id,
+                    "maxResults": BPRunner.HISTORY_PAGE_SIZE,
+                    "includeExecutionData": False}
+        
+        while True :
+            page = self.client.get_execution_history(**kwargs)
+            events += page["events"]
+            if "nextToken" not in page :
+                return events
+            kwargs["nextToken"] = page["nextToken"]
+    
     @classmethod
-    def _get_merged_df(cls, bucket, prefix, s3_client, show_header=True, has_header=True, maxkeys=10) :
+    def _map_branches(cls, states, branch="main", parallel=None, branches=None) :
+        
+        ## Maps every state to the branch it runs in. Branches of Parallel states are named
+        ## after their first state.
+        branches = {} if branches is None else branches
+        for name, state in states.items() :
+            branches[name] = (branch, parallel)
+            for b in state.get("Branches", []) :
+                cls._map_branches(b["States"], b["StartAt"], name, branches)
+                
+        return branches
+    
+    def _get_timeline(self, events, branches) :
         
-        files = []
-        skip = 0
-        kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': maxkeys}
-        resp = s3_client.list_objects_v2(**kwargs)
+        ## Every visit of a state, from the time it was entered to the time it exited. Choice,
+        ## Wait and Pass states are attributed to the last Task state of their branch, so that a
+        ## job status polling loop adds up to a single stage.
+        visits = []
+        entered = {}
+        current = {}
         
-        for obj in resp['Contents'] :
+        for e in events :
             
-            if has_header and not show_header :
-                skip = 1
+            if "stateEnteredEventDetails" in e :
+                name = e["stateEnteredEventDetails"]["name"]
+                state_type = e["type"][:-len("StateEntered")]
+                branch, parallel = branches.get(name, ("main", None))
                 
-            if has_header and show_header :
-                files.append(pd.read_csv("s3://{}/{}".format(bucket, obj["Key"])))
-            else :
-                files.append(pd.read_csv("s3://{}/{}".format(bucket, obj["Key"]), skiprows=skip, header=None))
+                if state_type in ("Task", "Parallel", "Map") or branch not in current :
+                    current[branch] = name
+                    
+                entered[name] = {   "state": name,
+                                    "type": state_type,
+                                    "stage": current[branch],
+                                    "branch": branch,
+                                    "parallel": parallel,
+                                    "entered": pd.Timestamp(e["timestamp"]),
+                                    "exited": None,
+                                    "seconds": None}
+                visits.append(entered[name])
                 
-        df = pd.concat(files)
-
-        return df
+            elif "stateExitedEventDetails" in e :
+                name = e["stateExitedEventDetails"]["name"]
+                # states still running, or that failed, have no exit event
+                if name in entered :
+                    visit = entered.pop(name)
+                    visit["exited"] = pd.Timestamp(e["timestamp"])
+                    visit["seconds"] = (visit["exited"] - visit["entered"]).total_seconds()
+        
+        return pd.DataFrame(visits, columns=["state", "type", "stage", "branch", "parallel", "entered", "exited", "seconds"])
+    
+    @classmethod
+    def _find_job_name(cls, outputs, path) :
+        
+        for payload in outputs :
+            value = payload
+            for key in path :
+                value = value.get(key) if isinstance(value, dict) else None
+            if value :
+                return value
+    
+    def _describe_job(self, job_type, job_name) :
+        
+        ## Start, end, instances and instance-hours of a job. The instance-hours of an AutoML
+        ## job are estimated from its candidates' run times, with one instance per candidate.
+        if job_type == "processing" :
+            desc = self.ml.describe_processing_job(ProcessingJobName=job_name)
+            cluster = desc.get("ProcessingResources", {}).get("ClusterConfig", {})
+            started, ended = desc.get("ProcessingStartTime"), desc.get("ProcessingEndTime")
+            instance_type, instance_count = cluster.get("InstanceType"), cluster.get("InstanceCount", 1)
+            
+        elif job_type == "transform" :
+            desc = self.ml.describe_transform_job(TransformJobName=job_name)
+            resources = desc.get("TransformResources", {})
+            started, ended = desc.get("TransformStartTime"), desc.get("TransformEndTime")
+            instance_type, instance_count = resources.get("InstanceType"), resources.get("InstanceCount", 1)
+            
+        else :
+            desc = self.ml.describe_auto_ml_job(AutoMLJobName=job_name)
+            candidates = []
+            kwargs = {"AutoMLJobName": job_name, "MaxResults": 100}
+            while True :
+                page = self.ml.list_candidates_for_auto_ml_job(**kwargs)
+                candidates += page["Candidates"]
+                if "NextToken" not in page :
+                    break
+                kwargs["NextToken"] = page["NextToken"]
+                
+            # the job analyzes the data before the first candidate and finalizes after the last
+            started = min([c["CreationTime"] for c in candidates], default=None)
+            ended = desc.get("EndTime")
+            candidate_seconds = sum((pd.Timestamp(c["EndTime"]) - pd.Timestamp(c["CreationTime"])).total_seconds()
+                                    for c in candidates if "EndTime" in c)
+            instance_type, instance_count = None, len(candidates)
+        
+        job = { "job_type": job_type,
+                "job_name": job_name,
+                "created": pd.Timestamp(desc["CreationTime"]),
+                "started": pd.Timestamp(started) if started else None,
+                "ended": pd.Timestamp(ended) if ended else None,
+                "instance_type": instance_type,
+                "instance_count": instance_count}
+        
+        if job_type == "automl" :
+            job["instance_hours"] = candidate_seconds / 3600
+        elif job["started"] is not None and job["ended"] is not None :
+            job["instance_hours"] = (job["ended"] - job["started"]).total_seconds() * instance_count / 3600
+        else :
+            job["instance_hours"] = None
+            
+        return job
+    
+    ## Rebuilds the timeline of a run from the Step Functions history and the descriptions of
+    ## the SageMaker jobs it ran. Each stage is broken down into the time to submit its job,
+    ## the job's queueing and instance startup, its run time and the time the workflow took to
+    ## detect the end of the job. Returns the timeline of every state visit, a DataFrame of
+    ## stages with the critical path through the Parallel states flagged, the critical path
+    ## and its longest stage.
+    def profile_execution(self, run_id) :
+        
+        exec_details = self.client.describe_execution(executionArn=run_id)
+        definition = json.loads(self.client.describe_state_machine(stateMachineArn=exec_details["stateMachineArn"])["definition"])
+        
+        branches = self._map_branches(definition["States"])
+        timeline = self._get_timeline(self._get_history(run_id), branches)
+        
+        outputs = []
+        if "output" in exec_details and exec_details["output"] :
+            output = json.loads(exec_details["output"])
+            for branch in output if isinstance(output, list) else [output] :
+                outputs += [branch.get("taskresult", {}).get("Payload", {}), branch.get("Payload", {})]
+        
+        rows = []
+        groups = timeline.assign(parallel=timeline["parallel"].fillna(""))
+        for (stage, branch, parallel), visits in groups.groupby(["stage", "branch", "parallel"], sort=False) :
+            
+            row = { "stage": stage,
+                    "branch": branch,
+                    "parallel": parallel if parallel else None,
+                    "start": visits["entered"].min(),
+                    "end": visits["exited"].max(),
+                    "invocations": int((visits["state"] == stage).sum()),
+                    "task_seconds": visits.loc[visits["type"] == "Task", "seconds"].sum(),
+                    "wait_seconds": visits.loc[visits["type"] == "Wait", "seconds"].sum()}
+            row["wall_seconds"] = (row["end"] - row["start"]).total_seconds() if pd.notnull(row["end"]) else None
+            
+            job_type, path = BPRunner.JOB_STAGES.get(stage, (None, None))
+            job_name = self._find_job_name(outputs, path) if job_type else None
+            if job_name :
+                job = self._describe_job(job_type, job_name)
+                
+                # a job from an earlier run, reused from a cache, cost nothing in this one
+                job["reused"] = job["created"] < pd.Timestamp(exec_details["startDate"])
+                if not job["reused"] :
+                    job["submit_seconds"] = (job["created"] - row["start"]).total_seconds()
+                    if job["started"] is not None :
+                        job["startup_seconds"] = (job["started"] - job["created"]).total_seconds()
+                    if job["ended"] is not None and job["started"] is not None :
+                        job["run_seconds"] = (job["ended"] - job["started"]).total_seconds()
+                    if job["ended"] is not None and pd.notnull(row["end"]) :
+                        job["detect_seconds"] = (row["end"] - job["ended"]).total_seconds()
+                else :
+                    job["instance_hours"] = 0.0
+                row.update({k: v for k, v in job.items() if k not in ("created", "started", "ended")})
+            
+            rows.append(row)
+        
+        stages = pd.DataFrame(rows, columns=["stage", "branch", "parallel", "start", "end", "wall_seconds", "invocations",
+                                             "task_seconds", "wait_seconds", "job_type", "job_name", "reused",
+                                             "instance_type", "instance_count", "submit_seconds", "startup_seconds",
+                                             "run_seconds", "detect_seconds", "instance_hours"])
+        
+        ## The branch of a Parallel state that finishes last is on the critical path; the other
+        ## branches have the slack of how much earlier they finish.
+        stages["critical"] = stages["branch"] == "main"
+        stages["slack_seconds"] = 0.0
+        critical_path = []
+        for stage in stages.loc[stages["branch"] == "main", "stage"] :
+            
+            in_parallel = stages["parallel"] == stage
+            if not in_parallel.any() :
+                critical_path.append(stage)
+                continue
+            
+            branch_end = stages[in_parallel].groupby("branch")["end"].max()
+            critical_branch = branch_end.idxmax()
+            slack = (branch_end.max() - branch_end).dt.total_seconds()
+            
+            stages.loc[in_parallel, "slack_seconds"] = stages.loc[in_parallel, "branch"].map(slack)
+            stages.loc[in_parallel, "critical"] = stages.loc[in_parallel, "branch"] == critical_branch
+            critical_path += stages.loc[in_parallel & (stages["branch"] == critical_branch), "stage"].tolist()
+        
+        on_path = stages[stages["critical"] & stages["stage"].isin(critical_path)]
+        bottleneck = on_path.loc[on_path["wall_seconds"].idxmax(), "stage"] if on_path["wall_seconds"].notnull().any() else None
+        
+        return {"timeline": timeline, "stages": stages, "critical_path": critical_path, "bottleneck": bottleneck}
+    
+    ## maxkeys is no longer used: the reader paginates over every shard under the prefix.
+    @classmethod
+    def _get_merged_df(cls, bucket, prefix, s3_client, show_header=True, has_header=True, maxkeys=None,
+                       data_format="csv", columns=None) :
+        
+        reader = ShardReader(s3_client)
+        
+        # Parquet files always carry their schema
+        if data_format == "parquet" or (has_header and show_header) :
+            return reader.read_merged_df(bucket, prefix, data_format=data_format, columns=columns)
+        
+        skip = 1 if has_header else 0
+        return reader.read_merged_df(bucket, prefix, columns=columns, skiprows=skip, header=None)
 
-    def get_prepped_data_df(self, run_id, has_header=True, maxkeys=10) :
+    ## The prepped data, in the format Data Wrangler wrote it in. columns selects the columns
+    ## to read, by name, or by position for CSV without a header.
+    def get_prepped_data_df(self, run_id, has_header=True, maxkeys=10, columns=None) :
         
         exec_details = self.client.describe_execution(executionArn=run_id)
         status = exec_details["status"] if "status" in exec_details else "UNKNOWN"
@@ -137,7 +432,9 @@ class BPRunner :
         if status != "SUCCEEDED" :
             raise Exception(f"{run_id} must have a SUCCEEDED status. Status is {status}.")     
         
-        data_uri = json.loads(exec_details["output"])[0]["Payload"]["automl-config"]["data_uri"]   
+        payload = json.loads(exec_details["output"])[0]["Payload"]
+        data_uri = payload["automl-config"]["data_uri"]
+        data_format = payload["dataprep-config"].get("output_format", "csv").lower()
         
         parsed = urlparse(data_uri, allow_fragments=False)
         if parsed.query:
@@ -145,7 +442,8 @@ class BPRunner :
         else:
             prefix= parsed.path.lstrip('/')
 
-        return self._get_merged_df(parsed.netloc, prefix, self.db, has_header, maxkeys)
+        return self._get_merged_df(parsed.netloc, prefix, self.db, has_header=has_header,
+                                   data_format=data_format, columns=columns)
         
         
 class SFNMonitor() :
@@ -153,6 +451,8 @@ class SFNMonitor() :
     PAGINATION_SIZE = 100
     TIMEOUT = 10800
     POLL_RATE = 30
+    
+    NESTED_STATE_TYPES = {"Parallel", "Map"}
 
     def __init__(self, timeout=None, n_wait=None, client = None) :
         
@@ -161,153 +461,165 @@ class SFNMonitor() :
         self.sfn = boto3.client("stepfunctions") if not client else client
             
     def _update_progress(self, pb, unit=1) :
-
         pb.update(unit)
-        sleep(0.5)
     
     def _wf_failed(self, status) :
         failed_states = {'FAILED','TIMED_OUT','ABORTED'}
         return (status in failed_states)
-
-    def _monitor_parallel_process(self, execution_arn, lookup, parent_pb) :
     
-        completed = 0
-
-        start = time()
+    @classmethod
+    def _follow(cls, states, name, seen) :
+        
+        ## The chain of states from name up to the next Choice or end. It is a loop when it
+        ## leads back into a state that was already visited.
+        chain = []
+        while name and name not in seen and name not in chain :
+            chain.append(name)
+            if states[name]["Type"] == "Choice" :
+                return chain, False
+            name = states[name].get("Next")
+            
+        return chain, name in seen
+    
+    @classmethod
+    def _count_states(cls, states, start, seen=None) :
+        
+        ## States a successful execution exits, each counted once like the monitor does: Fail
+        ## states are left out, the states of a status polling loop are counted, and of the
+        ## other targets of a Choice, which exclude each other, only the first is followed.
+        seen = seen if seen is not None else set()
+        count = 0
+        name = start
+        while name and name not in seen :
+            
+            seen.add(name)
+            state = states[name]
+            count += 1
+            for branch in state.get("Branches", []) :
+                count += cls._count_states(branch["States"], branch["StartAt"])
+            if "Iterator" in state :
+                count += cls._count_states(state["Iterator"]["States"], state["Iterator"]["StartAt"])
+            
+            if state["Type"] != "Choice" :
+                name = state.get("Next")
+                continue
+                
+            name = None
+            targets = [choice["Next"] for choice in state["Choices"]] + [state.get("Default")]
+            for target in targets :
+                if not target or target in seen or states[target]["Type"] == "Fail" :
+                    continue
+                chain, loop = cls._follow(states, target, seen)
+                if loop :
+                    seen.update(chain)
+                    count += len(chain)
+                elif not name :
+                    name = target
+            
+        return count
+    
+    def get_n_stages(self, execution_arn) :
+        
+        sm_arn = self.sfn.describe_execution(executionArn=execution_arn)["stateMachineArn"]
+        definition = json.loads(self.sfn.describe_state_machine(stateMachineArn=sm_arn)["definition"])
+        return self._count_states(definition["States"], definition["StartAt"])
+    
+    def _get_new_events(self, execution_arn, last_event_id) :
+        
+        ## The history API can't resume from an event id, so page backwards from the newest
+        ## event and stop at the first one that has already been processed. Each poll only
+        ## fetches the events that were added since the previous poll.
+        events = []
+        kwargs = {  "executionArn": execution_arn,
+                    "maxResults": SFNMonitor.PAGINATION_SIZE,
+                    "reverseOrder": True,
+                    "includeExecutionData": False}
+        
         while True :
-
-            status = self.sfn.describe_execution(executionArn=execution_arn)["status"]
-            if self._wf_failed(status) :
-                parent_pb.leave=True
-                return;
-
-            events = self.sfn.get_execution_history(
-                                    executionArn=execution_arn,
-                                    maxResults=200,
-                                    reverseOrder=False,
-                                    includeExecutionData=False)["events"]
-
-            for e in events :
-
-                if "stateEnteredEventDetails" in e :
-                    state = e["stateEnteredEventDetails"]["name"]
-                    transition= e["type"]
-
-                    #print(f"state entered: {state} status: {transition}")
-
-                    if state not in lookup :
-
-                        if transition != "ParallelStateEntered" :
-                            child_pb = trange(1, desc=f">> Parallel Stage: {state}")
-                            lookup[state] = child_pb
-                        else :
-                            lookup[state] = 1
-                            ntasks = self._monitor_parallel_process(execution_arn, lookup, parent_pb)
-                            completed += ntasks
-
-                if "stateExitedEventDetails" in e :
-                    state = e["stateExitedEventDetails"]["name"]
-                    transition = e["type"]
-
-                    #print(f"state exited: {state} status: {transition}")
-
-                    assert state in lookup
-
-                    if lookup[state] :
-                        completed+=1
-                        self._update_progress(parent_pb)
-
-                        if transition != "ParallelStateExited" :
-                            self._update_progress(lookup[state])
-                            lookup[state] = 0
-                        else :
-                            lookup[state] = 0
-                            return completed
-
-            if time() - start > self.timeout :
-                parent_pb.leave = True
+            
+            exec_hist = self.sfn.get_execution_history(**kwargs)
+            for e in exec_hist["events"] :
+                if e["id"] <= last_event_id :
+                    return events[::-1]
+                events.append(e)
+                
+            if "nextToken" not in exec_hist :
                 break
+            kwargs["nextToken"] = exec_hist["nextToken"]
+            
+        return events[::-1]
+    
+    def _process_event(self, e, lookup, nested, main_pb) :
+        
+        ## Nested Parallel/Map states are tracked from the same event stream. States entered
+        ## while a nested state is active get their own progress bar.
+        transition = e["type"]
+        
+        if "stateEnteredEventDetails" in e :
+            state = e["stateEnteredEventDetails"]["name"]
+            
+            if state not in lookup :
+                
+                if nested and transition == "TaskStateEntered" :
+                    lookup[state] = tqdm_notebook.trange(1, desc=f">> Parallel Stage: {state}")
+                else :
+                    lookup[state] = True
+                    main_pb.desc = f"Currently in the workflow stage: {state}"
+                    
+            if transition[:-len("StateEntered")] in SFNMonitor.NESTED_STATE_TYPES :
+                nested.append(state)
+                
+            return 0
 
-            sleep(self.n_wait)
-
-        return completed
+        if "stateExitedEventDetails" in e :
+            state = e["stateExitedEventDetails"]["name"]
+            
+            if transition[:-len("StateExited")] in SFNMonitor.NESTED_STATE_TYPES and state in nested :
+                nested.remove(state)
+            
+            # states that are re-entered, such as job status polling loops, are counted once
+            if lookup.get(state) :
+                
+                if lookup[state] is not True :
+                    self._update_progress(lookup[state])
+                    
+                lookup[state] = False
+                self._update_progress(main_pb)
+                return 1
+            
+        return 0
 
-    def run(self, execution_arn, n_stages) :
+    def run(self, execution_arn, n_stages=None) :
+        
+        if not n_stages :
+            n_stages = self.get_n_stages(execution_arn)
         
-        lookup= {}
+        lookup = {}
+        nested = []
         completed = 0
-        main_pb = trange(n_stages+1, desc="Workflow Initiated")
+        last_event_id = 0
+        main_pb = tqdm_notebook.trange(n_stages+1, desc="Workflow Initiated")
 
         start = time()
         while True :
 
             status = self.sfn.describe_execution(executionArn=execution_arn)["status"]
+            
+            for e in self._get_new_events(execution_arn, last_event_id) :
+                completed += self._process_event(e, lookup, nested, main_pb)
+                last_event_id = e["id"]
+                
             if self._wf_failed(status) :
                 main_pb.leave=True
                 raise Exception(f"Workflow execution {status}.")
-
-            exec_hist = self.sfn.get_execution_history(
-                                executionArn=execution_arn,
-                                maxResults=SFNMonitor.PAGINATION_SIZE,
-                                reverseOrder=False,
-                                includeExecutionData=False)
-            
-            events = exec_hist["events"]
-
-            while True :
-                
-                for e in events :
-
-                    if "stateEnteredEventDetails" in e :
-                        state = e["stateEnteredEventDetails"]["name"]
-                        transition= e["type"]
-
-                        #print(f"state entered: {state} status: {transition}")
-
-                        if state not in lookup :
-
-                            lookup[state] = 1
-                            main_pb.desc = f"Currently in the workflow stage: {state}"
-
-                            if transition == "ParallelStateEntered" :
-                                ntasks = self._monitor_parallel_process(execution_arn, lookup, main_pb)
-                                completed += ntasks
-
-                    if "stateExitedEventDetails" in e :
-                        state = e["stateExitedEventDetails"]["name"]
-                        transition = e["type"]
-
-                        #print(f"state exited: {state} status: {transition}")
-
-                        assert (state in lookup)
-
-                        if lookup[state] :
-
-                            if transition != "ParallelStateExited" :
-                                self._update_progress(main_pb)
-                                lookup[state] = 0
-                                completed+=1
-                            else :
-                                assert not lookup[state]
                                 
-                if "nextToken" not in exec_hist :
-                    break
+            if status == "SUCCEEDED" or completed >= n_stages :
+                main_pb.desc = f"Workflow Completed"
+                self._update_progress(main_pb, main_pb.total - main_pb.n)
+                break
                 
-                next_token = exec_hist["nextToken"]
-                exec_hist = self.sfn.get_execution_history(
-                                    executionArn=execution_arn,
-                                    maxResults=SFNMonitor.PAGINATION_SIZE,
-                                    reverseOrder=False,
-                                    includeExecutionData=False,
-                                    nextToken = next_token) 
-                                
             if time() - start > self.timeout :
                 main_pb.leave = True
                 break
-
-            if completed >= n_stages :
-                main_pb.desc = f"Workflow Completed"
-                self._update_progress(main_pb)
-                break
-            else :
-                sleep(self.n_wait) 
\ No newline at end of file
+            
+            sleep(self.n_wait)